@@ -1,7 +1,61 @@
+from app.genie_client import get_genie_client
+from app.polling import BackoffSchedule, server_push_mode, read_sse_result, PUSH_MODE_LONG_POLL, PUSH_MODE_SSE
 from app.slack_ops import post_wip_message, post_wip_message_with_attachment
-from app.utils import DEFAULT_LOADING_TEXT, fetch_data_from_genieapi
+from app.tracing import traced, set_attributes
+from app.utils import DEFAULT_LOADING_TEXT, fetch_data_from_genieapi, build_genieapi_params
 
+# How long to wait for a submitted question to reach the "processing_sql" status
+PROCESSING_START_MAX_WAIT_SECONDS = 40
 
+
+def wait_for_language_to_sql_result(
+        api_key,
+        chat_history_id,
+        chat_history_size,
+        experimental_features,
+        push,
+        client,
+        channel,
+        thread_ts,
+        logger,
+):
+    if push is not None and push["mode"] == PUSH_MODE_SSE:
+        params = build_genieapi_params(
+            id=chat_history_id,
+            chat_history_size=chat_history_size,
+            experimental_features=experimental_features,
+        )
+        try:
+            result = read_sse_result(
+                get_genie_client(),
+                push.get("endpoint", "/language_to_sql_process"),
+                api_key,
+                params=params,
+            )
+            if result is not None:
+                return result
+        except Exception as e:
+            logger.exception(f"wait_for_language_to_sql_result, SSE failed, falling back to polling, error={e}")
+
+    long_poll_seconds = None
+    if push is not None and push["mode"] == PUSH_MODE_LONG_POLL:
+        long_poll_seconds = push.get("wait_seconds")
+
+    return fetch_data_from_genieapi(
+        api_key=api_key,
+        endpoint="/language_to_sql_process",
+        id=chat_history_id,
+        chat_history_size=chat_history_size,
+        experimental_features=experimental_features,
+        client=client,
+        channel=channel,
+        thread_ts=thread_ts,
+        poll_schedule=BackoffSchedule(),
+        long_poll_seconds=long_poll_seconds,
+    )
+
+
+@traced()
 def get_language_to_sql(context, client, payload, messages, logger, text_query):
     api_key = context.get("api_key")
     db_table = context.get("db_table")
@@ -17,6 +71,7 @@ def get_language_to_sql(context, client, payload, messages, logger, text_query):
     db_warehouse = context.get("db_warehouse")
     is_in_dm_with_bot = payload.get("channel_type") == "im"
     user_id = context.actor_user_id or context.user_id
+    set_attributes(team_id=context.team_id, channel=context.channel_id, thread_ts=payload["ts"])
 
     post_wip_message(
         client=client,
@@ -49,6 +104,7 @@ def get_language_to_sql(context, client, payload, messages, logger, text_query):
     )
 
     chat_history_id = initial_request.get("chat_history_id", None)
+    set_attributes(chat_history_id=chat_history_id)
 
     client.chat_postMessage(
         channel=context.channel_id,
@@ -62,23 +118,23 @@ def get_language_to_sql(context, client, payload, messages, logger, text_query):
         id=chat_history_id,
         chat_history_size=chat_history_size,
         experimental_features=experimental_features,
+        poll_schedule=BackoffSchedule(max_wait=PROCESSING_START_MAX_WAIT_SECONDS),
     )
 
     processing_sql_status = processing_sql.get("status", None)
     if processing_sql_status != "processing_sql":
         raise Exception("Max retries reached without a successful response")
 
-    processing_sql = fetch_data_from_genieapi(
+    processing_sql = wait_for_language_to_sql_result(
         api_key=api_key,
-        endpoint="/language_to_sql_process",
-        id=chat_history_id,
+        chat_history_id=chat_history_id,
         chat_history_size=chat_history_size,
         experimental_features=experimental_features,
+        push=server_push_mode(initial_request),
         client=client,
         channel=context.channel_id,
         thread_ts=payload["ts"],
-        MAX_RETRIES=30,
-        DELAY_FACTOR=0,
+        logger=logger,
     )
 
     post_wip_message_with_attachment(
@@ -102,8 +158,7 @@ def get_language_to_sql(context, client, payload, messages, logger, text_query):
         user_id=context.user_id,
         execute_sql=True,
         is_generate_code=True,
-        MAX_RETRIES=30,
-        DELAY_FACTOR=0
+        poll_schedule=BackoffSchedule(),
     )
     post_wip_message_with_attachment(
         client=client,
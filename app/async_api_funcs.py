@@ -0,0 +1,152 @@
+from slack_sdk.web.async_client import AsyncWebClient
+
+from app.api_funcs import PROCESSING_START_MAX_WAIT_SECONDS
+from app.async_genie_client import async_fetch_data_from_genieapi
+from app.polling import BackoffSchedule, server_push_mode, PUSH_MODE_LONG_POLL
+from app.slack_ops import async_post_wip_message, async_post_wip_message_with_attachment
+from app.tracing import traced, set_attributes
+from app.utils import DEFAULT_LOADING_TEXT
+
+
+async def async_wait_for_language_to_sql_result(
+        api_key,
+        chat_history_id,
+        chat_history_size,
+        experimental_features,
+        push,
+        client: AsyncWebClient,
+        channel,
+        thread_ts,
+):
+    # SSE is not wired up on this path; long-poll covers it without holding a thread per question
+    long_poll_seconds = None
+    if push is not None and push["mode"] == PUSH_MODE_LONG_POLL:
+        long_poll_seconds = push.get("wait_seconds")
+
+    return await async_fetch_data_from_genieapi(
+        api_key=api_key,
+        endpoint="/language_to_sql_process",
+        id=chat_history_id,
+        chat_history_size=chat_history_size,
+        experimental_features=experimental_features,
+        client=client,
+        channel=channel,
+        thread_ts=thread_ts,
+        poll_schedule=BackoffSchedule(),
+        long_poll_seconds=long_poll_seconds,
+    )
+
+
+@traced()
+async def async_get_language_to_sql(context, client: AsyncWebClient, payload, messages, logger, text_query):
+    """asyncio counterpart of get_language_to_sql."""
+    api_key = context.get("api_key")
+    db_table = context.get("db_table")
+
+    table_name = context.get("db_table")
+    db_url = context.get("db_url")
+    db_schema = context.get("db_schema")
+    ai_engine = context.get("ai_engine")
+    ai_model = context.get("ai_model")
+    ai_temp = context.get("ai_temp")
+    experimental_features = context.get("experimental_features")
+    chat_history_size = context.get("chat_history_size")
+    db_warehouse = context.get("db_warehouse")
+    user_id = context.actor_user_id or context.user_id
+    set_attributes(team_id=context.team_id, channel=context.channel_id, thread_ts=payload["ts"])
+
+    await async_post_wip_message(
+        client=client,
+        channel=context.channel_id,
+        thread_ts=payload["ts"],
+        loading_text=DEFAULT_LOADING_TEXT + f" db_url={db_url}, db_table={db_table}, db_schema={db_schema}, ai_engine={ai_engine}, experimental_features={experimental_features}",
+        messages=messages,
+        user=context.user_id,
+    )
+
+    logger.info(
+        f"async_get_language_to_sql, db_url={db_url}, table_name={table_name}, text_query={text_query}, chat_history_size={chat_history_size}")
+
+    initial_request = await async_fetch_data_from_genieapi(
+        api_key=api_key,
+        endpoint="/language_to_sql",
+        text_query=text_query,
+        table_name=table_name,
+        resourcename=db_url,
+        chat_history_size=chat_history_size,
+        team_id=context.team_id,
+        user_id=context.user_id,
+        db_schema=db_schema,
+        ai_engine=ai_engine,
+        ai_model=ai_model,
+        ai_temp=ai_temp,
+        execute_sql=False,
+        experimental_features=experimental_features,
+        db_warehouse=db_warehouse
+    )
+
+    chat_history_id = initial_request.get("chat_history_id", None)
+    set_attributes(chat_history_id=chat_history_id)
+
+    await client.chat_postMessage(
+        channel=context.channel_id,
+        thread_ts=payload["ts"],
+        text=f"Genie is processing your request, id={chat_history_id}",
+    )
+
+    processing_sql = await async_fetch_data_from_genieapi(
+        api_key=api_key,
+        endpoint="/language_to_sql_process",
+        id=chat_history_id,
+        chat_history_size=chat_history_size,
+        experimental_features=experimental_features,
+        poll_schedule=BackoffSchedule(max_wait=PROCESSING_START_MAX_WAIT_SECONDS),
+    )
+
+    processing_sql_status = processing_sql.get("status", None)
+    if processing_sql_status != "processing_sql":
+        raise Exception("Max retries reached without a successful response")
+
+    processing_sql = await async_wait_for_language_to_sql_result(
+        api_key=api_key,
+        chat_history_id=chat_history_id,
+        chat_history_size=chat_history_size,
+        experimental_features=experimental_features,
+        push=server_push_mode(initial_request),
+        client=client,
+        channel=context.channel_id,
+        thread_ts=payload["ts"],
+    )
+
+    await async_post_wip_message_with_attachment(
+        client=client,
+        channel=context.channel_id,
+        thread_ts=payload["ts"],
+        loading_text=processing_sql,
+        messages=messages,
+        user=user_id,
+        context=context,
+    )
+    status = processing_sql.get("status", "")
+    if status == 3:
+        raise Exception("Max retries reached without a successful response")
+
+    loading_text = await async_fetch_data_from_genieapi(
+        api_key=api_key,
+        endpoint="/get_my_chat_history",
+        id=chat_history_id,
+        team_id=context.team_id,
+        user_id=context.user_id,
+        execute_sql=True,
+        is_generate_code=True,
+        poll_schedule=BackoffSchedule(),
+    )
+    await async_post_wip_message_with_attachment(
+        client=client,
+        channel=context.channel_id,
+        thread_ts=payload["ts"],
+        loading_text=loading_text,
+        messages=messages,
+        user=user_id,
+        context=context,
+    )
@@ -0,0 +1,237 @@
+import logging
+from typing import Optional
+
+from slack_bolt import BoltResponse
+from slack_bolt.async_app import AsyncApp, AsyncAck, AsyncBoltContext
+from slack_sdk.web.async_client import AsyncWebClient
+
+from app.async_api_funcs import async_get_language_to_sql
+from app.bolt_listeners import (
+    error_reply_text,
+    append_mention_message,
+    append_mention_thread_messages,
+    dm_history_token_budget,
+    dm_message_num_tokens,
+    find_message_by_ts,
+    build_thread_messages,
+    is_skippable_event,
+)
+from app.env import (
+    SYSTEM_TEXT,
+    TRANSLATE_MARKDOWN,
+)
+from app.idempotency import is_duplicate_event, retry_num, retry_reason
+from app.metrics import SLACK_DUPLICATE_EVENTS
+from app.openai_ops import build_system_text
+from app.slack_history import (
+    async_fetch_thread_messages,
+    thread_history_cache,
+    parent_mention_memo,
+    async_iter_dm_history,
+    async_take_within_budget,
+)
+from app.slack_ops import is_no_mention_thread
+from app.utils import DEFAULT_ERROR_TEXT_ERR
+
+
+#
+# asyncio counterparts of the listener functions in app/bolt_listeners.py
+#
+
+
+async def async_just_ack(ack: AsyncAck):
+    await ack()
+
+
+async def async_find_parent_message(
+        client: AsyncWebClient, channel_id: Optional[str], thread_ts: Optional[str]
+) -> Optional[dict]:
+    if channel_id is None or thread_ts is None:
+        return None
+
+    messages = (await client.conversations_history(
+        channel=channel_id,
+        latest=thread_ts,
+        limit=1,
+        inclusive=1,
+    )).get("messages", [])
+
+    return messages[0] if len(messages) > 0 else None
+
+
+async def async_parent_mentions_bot(
+        context: AsyncBoltContext,
+        client: AsyncWebClient,
+        thread_ts: str,
+        messages_in_context: Optional[list] = None,
+) -> Optional[bool]:
+    mentioned = parent_mention_memo.get(context.channel_id, thread_ts)
+    if mentioned is None:
+        parent_message = find_message_by_ts(messages_in_context or [], thread_ts)
+        if parent_message is None:
+            parent_message = await async_find_parent_message(client, context.channel_id, thread_ts)
+        if parent_message is None:
+            return None
+        mentioned = is_no_mention_thread(context, parent_message)
+        parent_mention_memo.put(context.channel_id, thread_ts, mentioned)
+    return mentioned
+
+
+async def async_respond_to_app_mention(
+        context: AsyncBoltContext,
+        payload: dict,
+        client: AsyncWebClient,
+        logger: logging.Logger,
+):
+    if payload.get("thread_ts") is not None:
+        if await async_parent_mentions_bot(context, client, payload.get("thread_ts")):
+            # The message event handler will reply to this
+            return
+    else:
+        # This message may become the parent of a thread
+        parent_mention_memo.put(context.channel_id, payload.get("ts"), is_no_mention_thread(context, payload))
+
+    # Replace placeholder for Slack user ID in the system prompt
+    system_text = build_system_text(SYSTEM_TEXT, TRANSLATE_MARKDOWN, context)
+    messages = [{"role": "system", "content": system_text}]
+
+    api_key = context.get("api_key")
+    is_in_dm_with_bot = payload.get("channel_type") == "im"
+
+    try:
+        if api_key is None:
+            await client.chat_postMessage(
+                channel=context.channel_id,
+                text="To use this app, please configure your Genie API key first",
+            )
+            return
+
+        user_id = context.actor_user_id or context.user_id
+
+        if payload.get("thread_ts") is not None:
+            # Mentioning the bot user in a thread
+            replies_in_thread = await async_fetch_thread_messages(
+                client, context.channel_id, payload.get("thread_ts"), latest_message=payload
+            )
+            last_message = append_mention_thread_messages(context, messages, replies_in_thread)
+
+        else:
+            last_message = append_mention_message(context, messages, user_id, payload["text"])
+
+        await async_get_language_to_sql(
+            context=context,
+            client=client,
+            payload=payload,
+            messages=messages,
+            logger=logger,
+            text_query=last_message,
+        )
+
+    except Exception as e:
+        logger.exception(f"async_bolt_listeners.py, {type(e).__name__}, Failed to process request: {e}")
+        await client.chat_postMessage(
+            channel=context.channel_id,
+            thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
+            text=error_reply_text(e),
+        )
+
+
+async def async_respond_to_new_message(
+        context: AsyncBoltContext,
+        payload: dict,
+        client: AsyncWebClient,
+        logger: logging.Logger,
+):
+    if payload.get("bot_id") is not None and payload.get("bot_id") != context.bot_id:
+        # Skip a new message by a different app
+        return
+
+    is_in_dm_with_bot = payload.get("channel_type") == "im"
+    try:
+        is_no_mention_required = False
+        thread_ts = payload.get("thread_ts")
+        if is_in_dm_with_bot is False and thread_ts is None:
+            # This message may become the parent of a thread
+            parent_mention_memo.put(context.channel_id, payload.get("ts"), is_no_mention_thread(context, payload))
+            return
+
+        api_key = context.get("api_key")
+        if api_key is None:
+            return
+
+        if is_in_dm_with_bot is True and thread_ts is None:
+            # In the DM with the bot
+            # Only the messages of the last day that fit in the context window
+            messages_in_context = await async_take_within_budget(
+                async_iter_dm_history(client, context.channel_id),
+                dm_history_token_budget(context),
+                dm_message_num_tokens(context),
+            )
+            is_no_mention_required = True
+        else:
+            # In a thread with the bot in a channel
+            messages_in_context = await async_fetch_thread_messages(
+                client, context.channel_id, thread_ts, latest_message=payload
+            )
+            if is_in_dm_with_bot is True:
+                is_no_mention_required = True
+            else:
+                is_no_mention_required = await async_parent_mentions_bot(
+                    context, client, thread_ts, messages_in_context
+                ) is True
+
+        if is_no_mention_required is False:
+            return
+
+        messages = build_thread_messages(context, messages_in_context, is_in_dm_with_bot)
+        if messages is None:
+            return
+
+        await async_get_language_to_sql(
+            context=context,
+            client=client,
+            payload=payload,
+            messages=messages,
+            logger=logger,
+            text_query=payload["text"],
+        )
+
+    except Exception as e:
+        logger.exception(f"async_bolt_listeners.py, {type(e).__name__}, Failed to process request: {e}")
+        await client.chat_postMessage(
+            channel=context.channel_id,
+            thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
+            text=error_reply_text(e, f"{DEFAULT_ERROR_TEXT_ERR}, status"),
+        )
+
+
+def register_async_listeners(app: AsyncApp):
+    app.event("app_mention")(ack=async_just_ack, lazy=[async_respond_to_app_mention])
+    app.event("message")(ack=async_just_ack, lazy=[async_respond_to_new_message])
+
+
+async def async_before_authorize(
+        body: dict,
+        payload: dict,
+        request,
+        logger: logging.Logger,
+        next_,
+):
+    if is_skippable_event(body, payload):
+        # Keep cached thread histories in sync with edits and deletions
+        thread_history_cache.apply_event(payload)
+        parent_mention_memo.apply_event(payload)
+        logger.debug(
+            "Skipped the following middleware and listeners "
+            f"for this message event (subtype: {payload.get('subtype')})"
+        )
+        return BoltResponse(status=200, body="")
+    if is_duplicate_event(body):
+        # Slack retries events it thinks were not acknowledged in time; the first delivery is still being handled
+        SLACK_DUPLICATE_EVENTS.inc(retry_reason=retry_reason(request))
+        logger.info(
+            f"Skipped a duplicate delivery of event {body.get('event_id')} "
+            f"(retry: {retry_num(request)}, reason: {retry_reason(request)})"
+        )
+        return BoltResponse(status=200, body="")
+    await next_()
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from typing import Any, Optional, Tuple
+
+import aiohttp
+
+from app.env import (
+    GENIEAPI_HOST,
+    GENIEAPI_POOL_SIZE,
+    GENIEAPI_CONNECT_TIMEOUT_SECONDS,
+    GENIEAPI_READ_TIMEOUT_SECONDS,
+    GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS,
+)
+from app.metrics import STAGE_SECONDS, GENIE_RETRIES, GENIE_REQUEST_SECONDS
+from app.polling import BackoffSchedule
+from app.tracing import start_span, inject_headers, traced, set_attributes
+from app.utils import build_genieapi_params, get_space_travel_update, is_prime
+
+logger = logging.getLogger(__name__)
+
+
+def to_query_params(params: Optional[dict]) -> Optional[dict]:
+    # aiohttp rejects None and bool values, so encode them the same way requests does
+    if params is None:
+        return None
+    return {k: str(v) for k, v in params.items() if v is not None}
+
+
+class AsyncGenieApiClient:
+    """asyncio counterpart of GenieApiClient, backed by one pooled, keep-alive aiohttp.ClientSession.
+
+    The session is bound to the event loop that first uses it.
+    """
+
+    def __init__(
+            self,
+            base_url: str = GENIEAPI_HOST,
+            pool_size: int = GENIEAPI_POOL_SIZE,
+            connect_timeout: float = GENIEAPI_CONNECT_TIMEOUT_SECONDS,
+            read_timeout: float = GENIEAPI_READ_TIMEOUT_SECONDS,
+    ):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+        return self._session
+
+    def url(self, endpoint: str) -> str:
+        return self.base_url + endpoint
+
+    async def get(
+            self,
+            endpoint: str,
+            api_key: Optional[str],
+            params: Optional[dict] = None,
+            read_timeout: Optional[float] = None,
+    ) -> Tuple[int, Any]:
+        """Returns (status code, decoded JSON body); the body is None unless the request succeeded."""
+        timeout = None
+        if read_timeout is not None:
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=read_timeout)
+        start, status = time.perf_counter(), "error"
+        try:
+            with start_span(f"genie GET {endpoint}", **{"http.method": "GET", "http.route": endpoint}) as span:
+                async with self.session.get(
+                        self.url(endpoint),
+                        headers=inject_headers({"X-API-Key": api_key}),
+                        params=to_query_params(params),
+                        timeout=timeout,
+                ) as response:
+                    status = response.status
+                    span.set_attributes(**{"http.status_code": status})
+                    if response.status < 299:
+                        return response.status, await response.json(content_type=None)
+                    return response.status, None
+        finally:
+            GENIE_REQUEST_SECONDS.observe(time.perf_counter() - start, method="GET", endpoint=endpoint, status=status)
+
+    async def post(
+            self,
+            endpoint: str,
+            api_key: Optional[str],
+            params: Optional[dict] = None,
+            json: Optional[dict] = None,
+    ) -> int:
+        start, status = time.perf_counter(), "error"
+        try:
+            with start_span(f"genie POST {endpoint}", **{"http.method": "POST", "http.route": endpoint}) as span:
+                async with self.session.post(
+                        self.url(endpoint),
+                        headers=inject_headers({"X-API-Key": api_key}),
+                        params=to_query_params(params),
+                        json=json,
+                ) as response:
+                    status = response.status
+                    span.set_attributes(**{"http.status_code": status})
+                    return response.status
+        finally:
+            GENIE_REQUEST_SECONDS.observe(time.perf_counter() - start, method="POST", endpoint=endpoint, status=status)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_async_genie_client: Optional[AsyncGenieApiClient] = None
+
+
+def get_async_genie_client() -> AsyncGenieApiClient:
+    global _async_genie_client
+    if _async_genie_client is None:
+        _async_genie_client = AsyncGenieApiClient()
+    return _async_genie_client
+
+
+@traced()
+async def async_fetch_data_from_genieapi(
+        api_key=None,
+        endpoint="/language_to_sql",
+        MAX_RETRIES=5,
+        DELAY_FACTOR=0,
+        client=None,
+        channel=None,
+        thread_ts=None,
+        genie_client: Optional[AsyncGenieApiClient] = None,
+        poll_schedule: Optional[BackoffSchedule] = None,
+        long_poll_seconds: Optional[float] = None,
+        **params,
+):
+    """asyncio counterpart of fetch_data_from_genieapi; params are the ones build_genieapi_params accepts."""
+    genie_client = genie_client or get_async_genie_client()
+    set_attributes(endpoint=endpoint)
+    PARAMS_DEFAULT = build_genieapi_params(**params)
+
+    read_timeout = None
+    if long_poll_seconds is not None:
+        PARAMS_DEFAULT["wait"] = long_poll_seconds
+        read_timeout = genie_client.read_timeout + long_poll_seconds
+
+    delays = iter(poll_schedule) if poll_schedule is not None else None
+    last_progress_at = time.monotonic()
+    progress_count = 0
+
+    # genie_poll_wait only counts the waits for the result (backoff sleeps and long polls), once
+    # per call; the requests themselves are in GENIE_REQUEST_SECONDS
+    is_polling = poll_schedule is not None or long_poll_seconds is not None
+    poll_wait_seconds = 0.0
+    try:
+        retries = 0
+        while delays is not None or retries < MAX_RETRIES:
+            requested_at = time.monotonic()
+            status, body = await genie_client.get(endpoint, api_key, params=PARAMS_DEFAULT, read_timeout=read_timeout)
+            if long_poll_seconds is not None:
+                poll_wait_seconds += time.monotonic() - requested_at
+
+            logger.debug(f"async_fetch_data_from_genieapi, response.status_code={status}, endpoint={endpoint}, retries={retries}")
+
+            if status < 299:
+                return body
+
+            elif 401 >= status <= 403:
+                raise Exception("USER_NOT_AUTHORIZED")
+
+            elif delays is not None:
+                delay = next(delays, None)
+                if delay is None:
+                    break
+                now = time.monotonic()
+                if client and channel and thread_ts and now - last_progress_at >= GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS:
+                    await client.chat_postMessage(
+                        channel=channel,
+                        thread_ts=thread_ts,
+                        text=get_space_travel_update(progress_count),
+                    )
+                    progress_count += 1
+                    last_progress_at = now
+                retries += 1
+                GENIE_RETRIES.inc(endpoint=endpoint)
+                await asyncio.sleep(delay)
+                poll_wait_seconds += delay
+
+            else:
+                if client and channel and thread_ts and is_prime(retries):
+                    await client.chat_postMessage(
+                        channel=channel,
+                        thread_ts=thread_ts,
+                        text=get_space_travel_update(retries),
+                    )
+                retries += 1
+                GENIE_RETRIES.inc(endpoint=endpoint)
+                if DELAY_FACTOR > 0:
+                    await asyncio.sleep(DELAY_FACTOR ** retries)  # exponential backoff
+                else:
+                    await asyncio.sleep(10)
+
+        # If maximum retries are reached, raise an exception
+        raise Exception("Max retries reached without a successful response")
+    finally:
+        if is_polling:
+            STAGE_SECONDS.observe(poll_wait_seconds, stage="genie_poll_wait")
+
+
+@traced()
+async def async_post_data_to_genieapi(api_key=None, endpoint=None, params=None, post_body=None,
+                                      genie_client: Optional[AsyncGenieApiClient] = None):
+    genie_client = genie_client or get_async_genie_client()
+    set_attributes(endpoint=endpoint)
+
+    MAX_RETRIES = 3
+    DELAY_FACTOR = 2
+
+    retries = 0
+    while retries < MAX_RETRIES:
+        status = await genie_client.post(endpoint, api_key, params=params, json=post_body)
+        if status < 299:
+            return status
+        elif 400 <= status < 500:
+            raise Exception(f"Genie API returned {status} for {endpoint}")
+        elif status >= 500:
+            retries += 1
+            GENIE_RETRIES.inc(endpoint=endpoint)
+            await asyncio.sleep(DELAY_FACTOR ** retries)  # exponential backoff
+        else:
+            break
+
+    raise Exception("Max retries reached without a successful response")
@@ -1,7 +1,6 @@
 import logging
 import re
-import time
-import traceback
+from typing import Callable, Optional
 
 from openai.error import Timeout
 from slack_bolt import App, Ack, BoltContext, BoltResponse
@@ -10,17 +9,30 @@ from slack_sdk.web import WebClient
 
 from app.api_funcs import get_language_to_sql
 from app.env import (
+    OPENAI_MODEL,
     OPENAI_TIMEOUT_SECONDS,
     SYSTEM_TEXT,
     TRANSLATE_MARKDOWN,
 )
 from app.i18n import translate
+from app.idempotency import is_duplicate_event, retry_num, retry_reason
+from app.metrics import SLACK_DUPLICATE_EVENTS
 from app.openai_ops import (
     start_receiving_openai_response,
     format_openai_message_content,
     consume_openai_stream_to_write_reply,
     build_system_text,
     messages_within_context_window,
+    history_token_budget,
+    estimate_message_num_tokens,
+)
+from app.prompt_registry import metadata_system_messages
+from app.slack_history import (
+    fetch_thread_messages,
+    thread_history_cache,
+    parent_mention_memo,
+    iter_dm_history,
+    take_within_budget,
 )
 from app.slack_ops import (
     find_parent_message,
@@ -29,9 +41,11 @@ from app.slack_ops import (
     update_wip_message, post_wip_message_with_attachment,
 )
 
-from app.utils import redact_string, fetch_data_from_genieapi, DEFAULT_LOADING_TEXT, DEFAULT_ERROR_TEXT, \
+from app.utils import redact_string, redact_message_text, fetch_data_from_genieapi, DEFAULT_LOADING_TEXT, DEFAULT_ERROR_TEXT, \
     DEFAULT_ERROR_TEXT_AUTH, DEFAULT_ERROR_TEXT_ERR
 
+logger = logging.getLogger(__name__)
+
 
 #
 # Listener functions
@@ -85,6 +99,154 @@ def extract_table(sentence):
         return None
 
 
+#
+# Shared by the sync listeners here and the asyncio ones in app/async_bolt_listeners.py
+#
+
+
+def error_reply_text(e: Exception, default_text: str = DEFAULT_ERROR_TEXT_ERR) -> str:
+    if isinstance(e, Timeout):
+        return DEFAULT_ERROR_TEXT
+    if f"{e}" == "USER_NOT_AUTHORIZED":
+        return DEFAULT_ERROR_TEXT_AUTH
+    return default_text
+
+
+def append_mention_message(context: BoltContext, messages: list, user_id: str, text: str) -> str:
+    # Strip bot Slack user ID from initial message
+    msg_text = re.sub(f"<@{context.bot_user_id}>\\s*", "", text)
+    msg_text = redact_string(msg_text)
+    messages.append(
+        {
+            "role": "user",
+            "content": f"<@{user_id}>: "
+                       + format_openai_message_content(msg_text, TRANSLATE_MARKDOWN),
+        }
+    )
+    return msg_text
+
+
+def append_mention_thread_messages(context: BoltContext, messages: list, replies_in_thread: list) -> Optional[str]:
+    last_message = None
+    for reply in replies_in_thread:
+        reply_text = redact_message_text(reply)
+        messages.append(
+            {
+                "role": (
+                    "assistant"
+                    if reply["user"] == context.bot_user_id
+                    else "user"
+                ),
+                "content": (
+                        f"<@{reply['user']}>: "
+                        + format_openai_message_content(
+                    reply_text, TRANSLATE_MARKDOWN
+                )
+                ),
+            }
+        )
+        last_message = reply_text
+    return last_message
+
+
+def dm_model(context: BoltContext) -> str:
+    """The workspace's model, as set by the config middleware, or OPENAI_MODEL."""
+    return context.get("OPENAI_MODEL") or OPENAI_MODEL
+
+
+def dm_history_token_budget(context: BoltContext) -> int:
+    return history_token_budget(dm_model(context))
+
+
+def dm_message_num_tokens(context: BoltContext) -> Callable[[dict], int]:
+    """Returns the function counting the tokens of a DM history message for the workspace's model."""
+    model = dm_model(context)
+
+    def num_tokens(message: dict) -> int:
+        return estimate_message_num_tokens({"role": "user", "content": message.get("text") or ""}, model)
+
+    return num_tokens
+
+
+def find_message_by_ts(messages_in_context: list, ts: str) -> Optional[dict]:
+    for message in messages_in_context:
+        if message.get("ts") == ts:
+            return message
+    return None
+
+
+def parent_mentions_bot(
+        context: BoltContext,
+        client: WebClient,
+        thread_ts: str,
+        messages_in_context: Optional[list] = None,
+) -> Optional[bool]:
+    """Whether the parent message of a thread mentions the bot; None if it can't be found."""
+    mentioned = parent_mention_memo.get(context.channel_id, thread_ts)
+    if mentioned is None:
+        parent_message = find_message_by_ts(messages_in_context or [], thread_ts)
+        if parent_message is None:
+            parent_message = find_parent_message(client, context.channel_id, thread_ts)
+        if parent_message is None:
+            return None
+        mentioned = is_no_mention_thread(context, parent_message)
+        parent_mention_memo.put(context.channel_id, thread_ts, mentioned)
+    return mentioned
+
+
+def build_thread_messages(context: BoltContext, messages_in_context: list, is_in_dm_with_bot: bool) -> Optional[list]:
+    """Rebuilds the conversation from a thread (or DM) history; returns None if there is nothing to answer."""
+    messages = []
+    last_assistant_idx = -1
+    indices_to_remove = []
+    # Replace placeholder for Slack user ID in the system prompt
+    system_text = build_system_text(SYSTEM_TEXT, TRANSLATE_MARKDOWN, context)
+    for idx, reply in enumerate(messages_in_context):
+        maybe_event_type = reply.get("metadata", {}).get("event_type")
+        if maybe_event_type == "chat-gpt-convo":
+            if context.bot_id != reply.get("bot_id"):
+                # Remove messages by a different app
+                indices_to_remove.append(idx)
+                continue
+            # A new list, as the history may be cached and reused by later events
+            maybe_new_messages = metadata_system_messages(
+                reply.get("metadata", {}).get("event_payload", {}), system_text
+            )
+            if maybe_new_messages is not None:
+                messages = maybe_new_messages
+                last_assistant_idx = idx
+
+    if is_in_dm_with_bot is True or last_assistant_idx == -1:
+        # To know whether this app needs to start a new convo
+        if not next(filter(lambda msg: msg["role"] == "system", messages), None):
+            messages.insert(0, {"role": "system", "content": system_text})
+
+    filtered_messages_in_context = []
+    for idx, reply in enumerate(messages_in_context):
+        # Strip bot Slack user ID from initial message
+        if idx == 0:
+            reply = {
+                **reply,
+                "text": re.sub(f"<@{context.bot_user_id}>\\s*", "", reply["text"]),
+            }
+        if idx not in indices_to_remove:
+            filtered_messages_in_context.append(reply)
+    if len(filtered_messages_in_context) == 0:
+        return None
+
+    for reply in filtered_messages_in_context:
+        msg_user_id = reply.get("user")
+        reply_text = redact_message_text(reply)
+        messages.append(
+            {
+                "content": f"<@{msg_user_id}>: "
+                           + format_openai_message_content(reply_text, TRANSLATE_MARKDOWN),
+                "role": "user",
+            }
+        )
+    return messages
+
+
 def respond_to_app_mention(
         context: BoltContext,
         payload: dict,
@@ -93,13 +255,12 @@ def respond_to_app_mention(
 ):
     last_message = None
     if payload.get("thread_ts") is not None:
-        parent_message = find_parent_message(
-            client, context.channel_id, payload.get("thread_ts")
-        )
-        if parent_message is not None:
-            if is_no_mention_thread(context, parent_message):
-                # The message event handler will reply to this
-                return
+        if parent_mentions_bot(context, client, payload.get("thread_ts")):
+            # The message event handler will reply to this
+            return
+    else:
+        # This message may become the parent of a thread
+        parent_mention_memo.put(context.channel_id, payload.get("ts"), is_no_mention_thread(context, payload))
 
     wip_reply = None
     # Replace placeholder for Slack user ID in the system prompt
@@ -121,43 +282,13 @@ def respond_to_app_mention(
 
         if payload.get("thread_ts") is not None:
             # Mentioning the bot user in a thread
-            replies_in_thread = client.conversations_replies(
-                channel=context.channel_id,
-                ts=payload.get("thread_ts"),
-                include_all_metadata=True,
-                limit=1000,
-            ).get("messages", [])
-            for reply in replies_in_thread:
-                reply_text = redact_string(reply.get("text"))
-                messages.append(
-                    {
-                        "role": (
-                            "assistant"
-                            if reply["user"] == context.bot_user_id
-                            else "user"
-                        ),
-                        "content": (
-                                f"<@{reply['user']}>: "
-                                + format_openai_message_content(
-                            reply_text, TRANSLATE_MARKDOWN
-                        )
-                        ),
-                    }
-                )
-                last_message = reply_text
+            replies_in_thread = fetch_thread_messages(
+                client, context.channel_id, payload.get("thread_ts"), latest_message=payload
+            )
+            last_message = append_mention_thread_messages(context, messages, replies_in_thread)
 
         else:
-            # Strip bot Slack user ID from initial message
-            msg_text = re.sub(f"<@{context.bot_user_id}>\\s*", "", payload["text"])
-            msg_text = redact_string(msg_text)
-            messages.append(
-                {
-                    "role": "user",
-                    "content": f"<@{user_id}>: "
-                               + format_openai_message_content(msg_text, TRANSLATE_MARKDOWN),
-                }
-            )
-            last_message = msg_text
+            last_message = append_mention_message(context, messages, user_id, payload["text"])
 
         text_query = last_message
         get_language_to_sql(
@@ -170,31 +301,13 @@ def respond_to_app_mention(
         )
 
 
-    except Timeout as e:
-        traceback.print_exc()
-        text = f"bolt_listeners.py, Timeout, Failed to process request: {e}"
-        logger.exception(text)
+    except Exception as e:
+        logger.exception(f"bolt_listeners.py, {type(e).__name__}, Failed to process request: {e}")
         client.chat_postMessage(
             channel=context.channel_id,
             thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
-            text=DEFAULT_ERROR_TEXT,
+            text=error_reply_text(e),
         )
-    except Exception as e:
-        traceback.print_exc()
-        text = f"bolt_listeners.py, Exception, Failed to process request: {e}"
-        logger.exception(text)
-        if f"{e}" == "USER_NOT_AUTHORIZED":
-            client.chat_postMessage(
-                channel=context.channel_id,
-                thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
-                text=DEFAULT_ERROR_TEXT_AUTH,
-            )
-        else:
-            client.chat_postMessage(
-                channel=context.channel_id,
-                thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
-                text=DEFAULT_ERROR_TEXT_ERR,
-            )
 
 
 def respond_to_new_message(
@@ -209,19 +322,11 @@ def respond_to_new_message(
 
     is_in_dm_with_bot = payload.get("channel_type") == "im"
     try:
-
-        messages_in_context = client.conversations_replies(
-            channel=context.channel_id,
-            ts=payload["ts"],
-            include_all_metadata=True,
-            limit=1000,
-        ).get("messages", [])
-        last_message = messages_in_context[-1]
-        # print(f"--- the last message is :{last_message} \n")
-
         is_no_mention_required = False
         thread_ts = payload.get("thread_ts")
         if is_in_dm_with_bot is False and thread_ts is None:
+            # This message may become the parent of a thread
+            parent_mention_memo.put(context.channel_id, payload.get("ts"), is_no_mention_thread(context, payload))
             return
 
         api_key = context.get("api_key")
@@ -231,106 +336,33 @@ def respond_to_new_message(
         messages_in_context = []
         if is_in_dm_with_bot is True and thread_ts is None:
             # In the DM with the bot
-            past_messages = client.conversations_history(
-                channel=context.channel_id,
-                include_all_metadata=True,
-                limit=100,
-            ).get("messages", [])
-            past_messages.reverse()
-            # Remove old messages
-            for message in past_messages:
-                seconds = time.time() - float(message.get("ts"))
-                if seconds < 86400:  # less than 1 day
-                    messages_in_context.append(message)
+            # Only the messages of the last day that fit in the context window
+            messages_in_context = take_within_budget(
+                iter_dm_history(client, context.channel_id),
+                dm_history_token_budget(context),
+                dm_message_num_tokens(context),
+            )
             is_no_mention_required = True
         else:
             # In a thread with the bot in a channel
-            messages_in_context = client.conversations_replies(
-                channel=context.channel_id,
-                ts=thread_ts,
-                include_all_metadata=True,
-                limit=1000,
-            ).get("messages", [])
+            messages_in_context = fetch_thread_messages(
+                client, context.channel_id, thread_ts, latest_message=payload
+            )
             if is_in_dm_with_bot is True:
                 is_no_mention_required = True
             else:
-                the_parent_message_found = False
-                for message in messages_in_context:
-                    if message.get("ts") == thread_ts:
-                        the_parent_message_found = True
-                        is_no_mention_required = is_no_mention_thread(context, message)
-                        break
-                if the_parent_message_found is False:
-                    parent_message = find_parent_message(
-                        client, context.channel_id, thread_ts
-                    )
-                    if parent_message is not None:
-                        is_no_mention_required = is_no_mention_thread(
-                            context, parent_message
-                        )
-
-        messages = []
-        user_id = context.actor_user_id or context.user_id
-        last_assistant_idx = -1
-        indices_to_remove = []
-        for idx, reply in enumerate(messages_in_context):
-            maybe_event_type = reply.get("metadata", {}).get("event_type")
-            if maybe_event_type == "chat-gpt-convo":
-                if context.bot_id != reply.get("bot_id"):
-                    # Remove messages by a different app
-                    indices_to_remove.append(idx)
-                    continue
-                maybe_new_messages = (
-                    reply.get("metadata", {}).get("event_payload", {}).get("messages")
-                )
-                if maybe_new_messages is not None:
-                    if len(messages) == 0 or user_id is None:
-                        new_user_id = (
-                            reply.get("metadata", {})
-                            .get("event_payload", {})
-                            .get("user")
-                        )
-                        if new_user_id is not None:
-                            user_id = new_user_id
-                    messages = maybe_new_messages
-                    last_assistant_idx = idx
+                is_no_mention_required = parent_mentions_bot(
+                    context, client, thread_ts, messages_in_context
+                ) is True
 
         if is_no_mention_required is False:
             return
 
-        if is_in_dm_with_bot is True or last_assistant_idx == -1:
-            # To know whether this app needs to start a new convo
-            if not next(filter(lambda msg: msg["role"] == "system", messages), None):
-                # Replace placeholder for Slack user ID in the system prompt
-                system_text = build_system_text(
-                    SYSTEM_TEXT, TRANSLATE_MARKDOWN, context
-                )
-                messages.insert(0, {"role": "system", "content": system_text})
-
-        filtered_messages_in_context = []
-        for idx, reply in enumerate(messages_in_context):
-            # Strip bot Slack user ID from initial message
-            if idx == 0:
-                reply["text"] = re.sub(
-                    f"<@{context.bot_user_id}>\\s*", "", reply["text"]
-                )
-            if idx not in indices_to_remove:
-                filtered_messages_in_context.append(reply)
-        if len(filtered_messages_in_context) == 0:
+        messages = build_thread_messages(context, messages_in_context, is_in_dm_with_bot)
+        if messages is None:
             return
 
-        for reply in filtered_messages_in_context:
-            msg_user_id = reply.get("user")
-            reply_text = redact_string(reply.get("text"))
-            messages.append(
-                {
-                    "content": f"<@{msg_user_id}>: "
-                               + format_openai_message_content(reply_text, TRANSLATE_MARKDOWN),
-                    "role": "user",
-                }
-            )
-
-        text_query = last_message["text"]
+        text_query = payload["text"]
         get_language_to_sql(
             context=context,
             client=client,
@@ -340,31 +372,13 @@ def respond_to_new_message(
             text_query=text_query
         )
 
-    except Timeout as e:
-        traceback.print_exc()
-        text = f"bolt_listeners.py, Timeout, Failed to process request: {e}"
-        logger.exception(text)
+    except Exception as e:
+        logger.exception(f"bolt_listeners.py, {type(e).__name__}, Failed to process request: {e}")
         client.chat_postMessage(
             channel=context.channel_id,
             thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
-            text=DEFAULT_ERROR_TEXT,
+            text=error_reply_text(e, f"{DEFAULT_ERROR_TEXT_ERR}, status"),
         )
-    except Exception as e:
-        traceback.print_exc()
-        text = f"bolt_listeners.py, Exception, Failed to process request: {e}"
-        logger.exception(text)
-        if f"{e}" == "USER_NOT_AUTHORIZED":
-            client.chat_postMessage(
-                channel=context.channel_id,
-                thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
-                text=DEFAULT_ERROR_TEXT_AUTH,
-            )
-        else:
-            client.chat_postMessage(
-                channel=context.channel_id,
-                thread_ts=payload.get("thread_ts") if is_in_dm_with_bot else payload["ts"],
-                text=f"{DEFAULT_ERROR_TEXT_ERR}, status",
-            )
 
 
 def register_listeners(app: App):
@@ -375,25 +389,42 @@ def register_listeners(app: App):
 MESSAGE_SUBTYPES_TO_SKIP = ["message_changed", "message_deleted"]
 
 
+def is_skippable_event(body: dict, payload: dict) -> bool:
+    return (
+            is_event(body)
+            and payload.get("type") == "message"
+            and payload.get("subtype") in MESSAGE_SUBTYPES_TO_SKIP
+    )
+
+
 # To reduce unnecessary workload in this app,
 # this before_authorize function skips message changed/deleted events.
 # Especially, "message_changed" events can be triggered many times when the app rapidly updates its reply.
+# It also drops Slack's retries of events already being handled, which would otherwise run the question again.
 def before_authorize(
         body: dict,
         payload: dict,
+        request,
         logger: logging.Logger,
         next_,
 ):
-    if (
-            is_event(body)
-            and payload.get("type") == "message"
-            and payload.get("subtype") in MESSAGE_SUBTYPES_TO_SKIP
-    ):
+    if is_skippable_event(body, payload):
+        # Keep cached thread histories in sync with edits and deletions
+        thread_history_cache.apply_event(payload)
+        parent_mention_memo.apply_event(payload)
         logger.debug(
             "Skipped the following middleware and listeners "
             f"for this message event (subtype: {payload.get('subtype')})"
         )
         return BoltResponse(status=200, body="")
+    if is_duplicate_event(body):
+        # Slack retries events it thinks were not acknowledged in time; the first delivery is still being handled
+        SLACK_DUPLICATE_EVENTS.inc(retry_reason=retry_reason(request))
+        logger.info(
+            f"Skipped a duplicate delivery of event {body.get('event_id')} "
+            f"(retry: {retry_num(request)}, reason: {retry_reason(request)})"
+        )
+        return BoltResponse(status=200, body="")
     next_()
 
 
@@ -455,7 +486,7 @@ def suggest_table(context, client, payload, value):
     messages = []
     user_id = context.actor_user_id or context.user_id
 
-    print(f"suggest_table, loading_text={loading_text}")
+    logger.debug(f"suggest_table, loading_text={loading_text}")
 
     # Use the built-in WebClient to upload the file
     post_wip_message_with_attachment(
@@ -483,7 +514,7 @@ def predict_table(context, client, payload, value):
     messages = []
     user_id = context.actor_user_id or context.user_id
 
-    print(f"predict_table, loading_text={loading_text}")
+    logger.debug(f"predict_table, loading_text={loading_text}")
 
     # Use the built-in WebClient to upload the file
     post_wip_message_with_attachment(
@@ -511,7 +542,7 @@ def suggest_tables(context, client, payload, value):
     messages = []
     user_id = context.actor_user_id or context.user_id
 
-    print(f"suggest_tables, loading_text={loading_text}")
+    logger.debug(f"suggest_tables, loading_text={loading_text}")
 
     # Use the built-in WebClient to upload the file
     post_wip_message_with_attachment(
@@ -0,0 +1,171 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.env import (
+    CONFIG_STORE_BACKEND,
+    CONFIG_STORE_SQLITE_PATH,
+    CONFIG_STORE_LOCAL_TTL_SECONDS,
+)
+from app.s3_config import (
+    load_s3_config,
+    async_load_s3_config,
+    invalidate_s3_config,
+    config_write_coalescer,
+)
+from app.sqlite_store import SQLiteDatabase
+
+
+class ConfigStore(ABC):
+    """Stores the per-team and per-user config objects (JSON strings), keyed by team_id or team_id_user_id."""
+
+    @abstractmethod
+    def load(self, key: str) -> Optional[str]:
+        """Returns the raw config object stored under key, or None if it does not exist."""
+
+    async def async_load(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.load, key)
+
+    @abstractmethod
+    def update(self, key: str, changes: Dict[str, str]) -> dict:
+        """Applies changes to the config object under key (creating it if needed) and returns the new config."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+
+class S3ConfigStore(ConfigStore):
+    """One JSON object per key in an S3 bucket, read through the config cache in app/s3_config.py."""
+
+    def __init__(self, s3_client, bucket_name: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+
+    def load(self, key: str) -> Optional[str]:
+        return load_s3_config(self.s3_client, self.bucket_name, key)
+
+    async def async_load(self, key: str) -> Optional[str]:
+        return await async_load_s3_config(self.s3_client, self.bucket_name, key)
+
+    def update(self, key: str, changes: Dict[str, str]) -> dict:
+        return config_write_coalescer.update(self.s3_client, self.bucket_name, key, changes)
+
+    def delete(self, key: str):
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+        invalidate_s3_config(key)
+
+
+class SQLiteConfigStore(ConfigStore):
+    """A local SQLite database, for single-node installs and tests.
+
+    A row whose body is NULL records that the key is known not to exist, which
+    TieredConfigStore uses to cache misses.
+    """
+
+    def __init__(self, path: str = CONFIG_STORE_SQLITE_PATH):
+        self.path = path
+        self.db = SQLiteDatabase(
+            path, "CREATE TABLE IF NOT EXISTS configs (key TEXT PRIMARY KEY, body TEXT, updated_at REAL NOT NULL)"
+        )
+
+    def load_entry(self, key: str) -> Optional[tuple]:
+        """Returns (body, updated_at) for key, or None if there is no row."""
+        return self.db.fetchone("SELECT body, updated_at FROM configs WHERE key = ?", (key,))
+
+    def load(self, key: str) -> Optional[str]:
+        entry = self.load_entry(key)
+        return entry[0] if entry is not None else None
+
+    async def async_load(self, key: str) -> Optional[str]:
+        # A local read is quicker than handing it to a worker thread
+        return self.load(key)
+
+    def store(self, key: str, body: Optional[str]):
+        self.db.execute(
+            "INSERT OR REPLACE INTO configs (key, body, updated_at) VALUES (?, ?, ?)",
+            (key, body, time.time()),
+        )
+
+    def update(self, key: str, changes: Dict[str, str]) -> dict:
+        # The write lock is taken before reading, so concurrent updates can't be lost
+        with self.db.transaction() as connection:
+            row = connection.execute("SELECT body FROM configs WHERE key = ?", (key,)).fetchone()
+            data = json.loads(row[0]) if row is not None and row[0] is not None else {}
+            data.update(changes)
+            connection.execute(
+                "INSERT OR REPLACE INTO configs (key, body, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(data), time.time()),
+            )
+        return data
+
+    def delete(self, key: str):
+        self.db.execute("DELETE FROM configs WHERE key = ?", (key,))
+
+
+class TieredConfigStore(ConfigStore):
+    """A local store in front of a remote one: reads are served locally for ttl_seconds,
+    writes go to the remote store first and then replace the local copy."""
+
+    def __init__(self, local: SQLiteConfigStore, remote: ConfigStore,
+                 ttl_seconds: float = CONFIG_STORE_LOCAL_TTL_SECONDS):
+        self.local = local
+        self.remote = remote
+        self.ttl_seconds = ttl_seconds
+
+    def load(self, key: str) -> Optional[str]:
+        entry = self.local.load_entry(key)
+        if entry is not None and time.time() - entry[1] < self.ttl_seconds:
+            return entry[0]
+        body = self.remote.load(key)
+        self.local.store(key, body)
+        return body
+
+    async def async_load(self, key: str) -> Optional[str]:
+        entry = self.local.load_entry(key)
+        if entry is not None and time.time() - entry[1] < self.ttl_seconds:
+            return entry[0]
+        body = await self.remote.async_load(key)
+        self.local.store(key, body)
+        return body
+
+    def update(self, key: str, changes: Dict[str, str]) -> dict:
+        data = self.remote.update(key, changes)
+        self.local.store(key, json.dumps(data))
+        return data
+
+    def delete(self, key: str):
+        self.remote.delete(key)
+        self.local.store(key, None)
+
+
+CONFIG_STORE_BACKENDS = ("s3", "sqlite", "tiered")
+
+# (s3_client, bucket_name) -> store
+_config_stores: Dict[Tuple[object, str], ConfigStore] = {}
+_config_stores_lock = threading.Lock()
+
+
+def create_config_store(s3_client, bucket_name: str, backend: str = CONFIG_STORE_BACKEND) -> ConfigStore:
+    if backend == "s3":
+        return S3ConfigStore(s3_client, bucket_name)
+    if backend == "sqlite":
+        return SQLiteConfigStore(CONFIG_STORE_SQLITE_PATH)
+    if backend == "tiered":
+        return TieredConfigStore(SQLiteConfigStore(CONFIG_STORE_SQLITE_PATH), S3ConfigStore(s3_client, bucket_name))
+    raise ValueError(f"Unknown CONFIG_STORE_BACKEND: {backend} (expected one of {', '.join(CONFIG_STORE_BACKENDS)})")
+
+
+def get_config_store(s3_client, bucket_name: str) -> ConfigStore:
+    """Returns the store for CONFIG_STORE_BACKEND over this S3 client and bucket, created on first use."""
+    key = (s3_client, bucket_name)
+    store = _config_stores.get(key)
+    if store is None:
+        with _config_stores_lock:
+            store = _config_stores.get(key)
+            if store is None:
+                store = _config_stores[key] = create_config_store(s3_client, bucket_name)
+    return store
@@ -9,6 +9,17 @@ Each message has the author's Slack user ID prepended, like the regex `^<@U.*?>:
 """
 SYSTEM_TEXT = os.environ.get("OPENAI_SYSTEM_TEXT", DEFAULT_SYSTEM_TEXT)
 
+# Bot replies reference their system prompt as "<PROMPT_VERSION>:<hash>" in metadata;
+# the version defaults to a hash of SYSTEM_TEXT
+PROMPT_VERSION = os.environ.get("PROMPT_VERSION")
+DEFAULT_PROMPT_REGISTRY_MAX_SIZE = 1000
+PROMPT_REGISTRY_MAX_SIZE = int(os.environ.get("PROMPT_REGISTRY_MAX_SIZE", DEFAULT_PROMPT_REGISTRY_MAX_SIZE))
+# "sqlite" keeps the prompts in a file as well, so refs still resolve after a restart
+DEFAULT_PROMPT_REGISTRY_BACKEND = "memory"
+PROMPT_REGISTRY_BACKEND = os.environ.get("PROMPT_REGISTRY_BACKEND", DEFAULT_PROMPT_REGISTRY_BACKEND)
+DEFAULT_PROMPT_REGISTRY_SQLITE_PATH = "data/prompts.sqlite3"
+PROMPT_REGISTRY_SQLITE_PATH = os.environ.get("PROMPT_REGISTRY_SQLITE_PATH", DEFAULT_PROMPT_REGISTRY_SQLITE_PATH)
+
 DEFAULT_OPENAI_TIMEOUT_SECONDS = 30
 OPENAI_TIMEOUT_SECONDS = int(
     os.environ.get("OPENAI_TIMEOUT_SECONDS", DEFAULT_OPENAI_TIMEOUT_SECONDS)
@@ -60,3 +71,208 @@ REDACT_SSN_PATTERN = os.environ.get(
 )
 # For REDACT_USER_DEFINED_PATTERN, the default will never match anything
 REDACT_USER_DEFINED_PATTERN = os.environ.get("REDACT_USER_DEFINED_PATTERN", r"(?!)")
+# Redacted texts remembered per message ts, so replayed threads aren't redacted again
+DEFAULT_REDACTION_MEMO_SIZE = 10000
+REDACTION_MEMO_SIZE = int(os.environ.get("REDACTION_MEMO_SIZE", DEFAULT_REDACTION_MEMO_SIZE))
+
+# Installation lookups (bot tokens) cache; misses are cached for a shorter time
+#
+DEFAULT_SLACK_INSTALLATION_CACHE_TTL_SECONDS = 300
+SLACK_INSTALLATION_CACHE_TTL_SECONDS = float(
+    os.environ.get("SLACK_INSTALLATION_CACHE_TTL_SECONDS", DEFAULT_SLACK_INSTALLATION_CACHE_TTL_SECONDS)
+)
+DEFAULT_SLACK_INSTALLATION_CACHE_NEGATIVE_TTL_SECONDS = 30
+SLACK_INSTALLATION_CACHE_NEGATIVE_TTL_SECONDS = float(
+    os.environ.get(
+        "SLACK_INSTALLATION_CACHE_NEGATIVE_TTL_SECONDS", DEFAULT_SLACK_INSTALLATION_CACHE_NEGATIVE_TTL_SECONDS
+    )
+)
+DEFAULT_SLACK_INSTALLATION_CACHE_MAX_SIZE = 1024
+SLACK_INSTALLATION_CACHE_MAX_SIZE = int(
+    os.environ.get("SLACK_INSTALLATION_CACHE_MAX_SIZE", DEFAULT_SLACK_INSTALLATION_CACHE_MAX_SIZE)
+)
+
+# Per-team / per-user config store: "s3" (default), "sqlite" (local file) or "tiered" (SQLite in front of S3)
+#
+DEFAULT_CONFIG_STORE_BACKEND = "s3"
+CONFIG_STORE_BACKEND = os.environ.get("CONFIG_STORE_BACKEND", DEFAULT_CONFIG_STORE_BACKEND)
+DEFAULT_CONFIG_STORE_SQLITE_PATH = "data/config.sqlite3"
+CONFIG_STORE_SQLITE_PATH = os.environ.get("CONFIG_STORE_SQLITE_PATH", DEFAULT_CONFIG_STORE_SQLITE_PATH)
+# How long the "tiered" backend serves a config from SQLite before reading S3 again
+DEFAULT_CONFIG_STORE_LOCAL_TTL_SECONDS = 60
+CONFIG_STORE_LOCAL_TTL_SECONDS = float(
+    os.environ.get("CONFIG_STORE_LOCAL_TTL_SECONDS", DEFAULT_CONFIG_STORE_LOCAL_TTL_SECONDS)
+)
+
+# Per-team / per-user config cache (S3)
+#
+DEFAULT_S3_CONFIG_CACHE_TTL_SECONDS = 60
+S3_CONFIG_CACHE_TTL_SECONDS = float(
+    os.environ.get("S3_CONFIG_CACHE_TTL_SECONDS", DEFAULT_S3_CONFIG_CACHE_TTL_SECONDS)
+)
+DEFAULT_S3_CONFIG_CACHE_MAX_SIZE = 1024
+S3_CONFIG_CACHE_MAX_SIZE = int(
+    os.environ.get("S3_CONFIG_CACHE_MAX_SIZE", DEFAULT_S3_CONFIG_CACHE_MAX_SIZE)
+)
+# Conflicting writes are retried this many times (conditional puts need a botocore with S3 conditional writes)
+DEFAULT_S3_CONFIG_WRITE_MAX_ATTEMPTS = 5
+S3_CONFIG_WRITE_MAX_ATTEMPTS = int(
+    os.environ.get("S3_CONFIG_WRITE_MAX_ATTEMPTS", DEFAULT_S3_CONFIG_WRITE_MAX_ATTEMPTS)
+)
+# Changes to the same config object within this window are written together (0 = off)
+DEFAULT_S3_CONFIG_WRITE_COALESCE_SECONDS = 0
+S3_CONFIG_WRITE_COALESCE_SECONDS = float(
+    os.environ.get("S3_CONFIG_WRITE_COALESCE_SECONDS", DEFAULT_S3_CONFIG_WRITE_COALESCE_SECONDS)
+)
+
+# Genie API client
+#
+DEFAULT_GENIEAPI_HOST = "https://genieapi.defytrends.dev/api"
+GENIEAPI_HOST = os.environ.get("GENIEAPI_HOST", DEFAULT_GENIEAPI_HOST)
+DEFAULT_GENIEAPI_POOL_SIZE = 20
+GENIEAPI_POOL_SIZE = int(os.environ.get("GENIEAPI_POOL_SIZE", DEFAULT_GENIEAPI_POOL_SIZE))
+DEFAULT_GENIEAPI_CONNECT_TIMEOUT_SECONDS = 5
+GENIEAPI_CONNECT_TIMEOUT_SECONDS = float(
+    os.environ.get("GENIEAPI_CONNECT_TIMEOUT_SECONDS", DEFAULT_GENIEAPI_CONNECT_TIMEOUT_SECONDS)
+)
+DEFAULT_GENIEAPI_READ_TIMEOUT_SECONDS = 120
+GENIEAPI_READ_TIMEOUT_SECONDS = float(
+    os.environ.get("GENIEAPI_READ_TIMEOUT_SECONDS", DEFAULT_GENIEAPI_READ_TIMEOUT_SECONDS)
+)
+
+# Genie API polling
+#
+DEFAULT_GENIEAPI_POLL_INITIAL_DELAY_SECONDS = 0.25
+GENIEAPI_POLL_INITIAL_DELAY_SECONDS = float(
+    os.environ.get("GENIEAPI_POLL_INITIAL_DELAY_SECONDS", DEFAULT_GENIEAPI_POLL_INITIAL_DELAY_SECONDS)
+)
+DEFAULT_GENIEAPI_POLL_MAX_DELAY_SECONDS = 10
+GENIEAPI_POLL_MAX_DELAY_SECONDS = float(
+    os.environ.get("GENIEAPI_POLL_MAX_DELAY_SECONDS", DEFAULT_GENIEAPI_POLL_MAX_DELAY_SECONDS)
+)
+DEFAULT_GENIEAPI_POLL_MAX_WAIT_SECONDS = 300
+GENIEAPI_POLL_MAX_WAIT_SECONDS = float(
+    os.environ.get("GENIEAPI_POLL_MAX_WAIT_SECONDS", DEFAULT_GENIEAPI_POLL_MAX_WAIT_SECONDS)
+)
+DEFAULT_GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS = 10
+GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS = float(
+    os.environ.get("GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS", DEFAULT_GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS)
+)
+# When "true", use long-poll or SSE for /language_to_sql_process if the API advertises it
+GENIEAPI_SERVER_PUSH_ENABLED = os.environ.get("GENIEAPI_SERVER_PUSH_ENABLED", "true") == "true"
+
+# Slash command executor
+#
+DEFAULT_COMMAND_EXECUTOR_MAX_WORKERS = 8
+COMMAND_EXECUTOR_MAX_WORKERS = int(
+    os.environ.get("COMMAND_EXECUTOR_MAX_WORKERS", DEFAULT_COMMAND_EXECUTOR_MAX_WORKERS)
+)
+DEFAULT_COMMAND_EXECUTOR_MAX_QUEUE_SIZE = 64
+COMMAND_EXECUTOR_MAX_QUEUE_SIZE = int(
+    os.environ.get("COMMAND_EXECUTOR_MAX_QUEUE_SIZE", DEFAULT_COMMAND_EXECUTOR_MAX_QUEUE_SIZE)
+)
+DEFAULT_COMMAND_EXECUTOR_MAX_QUEUE_SIZE_PER_TEAM = 16
+COMMAND_EXECUTOR_MAX_QUEUE_SIZE_PER_TEAM = int(
+    os.environ.get("COMMAND_EXECUTOR_MAX_QUEUE_SIZE_PER_TEAM", DEFAULT_COMMAND_EXECUTOR_MAX_QUEUE_SIZE_PER_TEAM)
+)
+
+# Slack file uploads for query results
+#
+DEFAULT_SLACK_FILE_UPLOAD_CONCURRENCY = 4
+SLACK_FILE_UPLOAD_CONCURRENCY = int(
+    os.environ.get("SLACK_FILE_UPLOAD_CONCURRENCY", DEFAULT_SLACK_FILE_UPLOAD_CONCURRENCY)
+)
+# When "true", all files of an answer are shared with a single files_upload_v2 call
+SLACK_FILE_UPLOAD_BATCHED = os.environ.get("SLACK_FILE_UPLOAD_BATCHED", "false") == "true"
+# JSON and text files at least this large are uploaded gzipped (0 disables compression)
+DEFAULT_SLACK_FILE_UPLOAD_GZIP_MIN_BYTES = 0
+SLACK_FILE_UPLOAD_GZIP_MIN_BYTES = int(
+    os.environ.get("SLACK_FILE_UPLOAD_GZIP_MIN_BYTES", DEFAULT_SLACK_FILE_UPLOAD_GZIP_MIN_BYTES)
+)
+
+# Text tables rendered from query results
+#
+DEFAULT_SLACK_TABLE_MAX_ROWS = 1000
+SLACK_TABLE_MAX_ROWS = int(os.environ.get("SLACK_TABLE_MAX_ROWS", DEFAULT_SLACK_TABLE_MAX_ROWS))
+DEFAULT_SLACK_TABLE_MAX_COL_WIDTH = 80
+SLACK_TABLE_MAX_COL_WIDTH = int(os.environ.get("SLACK_TABLE_MAX_COL_WIDTH", DEFAULT_SLACK_TABLE_MAX_COL_WIDTH))
+
+# Memoized token counts of message contents
+#
+DEFAULT_TOKEN_COUNT_CACHE_SIZE = 8192
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", DEFAULT_TOKEN_COUNT_CACHE_SIZE))
+
+# chat.update pacing while streaming a reply
+#
+DEFAULT_SLACK_UPDATE_MIN_INTERVAL_SECONDS = 1.0
+SLACK_UPDATE_MIN_INTERVAL_SECONDS = float(
+    os.environ.get("SLACK_UPDATE_MIN_INTERVAL_SECONDS", DEFAULT_SLACK_UPDATE_MIN_INTERVAL_SECONDS)
+)
+DEFAULT_SLACK_UPDATE_MAX_INTERVAL_SECONDS = 10.0
+SLACK_UPDATE_MAX_INTERVAL_SECONDS = float(
+    os.environ.get("SLACK_UPDATE_MAX_INTERVAL_SECONDS", DEFAULT_SLACK_UPDATE_MAX_INTERVAL_SECONDS)
+)
+
+# Thread history cache
+#
+DEFAULT_SLACK_THREAD_CACHE_MAX_THREADS = 1000
+SLACK_THREAD_CACHE_MAX_THREADS = int(
+    os.environ.get("SLACK_THREAD_CACHE_MAX_THREADS", DEFAULT_SLACK_THREAD_CACHE_MAX_THREADS)
+)
+DEFAULT_SLACK_THREAD_CACHE_MAX_MESSAGES = 1000
+SLACK_THREAD_CACHE_MAX_MESSAGES = int(
+    os.environ.get("SLACK_THREAD_CACHE_MAX_MESSAGES", DEFAULT_SLACK_THREAD_CACHE_MAX_MESSAGES)
+)
+DEFAULT_SLACK_PARENT_MENTION_MEMO_SIZE = 10000
+SLACK_PARENT_MENTION_MEMO_SIZE = int(
+    os.environ.get("SLACK_PARENT_MENTION_MEMO_SIZE", DEFAULT_SLACK_PARENT_MENTION_MEMO_SIZE)
+)
+
+# DM history
+#
+DEFAULT_SLACK_DM_HISTORY_WINDOW_SECONDS = 86400
+SLACK_DM_HISTORY_WINDOW_SECONDS = int(
+    os.environ.get("SLACK_DM_HISTORY_WINDOW_SECONDS", DEFAULT_SLACK_DM_HISTORY_WINDOW_SECONDS)
+)
+DEFAULT_SLACK_DM_HISTORY_PAGE_SIZE = 50
+SLACK_DM_HISTORY_PAGE_SIZE = int(os.environ.get("SLACK_DM_HISTORY_PAGE_SIZE", DEFAULT_SLACK_DM_HISTORY_PAGE_SIZE))
+
+# Tracing: spans are appended as JSON lines to this file (empty disables exporting);
+# the trace context is sent to the Genie API in a W3C traceparent header either way
+#
+DEFAULT_TRACE_EXPORT_PATH = ""
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH", DEFAULT_TRACE_EXPORT_PATH)
+DEFAULT_TRACE_SAMPLE_RATIO = 1.0
+TRACE_SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", DEFAULT_TRACE_SAMPLE_RATIO))
+DEFAULT_TRACE_SERVICE_NAME = "genie-slack-bot"
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", DEFAULT_TRACE_SERVICE_NAME)
+
+# Logging: records are handed to a background writer thread unless LOG_QUEUE_ENABLED is "false";
+# LOG_FORMAT is "text" or "json", and longer messages are cut to LOG_MAX_FIELD_LENGTH characters
+#
+LOG_QUEUE_ENABLED = os.environ.get("LOG_QUEUE_ENABLED", "true") == "true"
+DEFAULT_LOG_FORMAT = "text"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", DEFAULT_LOG_FORMAT)
+DEFAULT_LOG_MAX_FIELD_LENGTH = 2000
+LOG_MAX_FIELD_LENGTH = int(os.environ.get("LOG_MAX_FIELD_LENGTH", DEFAULT_LOG_MAX_FIELD_LENGTH))
+# Share of DEBUG records that are written (1.0 = all)
+DEFAULT_LOG_DEBUG_SAMPLE_RATIO = 1.0
+LOG_DEBUG_SAMPLE_RATIO = float(os.environ.get("LOG_DEBUG_SAMPLE_RATIO", DEFAULT_LOG_DEBUG_SAMPLE_RATIO))
+
+# Slack event deduplication: event ids already handled are remembered for this long, so
+# Slack's retries (X-Slack-Retry-Num) don't run the same question again.
+# EVENT_DEDUP_BACKEND is "memory" (this process) or "sqlite" (shared by the processes on a node)
+#
+DEFAULT_EVENT_DEDUP_TTL_SECONDS = 900
+EVENT_DEDUP_TTL_SECONDS = float(os.environ.get("EVENT_DEDUP_TTL_SECONDS", DEFAULT_EVENT_DEDUP_TTL_SECONDS))
+DEFAULT_EVENT_DEDUP_MAX_SIZE = 10000
+EVENT_DEDUP_MAX_SIZE = int(os.environ.get("EVENT_DEDUP_MAX_SIZE", DEFAULT_EVENT_DEDUP_MAX_SIZE))
+DEFAULT_EVENT_DEDUP_BACKEND = "memory"
+EVENT_DEDUP_BACKEND = os.environ.get("EVENT_DEDUP_BACKEND", DEFAULT_EVENT_DEDUP_BACKEND)
+DEFAULT_EVENT_DEDUP_SQLITE_PATH = "data/events.sqlite3"
+EVENT_DEDUP_SQLITE_PATH = os.environ.get("EVENT_DEDUP_SQLITE_PATH", DEFAULT_EVENT_DEDUP_SQLITE_PATH)
+# How often the sqlite backend deletes expired event ids
+DEFAULT_EVENT_DEDUP_PRUNE_INTERVAL_SECONDS = 60
+EVENT_DEDUP_PRUNE_INTERVAL_SECONDS = float(
+    os.environ.get("EVENT_DEDUP_PRUNE_INTERVAL_SECONDS", DEFAULT_EVENT_DEDUP_PRUNE_INTERVAL_SECONDS)
+)
@@ -0,0 +1,160 @@
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from slack_bolt import BoltContext
+
+from app.env import (
+    COMMAND_EXECUTOR_MAX_WORKERS,
+    COMMAND_EXECUTOR_MAX_QUEUE_SIZE,
+    COMMAND_EXECUTOR_MAX_QUEUE_SIZE_PER_TEAM,
+)
+from app.metrics import SLASH_COMMANDS, QUEUE_GAUGES, WORKER_GAUGES
+
+DEFAULT_BUSY_TEXT = ":warning: Genie is handling a lot of requests right now. Please try again in a moment."
+
+logger = logging.getLogger(__name__)
+
+
+class FairBoundedExecutor:
+    """Runs slash command handlers on a fixed number of worker threads.
+
+    Pending tasks are queued per team and picked round-robin across teams, so a burst from one
+    workspace can't starve the others. submit() refuses new tasks once the overall queue or the
+    team's share of it is full, instead of spawning more threads.
+    """
+
+    def __init__(
+            self,
+            max_workers: int = COMMAND_EXECUTOR_MAX_WORKERS,
+            max_queue_size: int = COMMAND_EXECUTOR_MAX_QUEUE_SIZE,
+            max_queue_size_per_team: int = COMMAND_EXECUTOR_MAX_QUEUE_SIZE_PER_TEAM,
+            name: str = "command-worker",
+    ):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_queue_size_per_team = max_queue_size_per_team
+        self.name = name
+        self._queues: Dict[Optional[str], deque] = {}
+        self._teams: deque = deque()  # teams with pending tasks, in round-robin order
+        self._cond = threading.Condition()
+        self._queued = 0
+        self._active = 0
+        self._rejected = 0
+        self._workers = []
+        self._shutdown = False
+
+    def submit(self, team_id: Optional[str], fn: Callable, *args) -> bool:
+        with self._cond:
+            if self._shutdown:
+                return False
+            queue = self._queues.get(team_id)
+            if self._queued >= self.max_queue_size or (
+                    queue is not None and len(queue) >= self.max_queue_size_per_team
+            ):
+                self._rejected += 1
+                return False
+            if queue is None:
+                queue = self._queues[team_id] = deque()
+                self._teams.append(team_id)
+            queue.append((fn, args))
+            self._queued += 1
+            if len(self._workers) < self.max_workers and len(self._workers) < self._active + self._queued:
+                worker = threading.Thread(target=self._work, name=f"{self.name}-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify()
+            return True
+
+    def _next_task(self):
+        with self._cond:
+            while not self._teams and not self._shutdown:
+                self._cond.wait()
+            if not self._teams:
+                return None
+            team_id = self._teams.popleft()
+            queue = self._queues[team_id]
+            task = queue.popleft()
+            if queue:
+                self._teams.append(team_id)
+            else:
+                del self._queues[team_id]
+            self._queued -= 1
+            self._active += 1
+            return task
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.exception(f"FairBoundedExecutor, task failed, fn={getattr(fn, '__name__', fn)}, error={e}")
+            finally:
+                with self._cond:
+                    self._active -= 1
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return self._queued
+
+    def active_workers(self) -> int:
+        with self._cond:
+            return self._active
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queue_depth": self._queued,
+                "active_workers": self._active,
+                "workers": len(self._workers),
+                "max_workers": self.max_workers,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+command_executor = FairBoundedExecutor()
+QUEUE_GAUGES.set_function(command_executor.queue_depth, queue="command_executor")
+WORKER_GAUGES.set_function(command_executor.active_workers, executor="command_executor")
+
+
+def command_name(target: Callable) -> str:
+    # handle_set_db_table_func -> set_db_table
+    name = getattr(target, "__name__", str(target))
+    if name.startswith("handle_"):
+        name = name[len("handle_"):]
+    if name.endswith("_func"):
+        name = name[:-len("_func")]
+    return name
+
+
+def count_command(target: Callable, queued: bool):
+    SLASH_COMMANDS.inc(command=command_name(target), outcome="queued" if queued else "rejected")
+
+
+def submit_command(ack, respond, context: BoltContext, target: Callable, args: tuple) -> bool:
+    """Acknowledges the request and queues target(*args) on command_executor.
+
+    The ack happens here because a queued handler may not start within Slack's 3 second window.
+    When the executor is saturated, the user gets a friendly message instead.
+    """
+    ack()
+    queued = command_executor.submit(context.team_id, target, *args)
+    count_command(target, queued)
+    if queued:
+        return True
+    logger.warning(f"submit_command, executor saturated, team_id={context.team_id}, stats={command_executor.stats()}")
+    respond(text=DEFAULT_BUSY_TEXT)
+    return False
@@ -0,0 +1,130 @@
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.env import (
+    GENIEAPI_HOST,
+    GENIEAPI_POOL_SIZE,
+    GENIEAPI_CONNECT_TIMEOUT_SECONDS,
+    GENIEAPI_READ_TIMEOUT_SECONDS,
+)
+from app.metrics import GENIE_REQUEST_SECONDS
+from app.tracing import start_span, inject_headers
+
+
+class GenieApiClient:
+    """HTTP client for the Genie API backed by a single pooled, keep-alive requests.Session.
+
+    The session is shared by all worker threads. Per-request state (API key, params) is always
+    passed to the request itself, never stored on the session, and urllib3's connection pool is
+    thread-safe, so concurrent calls only contend for a free connection.
+    """
+
+    def __init__(
+            self,
+            base_url: str = GENIEAPI_HOST,
+            pool_size: int = GENIEAPI_POOL_SIZE,
+            connect_timeout: float = GENIEAPI_CONNECT_TIMEOUT_SECONDS,
+            read_timeout: float = GENIEAPI_READ_TIMEOUT_SECONDS,
+    ):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    # Retries are handled by the callers (see fetch_data_from_genieapi)
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_size,
+                        pool_maxsize=self.pool_size,
+                        max_retries=0,
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers["Connection"] = "keep-alive"
+                    self._session = session
+        return self._session
+
+    def url(self, endpoint: str) -> str:
+        return self.base_url + endpoint
+
+    def headers(self, api_key: Optional[str], extra: Optional[dict] = None) -> dict:
+        headers = {"X-API-Key": api_key}
+        if extra:
+            headers.update(extra)
+        return inject_headers(headers)
+
+    def request(self, method: str, endpoint: str, send) -> requests.Response:
+        """Sends the request in its own span and records its duration under the endpoint and status code."""
+        start, status = time.perf_counter(), "error"
+        try:
+            with start_span(f"genie {method} {endpoint}", **{"http.method": method, "http.route": endpoint}) as span:
+                response = send()
+                status = response.status_code
+                span.set_attributes(**{"http.status_code": status})
+                return response
+        finally:
+            GENIE_REQUEST_SECONDS.observe(time.perf_counter() - start, method=method, endpoint=endpoint, status=status)
+
+    def get(
+            self,
+            endpoint: str,
+            api_key: Optional[str],
+            params: Optional[dict] = None,
+            headers: Optional[dict] = None,
+            **kwargs,
+    ) -> requests.Response:
+        return self.request("GET", endpoint, lambda: self.session.get(
+            self.url(endpoint),
+            headers=self.headers(api_key, headers),
+            params=params,
+            timeout=kwargs.pop("timeout", self.timeout),
+            **kwargs,
+        ))
+
+    def post(
+            self,
+            endpoint: str,
+            api_key: Optional[str],
+            params: Optional[dict] = None,
+            json: Optional[dict] = None,
+            headers: Optional[dict] = None,
+            **kwargs,
+    ) -> requests.Response:
+        return self.request("POST", endpoint, lambda: self.session.post(
+            self.url(endpoint),
+            headers=self.headers(api_key, headers),
+            params=params,
+            json=json,
+            timeout=kwargs.pop("timeout", self.timeout),
+            **kwargs,
+        ))
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+_genie_client: Optional[GenieApiClient] = None
+_genie_client_lock = threading.Lock()
+
+
+def get_genie_client() -> GenieApiClient:
+    """Returns the process-wide GenieApiClient shared by all handlers."""
+    global _genie_client
+    if _genie_client is None:
+        with _genie_client_lock:
+            if _genie_client is None:
+                _genie_client = GenieApiClient()
+    return _genie_client
@@ -0,0 +1,175 @@
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from slack_bolt.request.payload_utils import is_event
+
+from app.env import (
+    EVENT_DEDUP_TTL_SECONDS,
+    EVENT_DEDUP_MAX_SIZE,
+    EVENT_DEDUP_BACKEND,
+    EVENT_DEDUP_SQLITE_PATH,
+    EVENT_DEDUP_PRUNE_INTERVAL_SECONDS,
+)
+from app.sqlite_store import SQLiteDatabase
+
+
+def event_dedup_keys(body: dict) -> List[str]:
+    """Returns the keys identifying an event delivery; retries of an event share them.
+
+    Slack keeps the event_id across retries. client_msg_id, scoped by event type, also catches
+    the same user message delivered again under a new event_id.
+    """
+    if not is_event(body):
+        return []
+    keys = []
+    if body.get("event_id"):
+        keys.append(f"event:{body['event_id']}")
+    event = body.get("event") or {}
+    if event.get("client_msg_id"):
+        keys.append(f"msg:{event.get('type')}:{event['client_msg_id']}")
+    return keys
+
+
+def retry_num(request) -> int:
+    """The X-Slack-Retry-Num header of a BoltRequest; 0 for a first delivery."""
+    values = request.headers.get("x-slack-retry-num") if request is not None else None
+    return int(values[0]) if values else 0
+
+
+def retry_reason(request) -> str:
+    values = request.headers.get("x-slack-retry-reason") if request is not None else None
+    return values[0] if values else ""
+
+
+class EventIdStore(ABC):
+    """Remembers processed event keys for ttl_seconds."""
+
+    @abstractmethod
+    def claim(self, key: str) -> bool:
+        """Records key and returns True, or returns False if it was already recorded and has not expired."""
+
+    def claim_all(self, keys: List[str]) -> bool:
+        """Claims every key; returns False if any of them had been claimed before."""
+        claimed = True
+        for key in keys:
+            # No short-circuit: the other keys must be recorded too
+            claimed = self.claim(key) and claimed
+        return claimed
+
+
+class InMemoryEventIdStore(EventIdStore):
+    def __init__(self, ttl_seconds: float = EVENT_DEDUP_TTL_SECONDS, max_size: int = EVENT_DEDUP_MAX_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        # key -> expiry (monotonic), oldest first
+        self._expiries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._expiries:
+                oldest_key, expiry = next(iter(self._expiries.items()))
+                if expiry > now and len(self._expiries) < self.max_size:
+                    break
+                del self._expiries[oldest_key]
+            if key in self._expiries:
+                return False
+            self._expiries[key] = now + self.ttl_seconds
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._expiries.clear()
+
+
+class SQLiteEventIdStore(EventIdStore):
+    """Event keys in a SQLite file, shared by the app processes running on one node.
+
+    An expired key can be claimed again right away; the expired rows themselves are deleted
+    at most once per prune_interval_seconds, not on every claim.
+    """
+
+    def __init__(
+            self,
+            path: str = EVENT_DEDUP_SQLITE_PATH,
+            ttl_seconds: float = EVENT_DEDUP_TTL_SECONDS,
+            prune_interval_seconds: float = EVENT_DEDUP_PRUNE_INTERVAL_SECONDS,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.prune_interval_seconds = prune_interval_seconds
+        self.db = SQLiteDatabase(
+            path,
+            "CREATE TABLE IF NOT EXISTS events (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS events_expires_at ON events (expires_at)",
+        )
+        self._next_prune = 0.0
+        self._prune_lock = threading.Lock()
+
+    def claim(self, key: str) -> bool:
+        now = time.time()
+        self._prune(now)
+        # Inserts the key, or takes over its row if that has expired; a single statement, so atomic
+        changed = self.db.execute(
+            "INSERT INTO events (key, expires_at) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE events.expires_at <= ?",
+            (key, now + self.ttl_seconds, now),
+        )
+        return changed == 1
+
+    def _prune(self, now: float):
+        with self._prune_lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + self.prune_interval_seconds
+        self.db.execute("DELETE FROM events WHERE expires_at <= ?", (now,))
+
+
+class TieredEventIdStore(EventIdStore):
+    """Answers repeats from memory and checks the shared store only for keys new to this process."""
+
+    def __init__(self, local: InMemoryEventIdStore, shared: EventIdStore):
+        self.local = local
+        self.shared = shared
+
+    def claim(self, key: str) -> bool:
+        if not self.local.claim(key):
+            return False
+        return self.shared.claim(key)
+
+
+EVENT_DEDUP_BACKENDS = ("memory", "sqlite")
+
+
+def create_event_id_store(backend: str = EVENT_DEDUP_BACKEND) -> EventIdStore:
+    if backend == "memory":
+        return InMemoryEventIdStore()
+    if backend == "sqlite":
+        return TieredEventIdStore(InMemoryEventIdStore(), SQLiteEventIdStore())
+    raise ValueError(f"Unknown EVENT_DEDUP_BACKEND: {backend} (expected one of {', '.join(EVENT_DEDUP_BACKENDS)})")
+
+
+_event_id_store: Optional[EventIdStore] = None
+_event_id_store_lock = threading.Lock()
+
+
+def get_event_id_store() -> EventIdStore:
+    """Returns the process-wide store for EVENT_DEDUP_BACKEND, created on first use."""
+    global _event_id_store
+    if _event_id_store is None:
+        with _event_id_store_lock:
+            if _event_id_store is None:
+                _event_id_store = create_event_id_store()
+    return _event_id_store
+
+
+def is_duplicate_event(body: dict, store: Optional[EventIdStore] = None) -> bool:
+    """Returns True if this event was delivered before, recording it otherwise."""
+    keys = event_dedup_keys(body)
+    if not keys:
+        return False
+    return not (store or get_event_id_store()).claim_all(keys)
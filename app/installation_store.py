@@ -0,0 +1,283 @@
+import asyncio
+from logging import Logger
+from typing import Optional
+
+from slack_sdk.oauth.installation_store import InstallationStore
+from slack_sdk.oauth.installation_store.async_installation_store import AsyncInstallationStore
+from slack_sdk.oauth.installation_store.models.bot import Bot
+from slack_sdk.oauth.installation_store.models.installation import Installation
+from slack_sdk.oauth.state_store import OAuthStateStore
+from slack_sdk.oauth.state_store.async_state_store import AsyncOAuthStateStore
+
+from app.env import (
+    SLACK_INSTALLATION_CACHE_TTL_SECONDS,
+    SLACK_INSTALLATION_CACHE_NEGATIVE_TTL_SECONDS,
+    SLACK_INSTALLATION_CACHE_MAX_SIZE,
+)
+from app.s3_config import ConfigCache, MISSING
+
+
+def team_cache_prefix(enterprise_id: Optional[str], team_id: Optional[str]) -> str:
+    return f"{enterprise_id or '-'}:{team_id or '-'}:"
+
+
+class CachingInstallationStore(InstallationStore, AsyncInstallationStore):
+    """Caches the bot and installation lookups of another installation store.
+
+    Found records are kept for ttl_seconds and misses for negative_ttl_seconds (shorter, as an
+    install handled by another node can't invalidate this one). Every save or delete made
+    through this store drops the cached entries of its team, so the revocation and uninstall
+    handlers, which go through app.installation_store, invalidate it as well.
+    """
+
+    def __init__(
+            self,
+            installation_store: InstallationStore,
+            ttl_seconds: float = SLACK_INSTALLATION_CACHE_TTL_SECONDS,
+            negative_ttl_seconds: float = SLACK_INSTALLATION_CACHE_NEGATIVE_TTL_SECONDS,
+            max_size: int = SLACK_INSTALLATION_CACHE_MAX_SIZE,
+    ):
+        self.underlying = installation_store
+        self.found = ConfigCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.not_found = ConfigCache(max_size=max_size, ttl_seconds=negative_ttl_seconds)
+
+    @property
+    def logger(self) -> Logger:
+        return self.underlying.logger
+
+    def _get(self, key: str):
+        value = self.found.get(key)
+        if value is MISSING:
+            value = self.not_found.get(key)
+        return value
+
+    def _set(self, key: str, value):
+        if value is None:
+            self.not_found.set(key, None)
+        else:
+            self.found.set(key, value)
+
+    def invalidate(self, enterprise_id: Optional[str], team_id: Optional[str]):
+        prefix = team_cache_prefix(enterprise_id, team_id)
+        self.found.invalidate_prefix(prefix)
+        self.not_found.invalidate_prefix(prefix)
+
+    @staticmethod
+    def bot_key(enterprise_id, team_id, is_enterprise_install) -> str:
+        return f"{team_cache_prefix(enterprise_id, team_id)}bot:{bool(is_enterprise_install)}"
+
+    @staticmethod
+    def installation_key(enterprise_id, team_id, user_id, is_enterprise_install) -> str:
+        return f"{team_cache_prefix(enterprise_id, team_id)}installation:{user_id or '-'}:{bool(is_enterprise_install)}"
+
+    #
+    # InstallationStore
+    #
+
+    def save(self, installation: Installation):
+        self.underlying.save(installation)
+        self.invalidate(installation.enterprise_id, installation.team_id)
+
+    def save_bot(self, bot: Bot):
+        self.underlying.save_bot(bot)
+        self.invalidate(bot.enterprise_id, bot.team_id)
+
+    def find_bot(
+            self,
+            *,
+            enterprise_id: Optional[str],
+            team_id: Optional[str],
+            is_enterprise_install: Optional[bool] = False,
+    ) -> Optional[Bot]:
+        key = self.bot_key(enterprise_id, team_id, is_enterprise_install)
+        bot = self._get(key)
+        if bot is MISSING:
+            bot = self.underlying.find_bot(
+                enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install
+            )
+            self._set(key, bot)
+        return bot
+
+    def find_installation(
+            self,
+            *,
+            enterprise_id: Optional[str],
+            team_id: Optional[str],
+            user_id: Optional[str] = None,
+            is_enterprise_install: Optional[bool] = False,
+    ) -> Optional[Installation]:
+        key = self.installation_key(enterprise_id, team_id, user_id, is_enterprise_install)
+        installation = self._get(key)
+        if installation is MISSING:
+            installation = self.underlying.find_installation(
+                enterprise_id=enterprise_id,
+                team_id=team_id,
+                user_id=user_id,
+                is_enterprise_install=is_enterprise_install,
+            )
+            self._set(key, installation)
+        return installation
+
+    def delete_bot(self, *, enterprise_id: Optional[str], team_id: Optional[str]) -> None:
+        self.underlying.delete_bot(enterprise_id=enterprise_id, team_id=team_id)
+        self.invalidate(enterprise_id, team_id)
+
+    def delete_installation(
+            self,
+            *,
+            enterprise_id: Optional[str],
+            team_id: Optional[str],
+            user_id: Optional[str] = None,
+    ) -> None:
+        self.underlying.delete_installation(enterprise_id=enterprise_id, team_id=team_id, user_id=user_id)
+        self.invalidate(enterprise_id, team_id)
+
+    def delete_all(self, *, enterprise_id: Optional[str], team_id: Optional[str]):
+        self.underlying.delete_all(enterprise_id=enterprise_id, team_id=team_id)
+        self.invalidate(enterprise_id, team_id)
+
+    #
+    # AsyncInstallationStore, for stores that implement it too (such as ThreadedInstallationStore)
+    #
+
+    async def async_save(self, installation: Installation):
+        await self.underlying.async_save(installation)
+        self.invalidate(installation.enterprise_id, installation.team_id)
+
+    async def async_save_bot(self, bot: Bot):
+        await self.underlying.async_save_bot(bot)
+        self.invalidate(bot.enterprise_id, bot.team_id)
+
+    async def async_find_bot(
+            self,
+            *,
+            enterprise_id: Optional[str],
+            team_id: Optional[str],
+            is_enterprise_install: Optional[bool] = False,
+    ) -> Optional[Bot]:
+        key = self.bot_key(enterprise_id, team_id, is_enterprise_install)
+        bot = self._get(key)
+        if bot is MISSING:
+            bot = await self.underlying.async_find_bot(
+                enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install
+            )
+            self._set(key, bot)
+        return bot
+
+    async def async_find_installation(
+            self,
+            *,
+            enterprise_id: Optional[str],
+            team_id: Optional[str],
+            user_id: Optional[str] = None,
+            is_enterprise_install: Optional[bool] = False,
+    ) -> Optional[Installation]:
+        key = self.installation_key(enterprise_id, team_id, user_id, is_enterprise_install)
+        installation = self._get(key)
+        if installation is MISSING:
+            installation = await self.underlying.async_find_installation(
+                enterprise_id=enterprise_id,
+                team_id=team_id,
+                user_id=user_id,
+                is_enterprise_install=is_enterprise_install,
+            )
+            self._set(key, installation)
+        return installation
+
+    async def async_delete_bot(self, *, enterprise_id: Optional[str], team_id: Optional[str]) -> None:
+        await self.underlying.async_delete_bot(enterprise_id=enterprise_id, team_id=team_id)
+        self.invalidate(enterprise_id, team_id)
+
+    async def async_delete_installation(
+            self,
+            *,
+            enterprise_id: Optional[str],
+            team_id: Optional[str],
+            user_id: Optional[str] = None,
+    ) -> None:
+        await self.underlying.async_delete_installation(enterprise_id=enterprise_id, team_id=team_id, user_id=user_id)
+        self.invalidate(enterprise_id, team_id)
+
+    async def async_delete_all(self, *, enterprise_id: Optional[str], team_id: Optional[str]):
+        await self.underlying.async_delete_all(enterprise_id=enterprise_id, team_id=team_id)
+        self.invalidate(enterprise_id, team_id)
+
+
+class ThreadedInstallationStore(InstallationStore, AsyncInstallationStore):
+    """Gives a blocking installation store real async methods by running its calls in a worker thread.
+
+    The async_* methods of AmazonS3InstallationStore call boto3 directly, which would block
+    the event loop on every lookup.
+    """
+
+    def __init__(self, installation_store: InstallationStore):
+        self.underlying = installation_store
+
+    @property
+    def logger(self) -> Logger:
+        return self.underlying.logger
+
+    def save(self, installation: Installation):
+        self.underlying.save(installation)
+
+    def save_bot(self, bot: Bot):
+        self.underlying.save_bot(bot)
+
+    def find_bot(self, **kwargs) -> Optional[Bot]:
+        return self.underlying.find_bot(**kwargs)
+
+    def find_installation(self, **kwargs) -> Optional[Installation]:
+        return self.underlying.find_installation(**kwargs)
+
+    def delete_bot(self, **kwargs) -> None:
+        self.underlying.delete_bot(**kwargs)
+
+    def delete_installation(self, **kwargs) -> None:
+        self.underlying.delete_installation(**kwargs)
+
+    def delete_all(self, **kwargs):
+        self.underlying.delete_all(**kwargs)
+
+    async def async_save(self, installation: Installation):
+        await asyncio.to_thread(self.underlying.save, installation)
+
+    async def async_save_bot(self, bot: Bot):
+        await asyncio.to_thread(self.underlying.save_bot, bot)
+
+    async def async_find_bot(self, **kwargs) -> Optional[Bot]:
+        return await asyncio.to_thread(self.underlying.find_bot, **kwargs)
+
+    async def async_find_installation(self, **kwargs) -> Optional[Installation]:
+        return await asyncio.to_thread(self.underlying.find_installation, **kwargs)
+
+    async def async_delete_bot(self, **kwargs) -> None:
+        await asyncio.to_thread(self.underlying.delete_bot, **kwargs)
+
+    async def async_delete_installation(self, **kwargs) -> None:
+        await asyncio.to_thread(self.underlying.delete_installation, **kwargs)
+
+    async def async_delete_all(self, **kwargs):
+        await asyncio.to_thread(self.underlying.delete_all, **kwargs)
+
+
+class ThreadedOAuthStateStore(OAuthStateStore, AsyncOAuthStateStore):
+    """Runs a blocking OAuth state store (such as AmazonS3OAuthStateStore) in a worker thread for async apps."""
+
+    def __init__(self, state_store: OAuthStateStore):
+        self.underlying = state_store
+
+    @property
+    def logger(self) -> Logger:
+        return self.underlying.logger
+
+    def issue(self, *args, **kwargs) -> str:
+        return self.underlying.issue(*args, **kwargs)
+
+    def consume(self, state: str) -> bool:
+        return self.underlying.consume(state)
+
+    async def async_issue(self, *args, **kwargs) -> str:
+        return await asyncio.to_thread(self.underlying.issue, *args, **kwargs)
+
+    async def async_consume(self, state: str) -> bool:
+        return await asyncio.to_thread(self.underlying.consume, state)
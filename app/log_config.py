@@ -0,0 +1,114 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from typing import Optional
+
+from app.env import (
+    LOG_QUEUE_ENABLED,
+    LOG_FORMAT,
+    LOG_MAX_FIELD_LENGTH,
+    LOG_DEBUG_SAMPLE_RATIO,
+)
+from app.tracing import current_span
+
+DEFAULT_TEXT_FORMAT = "%(asctime)s %(message)s"
+
+
+def truncate(value, max_length: int = LOG_MAX_FIELD_LENGTH) -> str:
+    """Returns str(value) cut to max_length characters, noting how much was left out."""
+    text = str(value)
+    if max_length <= 0 or len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}... ({len(text) - max_length} more characters)"
+
+
+class ContextFilter(logging.Filter):
+    """Samples DEBUG records, truncates messages and stamps records with the current trace id.
+
+    It runs in the thread that logs, where the current span is known, and before any
+    exception text is appended, so tracebacks are never cut.
+    """
+
+    def __init__(self, debug_sample_ratio: float = LOG_DEBUG_SAMPLE_RATIO, max_length: int = LOG_MAX_FIELD_LENGTH):
+        super().__init__()
+        self.debug_sample_ratio = debug_sample_ratio
+        self.max_length = max_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and self.debug_sample_ratio < 1.0 \
+                and random.random() >= self.debug_sample_ratio:
+            return False
+        record.msg = truncate(record.getMessage(), self.max_length)
+        record.args = None
+        span = current_span()
+        record.trace_id = span.trace_id if span is not None else ""
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and trace_id."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "trace_id", ""):
+            entry["trace_id"] = record.trace_id
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(
+        level,
+        fmt: str = DEFAULT_TEXT_FORMAT,
+        log_format: str = LOG_FORMAT,
+        use_queue: bool = LOG_QUEUE_ENABLED,
+        stream=None,
+):
+    """Configures the root logger in place of logging.basicConfig.
+
+    With use_queue, logging calls only put the record on a queue; a background thread
+    formats it and writes it to the stream, so slow stdout never blocks a worker.
+    """
+    global _listener
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(fmt))
+
+    root = logging.getLogger()
+    stop_logging()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.setLevel(level)
+
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        root.addHandler(queue_handler)
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler.addFilter(ContextFilter())
+        root.addHandler(handler)
+
+
+def stop_logging():
+    """Writes out the queued records and stops the background writer, if any."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -1,53 +1,107 @@
 import re
+from typing import Callable, List, Pattern, Tuple
 
+# Code blocks and inline code, which are never converted
+CODE_PATTERN = re.compile(r"(?s)(```.+?```|`[^`\n]+?`)")
 
-# Conversion from Slack mrkdwn to OpenAI markdown
-# See also: https://api.slack.com/reference/surfaces/formatting#basics
-def slack_to_markdown(content: str) -> str:
+SLACK_TO_MARKDOWN_RULES: List[Tuple[Pattern, str]] = [
+    (re.compile(r"\*(?!\s)([^\*\n]+?)(?<!\s)\*"), r"**\1**"),  # *bold* to **bold**
+    (re.compile(r"_(?!\s)([^_\n]+?)(?<!\s)_"), r"*\1*"),  # _italic_ to *italic*
+    (re.compile(r"~(?!\s)([^~\n]+?)(?<!\s)~"), r"~~\1~~"),  # ~strike~ to ~~strike~~
+]
+
+MARKDOWN_TO_SLACK_RULES: List[Tuple[Pattern, str]] = [
+    (
+        re.compile(r"\*\*\*(?!\s)([^\*\n]+?)(?<!\s)\*\*\*"),
+        r"_*\1*_",
+    ),  # ***bold italic*** to *_bold italic_*
+    (
+        re.compile(r"(?<![\*_])\*(?!\s)([^\*\n]+?)(?<!\s)\*(?![\*_])"),
+        r"_\1_",
+    ),  # *italic* to _italic_
+    (re.compile(r"\*\*(?!\s)([^\*\n]+?)(?<!\s)\*\*"), r"*\1*"),  # **bold** to *bold*
+    (re.compile(r"__(?!\s)([^_\n]+?)(?<!\s)__"), r"*\1*"),  # __bold__ to *bold*
+    (re.compile(r"~~(?!\s)([^~\n]+?)(?<!\s)~~"), r"~\1~"),  # ~~strike~~ to ~strike~
+]
+
+
+def convert_outside_code(content: str, rules: List[Tuple[Pattern, str]]) -> str:
     # Split the input string into parts based on code blocks and inline code
-    parts = re.split(r"(?s)(```.+?```|`[^`\n]+?`)", content)
+    parts = CODE_PATTERN.split(content)
 
-    # Apply the bold, italic, and strikethrough formatting to text not within code
-    result = ""
+    # Apply the formatting rules to text not within code
+    result = []
     for part in parts:
-        if part.startswith("```") or part.startswith("`"):
-            result += part
-        else:
-            for o, n in [
-                (r"\*(?!\s)([^\*\n]+?)(?<!\s)\*", r"**\1**"),  # *bold* to **bold**
-                (r"_(?!\s)([^_\n]+?)(?<!\s)_", r"*\1*"),  # _italic_ to *italic*
-                (r"~(?!\s)([^~\n]+?)(?<!\s)~", r"~~\1~~"),  # ~strike~ to ~~strike~~
-            ]:
-                part = re.sub(o, n, part)
-            result += part
-    return result
+        if not part.startswith("`"):
+            for pattern, replacement in rules:
+                part = pattern.sub(replacement, part)
+        result.append(part)
+    return "".join(result)
+
+
+# Conversion from Slack mrkdwn to OpenAI markdown
+# See also: https://api.slack.com/reference/surfaces/formatting#basics
+def slack_to_markdown(content: str) -> str:
+    return convert_outside_code(content, SLACK_TO_MARKDOWN_RULES)
 
 
 # Conversion from OpenAI markdown to Slack mrkdwn
 # See also: https://api.slack.com/reference/surfaces/formatting#basics
 def markdown_to_slack(content: str) -> str:
-    # Split the input string into parts based on code blocks and inline code
-    parts = re.split(r"(?s)(```.+?```|`[^`\n]+?`)", content)
+    return convert_outside_code(content, MARKDOWN_TO_SLACK_RULES)
 
-    # Apply the bold, italic, and strikethrough formatting to text not within code
-    result = ""
-    for part in parts:
-        if part.startswith("```") or part.startswith("`"):
-            result += part
-        else:
-            for o, n in [
-                (
-                    r"\*\*\*(?!\s)([^\*\n]+?)(?<!\s)\*\*\*",
-                    r"_*\1*_",
-                ),  # ***bold italic*** to *_bold italic_*
-                (
-                    r"(?<![\*_])\*(?!\s)([^\*\n]+?)(?<!\s)\*(?![\*_])",
-                    r"_\1_",
-                ),  # *italic* to _italic_
-                (r"\*\*(?!\s)([^\*\n]+?)(?<!\s)\*\*", r"*\1*"),  # **bold** to *bold*
-                (r"__(?!\s)([^_\n]+?)(?<!\s)__", r"*\1*"),  # __bold__ to *bold*
-                (r"~~(?!\s)([^~\n]+?)(?<!\s)~~", r"~\1~"),  # ~~strike~~ to ~strike~
-            ]:
-                part = re.sub(o, n, part)
-            result += part
-    return result
+
+def find_safe_end(content: str) -> int:
+    """Returns the length of the longest prefix of content that converts the same on its own.
+
+    Formatting never spans lines, so the prefix ends right after a line break outside of code,
+    and before any ``` that isn't closed yet (it may still open a code block). Text that starts
+    with a backtick is left as is, so neither side of the split may begin with one.
+    """
+    safe_end = 0
+    offset = 0
+    for index, part in enumerate(CODE_PATTERN.split(content)):
+        if index % 2 == 0:  # not code
+            # A ``` may also begin here and run into the next inline code
+            fence = content.find("```", offset, offset + len(part) + 2)
+            fence = fence - offset if fence != -1 else -1
+            if not part.startswith("`"):
+                newline = part.rfind("\n", 0, fence if fence != -1 else len(part))
+                while newline != -1 and content[offset + newline + 1:offset + newline + 2] in ("", "`"):
+                    newline = part.rfind("\n", 0, newline)
+                if newline != -1:
+                    safe_end = offset + newline + 1
+            if fence != -1:
+                break
+        offset += len(part)
+    return safe_end
+
+
+class IncrementalConverter:
+    """Converts streamed text chunk by chunk with one of the functions above.
+
+    Text is converted and committed up to the last safe line break; only the uncommitted tail
+    is reconverted when the whole result is needed.
+    """
+
+    def __init__(self, convert: Callable[[str], str] = markdown_to_slack):
+        self.convert = convert
+        self._converted: List[str] = []
+        self._pending = ""
+
+    def append(self, text: str) -> str:
+        """Adds text and returns the converted text committed by this call (possibly empty)."""
+        self._pending += text
+        end = find_safe_end(self._pending)
+        if end == 0:
+            return ""
+        converted = self.convert(self._pending[:end])
+        self._converted.append(converted)
+        self._pending = self._pending[end:]
+        return converted
+
+    def text(self, tail: str = "") -> str:
+        """Returns the conversion of everything appended so far, plus tail (which is not committed)."""
+        if len(self._converted) > 1:
+            self._converted = ["".join(self._converted)]
+        return "".join(self._converted) + self.convert(self._pending + tail)
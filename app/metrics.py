@@ -0,0 +1,222 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition, see https://prometheus.io/docs/instrumenting/exposition_formats/
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """The sample lines of this metric in the text exposition format."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self.label_values(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in items]
+
+
+class Gauge(Metric):
+    """A gauge whose values are read from callbacks when the metrics are rendered."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        with self._lock:
+            self._functions[self.label_values(labels)] = fn
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._functions.items())
+        lines = []
+        for key, fn in items:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> ([count per bucket, not cumulative], sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self.label_values(labels))
+            return entry[2] if entry is not None else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items()]
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, key, ("le", format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() for metric in metrics)
+
+
+registry = Registry()
+
+
+def render_metrics() -> str:
+    return registry.render()
+
+
+#
+# The app's metrics
+#
+
+STAGE_SECONDS = registry.register(Histogram(
+    "genie_stage_duration_seconds",
+    "Time spent per stage of handling a request (config_load, slack_history, genie_poll_wait).",
+    ["stage"],
+))
+GENIE_REQUEST_SECONDS = registry.register(Histogram(
+    "genie_api_request_duration_seconds",
+    "Duration of each Genie API request.",
+    ["method", "endpoint", "status"],
+))
+GENIE_RETRIES = registry.register(Counter(
+    "genie_api_retries_total",
+    "Genie API requests retried or polled again.",
+    ["endpoint"],
+))
+SLACK_UPLOAD_SECONDS = registry.register(Histogram(
+    "slack_upload_duration_seconds",
+    "Duration of each Slack call posting an answer (messages and file uploads).",
+    ["method"],
+))
+SLASH_COMMANDS = registry.register(Counter(
+    "slash_commands_total",
+    "Slash commands and actions handled, by handler and whether they were queued or rejected.",
+    ["command", "outcome"],
+))
+QUEUE_GAUGES = registry.register(Gauge(
+    "genie_queue_size",
+    "Tasks waiting in each executor queue (for upload_executor, also the uploads running).",
+    ["queue"],
+))
+WORKER_GAUGES = registry.register(Gauge(
+    "genie_active_workers",
+    "Worker threads busy in each executor.",
+    ["executor"],
+))
+SLACK_DUPLICATE_EVENTS = registry.register(Counter(
+    "slack_duplicate_events_total",
+    "Slack event deliveries dropped because the event was already handled.",
+    ["retry_reason"],
+))
+PROMPT_REF_MISSES = registry.register(Counter(
+    "prompt_ref_misses_total",
+    "Prompt refs in reply metadata that couldn't be resolved, so the default system text was used.",
+))
+THREADS = registry.register(Gauge("python_threads", "Live Python threads."))
+THREADS.set_function(threading.active_count)
@@ -1,6 +1,9 @@
+import hashlib
 import threading
 import time
 import re
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List, Dict, Any, Generator, Tuple
 
 import openai
@@ -11,8 +14,9 @@ import tiktoken
 from slack_bolt import BoltContext
 from slack_sdk.web import WebClient
 
-from app.markdown import slack_to_markdown, markdown_to_slack
-from app.slack_ops import update_wip_message
+from app.env import TOKEN_COUNT_CACHE_SIZE
+from app.markdown import slack_to_markdown, markdown_to_slack, IncrementalConverter
+from app.update_scheduler import WipMessageUpdater
 
 # ----------------------------
 # Internal functions
@@ -57,17 +61,23 @@ def messages_within_context_window(
     # > total tokens must be below the model’s maximum limit (e.g., 4096 tokens for gpt-3.5-turbo-0301)
     max_context_tokens = context_length(model) - MAX_TOKENS - 1
     num_context_tokens = 0  # Number of tokens in the context window just before the earliest message is deleted
-    while (num_tokens := calculate_num_tokens(messages)) > max_context_tokens:
-        removed = False
-        for i, message in enumerate(messages):
-            if message["role"] in ("user", "assistant"):
-                num_context_tokens = num_tokens
-                del messages[i]
-                removed = True
-                break
-        if not removed:
-            # Fall through and let the OpenAI error handler deal with it
+
+    # Count each message once, then walk the removable (user/assistant) messages oldest first,
+    # subtracting their cost until the rest fits. System messages are never removed.
+    costs = [calculate_message_num_tokens(message) for message in messages]
+    num_tokens = sum(costs) + 3  # every reply is primed with <|start|>assistant<|message|>
+    removed = set()
+    for i, message in enumerate(messages):
+        if num_tokens <= max_context_tokens:
             break
+        if message["role"] in ("user", "assistant"):
+            num_context_tokens = num_tokens
+            num_tokens -= costs[i]
+            removed.add(i)
+    # If it still doesn't fit, fall through and let the OpenAI error handler deal with it
+
+    if removed:
+        messages[:] = [message for i, message in enumerate(messages) if i not in removed]
     return messages, num_context_tokens, max_context_tokens
 
 
@@ -117,8 +127,14 @@ def consume_openai_stream_to_write_reply(
     start_time = time.time()
     assistant_reply: Dict[str, str] = {"role": "assistant", "content": ""}
     messages.append(assistant_reply)
-    word_count = 0
-    threads = []
+    formatter = AssistantReplyFormatter(translate_markdown)
+    updater = WipMessageUpdater(
+        client=client,
+        channel=context.channel_id,
+        ts=wip_reply["message"]["ts"],
+        messages=messages,
+        user=user_id,
+    )
     try:
         loading_character = " ... :writing_hand:"
         for chunk in stream:
@@ -130,56 +146,20 @@ def consume_openai_stream_to_write_reply(
                 break
             delta = item.get("delta")
             if delta.get("content") is not None:
-                word_count += 1
                 assistant_reply["content"] += delta.get("content")
-                if word_count >= 20:
-
-                    def update_message():
-                        assistant_reply_text = format_assistant_reply(
-                            assistant_reply["content"], translate_markdown
-                        )
-                        wip_reply["message"]["text"] = assistant_reply_text
-                        update_wip_message(
-                            client=client,
-                            channel=context.channel_id,
-                            ts=wip_reply["message"]["ts"],
-                            text=assistant_reply_text + loading_character,
-                            messages=messages,
-                            user=user_id,
-                        )
-
-                    thread = threading.Thread(target=update_message)
-                    thread.daemon = True
-                    thread.start()
-                    threads.append(thread)
-                    word_count = 0
-
-        for t in threads:
-            try:
-                if t.is_alive():
-                    t.join()
-            except Exception:
-                pass
-
-        assistant_reply_text = format_assistant_reply(
-            assistant_reply["content"], translate_markdown
-        )
+                formatter.append(delta.get("content"))
+                # Only format the text when the updater can send it;
+                # otherwise the latest chunks are picked up next time
+                if updater.wants_update():
+                    assistant_reply_text = formatter.text()
+                    wip_reply["message"]["text"] = assistant_reply_text
+                    updater.submit(assistant_reply_text + loading_character)
+
+        assistant_reply_text = formatter.text()
         wip_reply["message"]["text"] = assistant_reply_text
-        update_wip_message(
-            client=client,
-            channel=context.channel_id,
-            ts=wip_reply["message"]["ts"],
-            text=assistant_reply_text,
-            messages=messages,
-            user=user_id,
-        )
+        updater.close(assistant_reply_text)
     finally:
-        for t in threads:
-            try:
-                if t.is_alive():
-                    t.join()
-            except Exception:
-                pass
+        updater.close()
         try:
             stream.close()
         except Exception:
@@ -214,28 +194,30 @@ def context_length(
         raise NotImplementedError(error)
 
 
-def calculate_num_tokens(
-    messages: List[Dict[str, str]],
-    model: str = GPT_3_5_TURBO_0301_MODEL,
-) -> int:
-    """Returns the number of tokens used by a list of messages."""
+# Models whose token counting follows a pinned snapshot
+TOKEN_COUNT_MODEL_ALIASES = {
+    # Note that these models may change over time. Count tokens assuming their 0613 snapshots.
+    GPT_3_5_TURBO_MODEL: GPT_3_5_TURBO_0613_MODEL,
+    GPT_3_5_TURBO_16K_MODEL: GPT_3_5_TURBO_16K_0613_MODEL,
+    GPT_4_MODEL: GPT_4_0613_MODEL,
+    GPT_4_32K_MODEL: GPT_4_32K_0613_MODEL,
+}
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Returns the tiktoken encoding for model; each encoding is loaded once per process."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == GPT_3_5_TURBO_MODEL:
-        # Note that GPT_3_5_TURBO_MODEL may change over time. Return num tokens assuming GPT_3_5_TURBO_0613_MODEL.
-        return calculate_num_tokens(messages, model=GPT_3_5_TURBO_0613_MODEL)
-    if model == GPT_3_5_TURBO_16K_MODEL:
-        # Note that GPT_3_5_TURBO_16K_MODEL may change over time. Return num tokens assuming GPT_3_5_TURBO_16K_0613_MODEL.
-        return calculate_num_tokens(messages, model=GPT_3_5_TURBO_16K_0613_MODEL)
-    elif model == GPT_4_MODEL:
-        # Note that GPT_4_MODEL may change over time. Return num tokens assuming GPT_4_0613_MODEL.
-        return calculate_num_tokens(messages, model=GPT_4_0613_MODEL)
-    elif model == GPT_4_32K_MODEL:
-        # Note that GPT_4_32K_MODEL may change over time. Return num tokens assuming GPT_4_32K_0613_MODEL.
-        return calculate_num_tokens(messages, model=GPT_4_32K_0613_MODEL)
-    elif (
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def token_count_params(model: str) -> Tuple[tiktoken.Encoding, int, int]:
+    """Returns (encoding, tokens_per_message, tokens_per_name) for model."""
+    model = TOKEN_COUNT_MODEL_ALIASES.get(model, model)
+    if (
         model == GPT_3_5_TURBO_0301_MODEL
         or model == GPT_3_5_TURBO_0613_MODEL
         or model == GPT_3_5_TURBO_16K_0613_MODEL
@@ -259,51 +241,135 @@ def calculate_num_tokens(
             "for information on how messages are converted to tokens."
         )
         raise NotImplementedError(error)
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
+    return get_encoding(model), tokens_per_message, tokens_per_name
+
+
+# (encoding name, digest of the text) -> number of tokens, least recently used first
+_token_counts: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def count_tokens(encoding_name: str, text: str) -> int:
+    # Keyed by a 16-byte digest rather than the text: hashing is much cheaper than encoding,
+    # and the cache doesn't keep message bodies alive
+    key = (encoding_name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    with _token_counts_lock:
+        num_tokens = _token_counts.get(key)
+        if num_tokens is not None:
+            _token_counts.move_to_end(key)
+            return num_tokens
+    num_tokens = len(tiktoken.get_encoding(encoding_name).encode(text))
+    if TOKEN_COUNT_CACHE_SIZE > 0:
+        with _token_counts_lock:
+            _token_counts[key] = num_tokens
+            while len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+                _token_counts.popitem(last=False)
+    return num_tokens
+
+
+def clear_token_count_cache():
+    with _token_counts_lock:
+        _token_counts.clear()
+
+
+def calculate_message_num_tokens(
+    message: Dict[str, str],
+    model: str = GPT_3_5_TURBO_0301_MODEL,
+) -> int:
+    """Returns the number of tokens a single message adds to the prompt."""
+    encoding, tokens_per_message, tokens_per_name = token_count_params(model)
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += count_tokens(encoding.name, value)
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+
+# For models the tables above don't know: the smallest context window, counted with cl100k_base
+FALLBACK_CONTEXT_LENGTH = 4096
+FALLBACK_ENCODING_NAME = "cl100k_base"
+
+
+def history_token_budget(model: str) -> int:
+    """Returns how many prompt tokens leave room for a reply from model, assuming
+    FALLBACK_CONTEXT_LENGTH for models context_length doesn't support."""
+    try:
+        return context_length(model) - MAX_TOKENS
+    except NotImplementedError:
+        return FALLBACK_CONTEXT_LENGTH - MAX_TOKENS
+
+
+def estimate_message_num_tokens(message: Dict[str, str], model: str) -> int:
+    """Same as calculate_message_num_tokens, but counts with FALLBACK_ENCODING_NAME and
+    the gpt-4 message overhead for models it doesn't support."""
+    try:
+        return calculate_message_num_tokens(message, model)
+    except NotImplementedError:
+        num_tokens = 3
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += count_tokens(FALLBACK_ENCODING_NAME, value)
             if key == "name":
-                num_tokens += tokens_per_name
+                num_tokens += 1
+        return num_tokens
+
+
+def calculate_num_tokens(
+    messages: List[Dict[str, str]],
+    model: str = GPT_3_5_TURBO_0301_MODEL,
+) -> int:
+    """Returns the number of tokens used by a list of messages."""
+    num_tokens = 0
+    for message in messages:
+        num_tokens += calculate_message_num_tokens(message, model)
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
 
+# Leading newlines, then a prepended Slack user ID
+REPLY_PREFIX_PATTERN = re.compile("^\n*(?:<@U.*?>\\s?:\\s?)?")
+
+# OpenAI syntax tags, removed since Slack doesn't render them in a message
+CODE_FENCE_LANGUAGES = [
+    "[Rr]ust",
+    "[Rr]uby",
+    "[Ss]cala",
+    "[Kk]otlin",
+    "[Jj]ava",
+    "[Gg]o",
+    "[Ss]wift",
+    "[Oo]objective[Cc]",
+    "[Cc]",
+    "[Cc][+][+]",
+    "[Cc][Pp][Pp]",
+    "[Cc]sharp",
+    "[Mm][Aa][Tt][Ll][Aa][Bb]",
+    "[Jj][Ss][Oo][Nn]",
+    "[Ll]a[Tt]e[Xx]",
+    "bash",
+    "zsh",
+    "sh",
+    "[Ss][Qq][Ll]",
+    "[Pp][Hh][Pp]",
+    "[Pp][Ee][Rr][Ll]",
+    "[Jj]ava[Ss]cript",
+    "[Ty]ype[Ss]cript",
+    "[Pp]ython",
+]
+CODE_FENCE_LANGUAGE_PATTERN = re.compile("```\\s*(?:" + "|".join(CODE_FENCE_LANGUAGES) + ")\n")
+
+# What may follow an unterminated ``` and still turn into a syntax tag once more text arrives
+PARTIAL_CODE_FENCE_TAIL_PATTERN = re.compile("\\s*[A-Za-z+]*")
+
+
+def normalize_assistant_reply(content: str) -> str:
+    content = REPLY_PREFIX_PATTERN.sub("", content, count=1)
+    return CODE_FENCE_LANGUAGE_PATTERN.sub("```\n", content)
+
+
 # Format message from OpenAI to display in Slack
 def format_assistant_reply(content: str, translate_markdown: bool) -> str:
-    for o, n in [
-        # Remove leading newlines
-        ("^\n+", ""),
-        # Remove prepended Slack user ID
-        ("^<@U.*?>\\s?:\\s?", ""),
-        # Remove OpenAI syntax tags since Slack doesn't render them in a message
-        ("```\\s*[Rr]ust\n", "```\n"),
-        ("```\\s*[Rr]uby\n", "```\n"),
-        ("```\\s*[Ss]cala\n", "```\n"),
-        ("```\\s*[Kk]otlin\n", "```\n"),
-        ("```\\s*[Jj]ava\n", "```\n"),
-        ("```\\s*[Gg]o\n", "```\n"),
-        ("```\\s*[Ss]wift\n", "```\n"),
-        ("```\\s*[Oo]objective[Cc]\n", "```\n"),
-        ("```\\s*[Cc]\n", "```\n"),
-        ("```\\s*[Cc][+][+]\n", "```\n"),
-        ("```\\s*[Cc][Pp][Pp]\n", "```\n"),
-        ("```\\s*[Cc]sharp\n", "```\n"),
-        ("```\\s*[Mm][Aa][Tt][Ll][Aa][Bb]\n", "```\n"),
-        ("```\\s*[Jj][Ss][Oo][Nn]\n", "```\n"),
-        ("```\\s*[Ll]a[Tt]e[Xx]\n", "```\n"),
-        ("```\\s*bash\n", "```\n"),
-        ("```\\s*zsh\n", "```\n"),
-        ("```\\s*sh\n", "```\n"),
-        ("```\\s*[Ss][Qq][Ll]\n", "```\n"),
-        ("```\\s*[Pp][Hh][Pp]\n", "```\n"),
-        ("```\\s*[Pp][Ee][Rr][Ll]\n", "```\n"),
-        ("```\\s*[Jj]ava[Ss]cript\n", "```\n"),
-        ("```\\s*[Ty]ype[Ss]cript\n", "```\n"),
-        ("```\\s*[Pp]ython\n", "```\n"),
-    ]:
-        content = re.sub(o, n, content)
+    content = normalize_assistant_reply(content)
 
     # Convert from OpenAI markdown to Slack mrkdwn format
     if translate_markdown:
@@ -312,6 +378,59 @@ def format_assistant_reply(content: str, translate_markdown: bool) -> str:
     return content
 
 
+class AssistantReplyFormatter:
+    """Incremental format_assistant_reply for a streamed reply.
+
+    append() normalizes only the newly received text, except for a short tail that may still
+    turn into a syntax tag; text() returns what format_assistant_reply would for everything so far.
+    """
+
+    def __init__(self, translate_markdown: bool):
+        self.translate_markdown = translate_markdown
+        self._normalized = IncrementalConverter(markdown_to_slack if translate_markdown else str)
+        self._pending = ""
+        self._prefix_done = False
+
+    def append(self, text: str):
+        self._pending += text
+        if not self._prefix_done:
+            if not self._is_prefix_decidable():
+                return
+            self._pending = REPLY_PREFIX_PATTERN.sub("", self._pending, count=1)
+            self._prefix_done = True
+        end = self._safe_end()
+        if end > 0:
+            self._normalized.append(CODE_FENCE_LANGUAGE_PATTERN.sub("```\n", self._pending[:end]))
+            self._pending = self._pending[end:]
+
+    def _is_prefix_decidable(self) -> bool:
+        head = self._pending.lstrip("\n")
+        if head == "":
+            return False
+        if not (head.startswith("<@U") or "<@U".startswith(head)):
+            return True
+        # The user ID can't span lines, and at most ":" plus a whitespace follow a line break
+        newline = head.find("\n")
+        return newline != -1 and len(head) - newline > 2
+
+    def _safe_end(self) -> int:
+        # Only the last run of backticks can start a syntax tag that isn't complete yet
+        run_end = self._pending.rfind("`") + 1
+        if run_end == 0:
+            return len(self._pending)
+        if PARTIAL_CODE_FENCE_TAIL_PATTERN.fullmatch(self._pending, run_end) is None:
+            return len(self._pending)
+        return len(self._pending[:run_end].rstrip("`"))
+
+    def text(self) -> str:
+        if self._prefix_done:
+            tail = CODE_FENCE_LANGUAGE_PATTERN.sub("```\n", self._pending)
+        else:
+            tail = normalize_assistant_reply(self._pending)
+        # Convert from OpenAI markdown to Slack mrkdwn format (when enabled)
+        return self._normalized.text(tail)
+
+
 def build_system_text(
     system_text_template: str, translate_markdown: bool, context: BoltContext
 ):
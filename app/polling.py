@@ -0,0 +1,107 @@
+import json
+import random
+import time
+from typing import Iterator, Optional
+
+from app.env import (
+    GENIEAPI_POLL_INITIAL_DELAY_SECONDS,
+    GENIEAPI_POLL_MAX_DELAY_SECONDS,
+    GENIEAPI_POLL_MAX_WAIT_SECONDS,
+    GENIEAPI_SERVER_PUSH_ENABLED,
+)
+from app.genie_client import GenieApiClient
+
+PUSH_MODE_LONG_POLL = "long_poll"
+PUSH_MODE_SSE = "sse"
+
+
+class BackoffSchedule:
+    """Jittered exponential backoff for polling the Genie API.
+
+    Iterating yields the delays to sleep between attempts: initial_delay, initial_delay * multiplier, ...
+    capped at max_delay, each randomized by +/- jitter. Iteration stops once max_wait seconds have
+    elapsed since the iterator was created, so a poll never blocks a worker longer than that.
+    """
+
+    def __init__(
+            self,
+            initial_delay: float = GENIEAPI_POLL_INITIAL_DELAY_SECONDS,
+            max_delay: float = GENIEAPI_POLL_MAX_DELAY_SECONDS,
+            max_wait: float = GENIEAPI_POLL_MAX_WAIT_SECONDS,
+            multiplier: float = 2.0,
+            jitter: float = 0.2,
+    ):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        base = min(self.max_delay, self.initial_delay * (self.multiplier ** attempt))
+        return min(self.max_delay, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def __iter__(self) -> Iterator[float]:
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield min(self.delay(attempt), remaining)
+            attempt += 1
+
+
+def server_push_mode(initial_response: Optional[dict]) -> Optional[dict]:
+    """Returns the server-push settings advertised by a /language_to_sql response, if any.
+
+    The API advertises them as {"push": {"mode": "long_poll", "wait_seconds": 25}}
+    or {"push": {"mode": "sse", "endpoint": "/language_to_sql_events"}}.
+    """
+    if not GENIEAPI_SERVER_PUSH_ENABLED or not isinstance(initial_response, dict):
+        return None
+    push = initial_response.get("push")
+    if not isinstance(push, dict) or push.get("mode") not in (PUSH_MODE_LONG_POLL, PUSH_MODE_SSE):
+        return None
+    return push
+
+
+def read_sse_result(
+        genie_client: GenieApiClient,
+        endpoint: str,
+        api_key: Optional[str],
+        params: dict,
+        max_wait: float = GENIEAPI_POLL_MAX_WAIT_SECONDS,
+) -> Optional[dict]:
+    """Waits on a Server-Sent Events stream until the API sends the "result" event.
+
+    Returns the decoded result, or None if the stream ended without one.
+    """
+    connect_timeout, _ = genie_client.timeout
+    with genie_client.get(
+            endpoint,
+            api_key,
+            params=params,
+            headers={"Accept": "text/event-stream"},
+            stream=True,
+            timeout=(connect_timeout, max_wait),
+    ) as response:
+        response.raise_for_status()
+        event_name = None
+        data_lines = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == "":
+                # A blank line terminates one event
+                if event_name == "result" and data_lines:
+                    return json.loads("\n".join(data_lines))
+                event_name = None
+                data_lines = []
+            elif line.startswith("event:"):
+                event_name = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data_lines.append(line[len("data:"):].lstrip())
+        if event_name == "result" and data_lines:
+            return json.loads("\n".join(data_lines))
+    return None
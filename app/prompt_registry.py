@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from app.env import (
+    SYSTEM_TEXT,
+    PROMPT_VERSION,
+    PROMPT_REGISTRY_MAX_SIZE,
+    PROMPT_REGISTRY_BACKEND,
+    PROMPT_REGISTRY_SQLITE_PATH,
+)
+from app.metrics import PROMPT_REF_MISSES
+from app.sqlite_store import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+# Identifies the system prompt template the refs below were made from;
+# derived from SYSTEM_TEXT unless PROMPT_VERSION is set
+prompt_version = PROMPT_VERSION or hashlib.sha256(SYSTEM_TEXT.encode("utf-8")).hexdigest()[:8]
+
+_prompts: "OrderedDict[str, str]" = OrderedDict()
+_prompts_lock = threading.Lock()
+
+
+class SQLitePromptStore:
+    """Prompt texts in a SQLite file keyed by ref, shared by the app processes on one node and kept across restarts."""
+
+    def __init__(self, path: str = PROMPT_REGISTRY_SQLITE_PATH):
+        self.path = path
+        self.db = SQLiteDatabase(path, "CREATE TABLE IF NOT EXISTS prompts (ref TEXT PRIMARY KEY, content TEXT NOT NULL)")
+
+    def save(self, ref: str, content: str):
+        # A ref is a hash of its content, so an existing row never needs replacing
+        self.db.execute("INSERT OR IGNORE INTO prompts (ref, content) VALUES (?, ?)", (ref, content))
+
+    def load(self, ref: str) -> Optional[str]:
+        row = self.db.fetchone("SELECT content FROM prompts WHERE ref = ?", (ref,))
+        return row[0] if row is not None else None
+
+
+PROMPT_REGISTRY_BACKENDS = ("memory", "sqlite")
+
+_prompt_store: Optional[SQLitePromptStore] = None
+_prompt_store_lock = threading.Lock()
+
+
+def get_prompt_store() -> Optional[SQLitePromptStore]:
+    """Returns the durable store for PROMPT_REGISTRY_BACKEND, created on first use, or None for "memory"."""
+    global _prompt_store
+    if PROMPT_REGISTRY_BACKEND == "memory":
+        return None
+    if PROMPT_REGISTRY_BACKEND != "sqlite":
+        raise ValueError(
+            f"Unknown PROMPT_REGISTRY_BACKEND: {PROMPT_REGISTRY_BACKEND} "
+            f"(expected one of {', '.join(PROMPT_REGISTRY_BACKENDS)})"
+        )
+    if _prompt_store is None:
+        with _prompt_store_lock:
+            if _prompt_store is None:
+                _prompt_store = SQLitePromptStore()
+    return _prompt_store
+
+
+def _remember(ref: str, content: str) -> bool:
+    """Puts content in the in-memory LRU; returns False if it was already there."""
+    with _prompts_lock:
+        if ref in _prompts:
+            _prompts.move_to_end(ref)
+            return False
+        _prompts[ref] = content
+        while len(_prompts) > PROMPT_REGISTRY_MAX_SIZE:
+            _prompts.popitem(last=False)
+        return True
+
+
+def prompt_ref(content: str) -> str:
+    """Returns a short reference to content ("<prompt version>:<hash>") and keeps content to resolve it later."""
+    ref = f"{prompt_version}:{hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]}"
+    if _remember(ref, content):
+        store = get_prompt_store()
+        if store is not None:
+            store.save(ref, content)
+    return ref
+
+
+def resolve_prompt_ref(ref: str) -> Optional[str]:
+    with _prompts_lock:
+        content = _prompts.get(ref)
+    if content is not None:
+        return content
+    store = get_prompt_store()
+    content = store.load(ref) if store is not None else None
+    if content is not None:
+        _remember(ref, content)
+    return content
+
+
+def prompt_metadata_payload(messages: List[Dict[str, str]], user: str) -> dict:
+    """The event_payload of a bot reply's metadata: refs to its system messages instead of their text."""
+    return {
+        "prompt_refs": [prompt_ref(msg["content"]) for msg in messages if msg["role"] == "system"],
+        "user": user,
+    }
+
+
+def metadata_system_messages(event_payload: dict, default_system_text: str) -> Optional[List[Dict[str, str]]]:
+    """Returns the system messages recorded in a bot reply's metadata, or None if it has none.
+
+    Replies posted before prompt refs carry the messages themselves. A ref that can't be
+    resolved (evicted, made on another node, or made before a restart unless
+    PROMPT_REGISTRY_BACKEND is "sqlite") falls back to default_system_text, and is logged and counted.
+    """
+    if event_payload.get("messages") is not None:
+        return list(event_payload["messages"])
+    refs = event_payload.get("prompt_refs")
+    if refs is None:
+        return None
+    messages = []
+    for ref in refs:
+        content = resolve_prompt_ref(ref)
+        if content is None:
+            logger.warning(f"metadata_system_messages, unresolved prompt ref {ref}, using the default system text")
+            PROMPT_REF_MISSES.inc()
+            content = default_system_text
+        messages.append({"role": "system", "content": content})
+    return messages
@@ -0,0 +1,72 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Pattern, Tuple
+
+from app.env import (
+    REDACT_EMAIL_PATTERN,
+    REDACT_PHONE_PATTERN,
+    REDACT_CREDIT_CARD_PATTERN,
+    REDACT_SSN_PATTERN,
+    REDACT_USER_DEFINED_PATTERN,
+    REDACTION_MEMO_SIZE,
+)
+
+# (group name, pattern, replacement), in the order redact_string has always applied them
+REDACTION_RULES: List[Tuple[str, str, str]] = [
+    ("email", REDACT_EMAIL_PATTERN, "[EMAIL]"),
+    ("credit_card", REDACT_CREDIT_CARD_PATTERN, "[CREDIT CARD]"),
+    ("phone", REDACT_PHONE_PATTERN, "[PHONE]"),
+    ("ssn", REDACT_SSN_PATTERN, "[SSN]"),
+    ("user_defined", REDACT_USER_DEFINED_PATTERN, "[REDACTED]"),
+]
+
+
+class Redactor:
+    """Applies the rules one after the other, each to the output of the previous one.
+
+    The patterns are compiled once. They are not merged into one alternation: a single
+    leftmost-first scan can consume text that a later rule would have matched on the
+    rescanned output (e.g. an SSN run into a phone number), and leak it.
+    """
+
+    def __init__(self, rules: List[Tuple[str, str, str]] = REDACTION_RULES):
+        self.patterns: List[Tuple[Pattern, str]] = [
+            (re.compile(pattern), replacement) for _, pattern, replacement in rules
+        ]
+
+    def redact(self, text: str) -> str:
+        for pattern, replacement in self.patterns:
+            text = pattern.sub(replacement, text)
+        return text
+
+
+class MessageRedactionMemo:
+    """Remembers the redacted text of Slack messages by ts, so replaying a thread only
+    redacts the messages that are new or were edited since."""
+
+    def __init__(self, redactor: Redactor, max_size: int = REDACTION_MEMO_SIZE):
+        self.redactor = redactor
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def redact(self, ts: Optional[str], text: str) -> str:
+        if ts is None or self.max_size <= 0:
+            return self.redactor.redact(text)
+        with self._lock:
+            entry = self._entries.get(ts)
+            if entry is not None and entry[0] == text:
+                self._entries.move_to_end(ts)
+                return entry[1]
+        redacted = self.redactor.redact(text)
+        with self._lock:
+            self._entries[ts] = (text, redacted)
+            self._entries.move_to_end(ts)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return redacted
+
+
+default_redactor = Redactor()
+message_redaction_memo = MessageRedactionMemo(default_redactor)
@@ -0,0 +1,250 @@
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from app.env import (
+    S3_CONFIG_CACHE_TTL_SECONDS,
+    S3_CONFIG_CACHE_MAX_SIZE,
+    S3_CONFIG_WRITE_MAX_ATTEMPTS,
+    S3_CONFIG_WRITE_COALESCE_SECONDS,
+)
+
+# Returned by ConfigCache.get() when the key is not cached (None is a valid cached value)
+MISSING = object()
+
+
+class ConfigCache:
+    """Bounded LRU cache with a TTL per entry, keyed by S3 bucket key.
+
+    A cached value of None means "the object does not exist in S3" (negative caching).
+    """
+
+    def __init__(self, max_size: int = S3_CONFIG_CACHE_MAX_SIZE, ttl_seconds: float = S3_CONFIG_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl_seconds > 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Optional[str]):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_prefix(self, prefix: str):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+config_cache = ConfigCache()
+
+
+def load_s3_config(s3_client, bucket_name: str, key: str) -> Optional[str]:
+    """Returns the raw config object stored under key, or None if it does not exist.
+
+    Reads go through config_cache, so S3 is hit at most once per TTL per key.
+    """
+    cached = config_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    return _fetch_s3_config(s3_client, bucket_name, key)
+
+
+def _fetch_s3_config(s3_client, bucket_name: str, key: str) -> Optional[str]:
+    try:
+        s3_response = s3_client.get_object(Bucket=bucket_name, Key=key)
+        config_str: Optional[str] = s3_response["Body"].read().decode("utf-8")
+    except s3_client.exceptions.NoSuchKey:
+        config_str = None
+
+    config_cache.set(key, config_str)
+    return config_str
+
+
+async def async_load_s3_config(s3_client, bucket_name: str, key: str) -> Optional[str]:
+    """Same as load_s3_config, but runs the blocking boto3 call in a worker thread on a cache miss."""
+    cached = config_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    return await asyncio.to_thread(_fetch_s3_config, s3_client, bucket_name, key)
+
+
+def invalidate_s3_config(key: str):
+    config_cache.invalidate(key)
+
+
+class ConfigWriteConflict(Exception):
+    """Raised when a config object kept changing under update_s3_config until it gave up."""
+
+
+# Error codes S3 answers a conditional put with when the object changed in between
+CONDITIONAL_WRITE_CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+
+def supports_conditional_writes(s3_client) -> bool:
+    """Whether the installed botocore knows PutObject's IfMatch (S3 conditional writes)."""
+    try:
+        members = s3_client.meta.service_model.operation_model("PutObject").input_shape.members
+    except Exception:
+        return False
+    return "IfMatch" in members
+
+
+# The If-Match / If-None-Match headers of the put_object call running in this context
+_put_condition_headers: contextvars.ContextVar = contextvars.ContextVar("put_condition_headers", default=None)
+
+
+def _add_put_condition_headers(request, **kwargs):
+    headers = _put_condition_headers.get()
+    if headers:
+        for name, value in headers.items():
+            request.headers[name] = value
+
+
+def conditional_put_object(s3_client, etag: Optional[str], **put_params):
+    """put_object that only succeeds if the object still has etag, or still doesn't exist when etag is None.
+
+    Botocore releases that predate S3 conditional writes don't accept IfMatch/IfNoneMatch, so for
+    them the headers are added to the request just before it is signed.
+    """
+    if supports_conditional_writes(s3_client):
+        condition = {"IfMatch": etag} if etag is not None else {"IfNoneMatch": "*"}
+        return s3_client.put_object(**put_params, **condition)
+
+    s3_client.meta.events.register(
+        "before-sign.s3.PutObject", _add_put_condition_headers, unique_id="genie-put-condition-headers"
+    )
+    token = _put_condition_headers.set({"If-Match": etag} if etag is not None else {"If-None-Match": "*"})
+    try:
+        return s3_client.put_object(**put_params)
+    finally:
+        _put_condition_headers.reset(token)
+
+
+def update_s3_config(
+        s3_client,
+        bucket_name: str,
+        key: str,
+        changes: Dict[str, str],
+        max_attempts: int = S3_CONFIG_WRITE_MAX_ATTEMPTS,
+) -> dict:
+    """Applies all changes to the JSON config under key in one read-modify-write, and returns the new config.
+
+    The put is conditional on the ETag that was read (or on the object not existing yet), so
+    a concurrent write is never lost: on a conflict the object is read again and the changes
+    reapplied, up to max_attempts times.
+    """
+    for _ in range(max(max_attempts, 1)):
+        try:
+            s3_response = s3_client.get_object(Bucket=bucket_name, Key=key)
+            etag = s3_response.get("ETag")
+            data = json.loads(s3_response["Body"].read().decode("utf-8"))
+        except s3_client.exceptions.NoSuchKey:
+            etag = None
+            data = {}
+
+        data.update(changes)
+        body = json.dumps(data)
+        try:
+            conditional_put_object(s3_client, etag, Bucket=bucket_name, Key=key, Body=body)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in CONDITIONAL_WRITE_CONFLICT_CODES:
+                continue
+            raise
+        config_cache.set(key, body)
+        return data
+    invalidate_s3_config(key)
+    raise ConfigWriteConflict(f"The config {key} kept changing, gave up after {max_attempts} attempts")
+
+
+class ConfigWriteCoalescer:
+    """Merges the changes to the same config object that are issued within window_seconds.
+
+    The first caller waits for the window, then writes everyone's changes with a single
+    update_s3_config; the others wait for that write and share its result (or error).
+    With window_seconds <= 0, every call writes right away.
+    """
+
+    def __init__(self, window_seconds: float = S3_CONFIG_WRITE_COALESCE_SECONDS):
+        self.window_seconds = window_seconds
+        self._pending: Dict[Tuple[str, str], Tuple[Dict[str, str], Future]] = {}
+        self._lock = threading.Lock()
+
+    def update(self, s3_client, bucket_name: str, key: str, changes: Dict[str, str]) -> dict:
+        if self.window_seconds <= 0:
+            return update_s3_config(s3_client, bucket_name, key, changes)
+
+        with self._lock:
+            pending = self._pending.get((bucket_name, key))
+            is_leader = pending is None
+            if is_leader:
+                pending = ({}, Future())
+                self._pending[(bucket_name, key)] = pending
+            merged_changes, future = pending
+            merged_changes.update(changes)
+
+        if is_leader:
+            time.sleep(self.window_seconds)
+            with self._lock:
+                del self._pending[(bucket_name, key)]
+            try:
+                future.set_result(update_s3_config(s3_client, bucket_name, key, merged_changes))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+config_write_coalescer = ConfigWriteCoalescer()
@@ -0,0 +1,316 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from slack_sdk.web import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
+
+from app.env import (
+    SLACK_THREAD_CACHE_MAX_THREADS,
+    SLACK_THREAD_CACHE_MAX_MESSAGES,
+    SLACK_PARENT_MENTION_MEMO_SIZE,
+    SLACK_DM_HISTORY_WINDOW_SECONDS,
+    SLACK_DM_HISTORY_PAGE_SIZE,
+)
+from app.metrics import STAGE_SECONDS
+
+
+def ts_key(message: dict) -> float:
+    return float(message.get("ts") or 0)
+
+
+class ThreadHistory:
+    """The cached messages of one thread, keyed by ts.
+
+    fetched_ts is the newest ts confirmed by conversations.replies; messages appended from
+    event payloads may be newer, but there may be gaps before them until the next fetch.
+    """
+
+    def __init__(self):
+        self.messages: Dict[str, dict] = {}
+        self.fetched_ts: Optional[str] = None
+        self.bot_reply_ts: Optional[str] = None
+
+    def fetch_oldest(self) -> Optional[str]:
+        """Returns the ts to fetch from: the newest fetched one, or the latest bot reply if older,
+        since bot replies keep changing while they are streamed."""
+        if self.bot_reply_ts is not None and float(self.bot_reply_ts) < float(self.fetched_ts):
+            return self.bot_reply_ts
+        return self.fetched_ts
+
+    def merge(self, messages: List[dict], fetched: bool, max_messages: int):
+        for message in messages:
+            ts = message.get("ts")
+            if ts is None:
+                continue
+            self.messages[ts] = message
+            if fetched and (self.fetched_ts is None or float(ts) > float(self.fetched_ts)):
+                self.fetched_ts = ts
+            if fetched and message.get("bot_id") is not None and (
+                    self.bot_reply_ts is None or float(ts) > float(self.bot_reply_ts)
+            ):
+                self.bot_reply_ts = ts
+        if len(self.messages) > max_messages:
+            ordered = sorted(self.messages.values(), key=ts_key)
+            # Keep the parent message, drop the oldest replies
+            kept = ordered[:1] + ordered[len(ordered) - max_messages + 1:]
+            self.messages = {m["ts"]: m for m in kept}
+
+    def sorted_messages(self) -> List[dict]:
+        return sorted(self.messages.values(), key=ts_key)
+
+
+class ThreadHistoryCache:
+    """LRU cache of thread histories, so each new message only costs a delta fetch.
+
+    The first lookup of a thread fetches it as a whole; later lookups only fetch the replies
+    posted since the last fetch (conversations.replies with oldest). Edits and deletions
+    arrive as message_changed / message_deleted events and are applied with apply_event.
+    """
+
+    def __init__(
+            self,
+            max_threads: int = SLACK_THREAD_CACHE_MAX_THREADS,
+            max_messages: int = SLACK_THREAD_CACHE_MAX_MESSAGES,
+    ):
+        self.max_threads = max_threads
+        self.max_messages = max_messages
+        self._threads: "OrderedDict[Tuple[str, str], ThreadHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, channel: str, thread_ts: str) -> ThreadHistory:
+        key = (channel, thread_ts)
+        entry = self._threads.get(key)
+        if entry is None:
+            entry = ThreadHistory()
+            self._threads[key] = entry
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        else:
+            self._threads.move_to_end(key)
+        return entry
+
+    def fetch_params(self, channel: str, thread_ts: str, latest_message: Optional[dict]) -> dict:
+        """Records latest_message (an event payload) and returns the conversations.replies params to call."""
+        with self._lock:
+            entry = self._entry(channel, thread_ts)
+            if latest_message is not None:
+                entry.merge([latest_message], fetched=False, max_messages=self.max_messages)
+            params = {
+                "channel": channel,
+                "ts": thread_ts,
+                "include_all_metadata": True,
+                "limit": 1000,
+            }
+            oldest = entry.fetch_oldest()
+            if oldest is not None:
+                params["oldest"] = oldest
+                params["inclusive"] = True
+            return params
+
+    def store(self, channel: str, thread_ts: str, fetched_messages: List[dict]) -> List[dict]:
+        """Merges a conversations.replies result and returns the whole thread, oldest first."""
+        with self._lock:
+            entry = self._entry(channel, thread_ts)
+            entry.merge(fetched_messages, fetched=True, max_messages=self.max_messages)
+            return entry.sorted_messages()
+
+    def apply_event(self, payload: dict):
+        """Applies a message_changed / message_deleted event to the cached thread, if any."""
+        channel = payload.get("channel")
+        subtype = payload.get("subtype")
+        if subtype == "message_changed":
+            message = payload.get("message") or {}
+        elif subtype == "message_deleted":
+            message = payload.get("previous_message") or {}
+        else:
+            return
+        ts = message.get("ts")
+        thread_ts = message.get("thread_ts") or ts
+        with self._lock:
+            entry = self._threads.get((channel, thread_ts))
+            if entry is None or ts not in entry.messages:
+                return
+            if subtype == "message_deleted":
+                del entry.messages[ts]
+            else:
+                # Events may come without metadata, so keep the fields only a fetch returns
+                entry.messages[ts] = {**entry.messages[ts], **message}
+
+    def clear(self):
+        with self._lock:
+            self._threads.clear()
+
+
+thread_history_cache = ThreadHistoryCache()
+
+
+class ParentMentionMemo:
+    """Remembers whether the parent message of a thread mentions the bot, keyed by (channel, thread_ts).
+
+    Filled from the events the app receives and from parents it looks up, so threads that are
+    already classified need no conversations.history call. An edit or deletion of the parent
+    drops its entry.
+    """
+
+    def __init__(self, max_size: int = SLACK_PARENT_MENTION_MEMO_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], bool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, channel: str, thread_ts: str) -> Optional[bool]:
+        with self._lock:
+            key = (channel, thread_ts)
+            mentioned = self._entries.get(key)
+            if mentioned is not None:
+                self._entries.move_to_end(key)
+            return mentioned
+
+    def put(self, channel: Optional[str], thread_ts: Optional[str], mentioned: bool):
+        if channel is None or thread_ts is None:
+            return
+        with self._lock:
+            key = (channel, thread_ts)
+            self._entries[key] = mentioned
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def apply_event(self, payload: dict):
+        """Drops the entry of a parent message that was edited or deleted."""
+        subtype = payload.get("subtype")
+        if subtype == "message_changed":
+            ts = (payload.get("message") or {}).get("ts")
+        elif subtype == "message_deleted":
+            ts = payload.get("deleted_ts") or (payload.get("previous_message") or {}).get("ts")
+        else:
+            return
+        with self._lock:
+            self._entries.pop((payload.get("channel"), ts), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+parent_mention_memo = ParentMentionMemo()
+
+
+def fetch_thread_messages(
+        client: WebClient,
+        channel: str,
+        thread_ts: str,
+        latest_message: Optional[dict] = None,
+        cache: ThreadHistoryCache = thread_history_cache,
+) -> List[dict]:
+    params = cache.fetch_params(channel, thread_ts, latest_message)
+    with STAGE_SECONDS.time(stage="slack_history"):
+        fetched = client.conversations_replies(**params).get("messages", [])
+    return cache.store(channel, thread_ts, fetched)
+
+
+async def async_fetch_thread_messages(
+        client: AsyncWebClient,
+        channel: str,
+        thread_ts: str,
+        latest_message: Optional[dict] = None,
+        cache: ThreadHistoryCache = thread_history_cache,
+) -> List[dict]:
+    params = cache.fetch_params(channel, thread_ts, latest_message)
+    with STAGE_SECONDS.time(stage="slack_history"):
+        fetched = (await client.conversations_replies(**params)).get("messages", [])
+    return cache.store(channel, thread_ts, fetched)
+
+
+def dm_history_params(channel: str, window_seconds: int, page_size: int) -> dict:
+    return {
+        "channel": channel,
+        "oldest": f"{time.time() - window_seconds:.6f}",
+        "include_all_metadata": True,
+        "limit": page_size,
+    }
+
+
+def next_cursor(response) -> Optional[str]:
+    if not response.get("has_more"):
+        return None
+    return (response.get("response_metadata") or {}).get("next_cursor") or None
+
+
+def iter_dm_history(
+        client: WebClient,
+        channel: str,
+        window_seconds: int = SLACK_DM_HISTORY_WINDOW_SECONDS,
+        page_size: int = SLACK_DM_HISTORY_PAGE_SIZE,
+) -> Iterator[dict]:
+    """Yields the messages of the last window_seconds, newest first, fetching pages only as they are consumed."""
+    params = dm_history_params(channel, window_seconds, page_size)
+    while True:
+        with STAGE_SECONDS.time(stage="slack_history"):
+            response = client.conversations_history(**params)
+        yield from response.get("messages", [])
+        cursor = next_cursor(response)
+        if cursor is None:
+            return
+        params["cursor"] = cursor
+
+
+async def async_iter_dm_history(
+        client: AsyncWebClient,
+        channel: str,
+        window_seconds: int = SLACK_DM_HISTORY_WINDOW_SECONDS,
+        page_size: int = SLACK_DM_HISTORY_PAGE_SIZE,
+) -> AsyncIterator[dict]:
+    params = dm_history_params(channel, window_seconds, page_size)
+    while True:
+        with STAGE_SECONDS.time(stage="slack_history"):
+            response = await client.conversations_history(**params)
+        for message in response.get("messages", []):
+            yield message
+        cursor = next_cursor(response)
+        if cursor is None:
+            return
+        params["cursor"] = cursor
+
+
+class TokenBudget:
+    """Collects newest-first messages until their token count reaches the budget."""
+
+    def __init__(self, token_budget: int, count_tokens: Callable[[dict], int]):
+        self.remaining = token_budget
+        self.count_tokens = count_tokens
+        self.messages: List[dict] = []
+
+    def add(self, message: dict) -> bool:
+        """Adds message and returns False once the budget is filled."""
+        self.messages.append(message)
+        self.remaining -= self.count_tokens(message)
+        return self.remaining > 0
+
+    def oldest_first(self) -> List[dict]:
+        return list(reversed(self.messages))
+
+
+def take_within_budget(
+        messages: Iterable[dict], token_budget: int, count_tokens: Callable[[dict], int]
+) -> List[dict]:
+    """Takes newest-first messages until token_budget is filled and returns them oldest first.
+
+    The message that fills the budget is kept, so trimming the context later has all it needs.
+    """
+    budget = TokenBudget(token_budget, count_tokens)
+    for message in messages:
+        if not budget.add(message):
+            break
+    return budget.oldest_first()
+
+
+async def async_take_within_budget(
+        messages: AsyncIterator[dict], token_budget: int, count_tokens: Callable[[dict], int]
+) -> List[dict]:
+    budget = TokenBudget(token_budget, count_tokens)
+    async for message in messages:
+        if not budget.add(message):
+            break
+    return budget.oldest_first()
@@ -1,15 +1,31 @@
+import asyncio
 import base64
-import io
+import contextvars
+import gzip
 import json
-import traceback
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Optional
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from slack_sdk.web import WebClient, SlackResponse
+from slack_sdk.web.async_client import AsyncWebClient, AsyncSlackResponse
 from slack_bolt import BoltContext
 
+from app.env import (
+    SLACK_FILE_UPLOAD_CONCURRENCY,
+    SLACK_FILE_UPLOAD_BATCHED,
+    SLACK_FILE_UPLOAD_GZIP_MIN_BYTES,
+)
+from app.prompt_registry import prompt_metadata_payload
+from app.metrics import SLACK_UPLOAD_SECONDS, QUEUE_GAUGES
+from app.tracing import traced
+from app.table_renderer import render_text_table
 from app.utils import DEFAULT_ERROR_TEXT
 
+logger = logging.getLogger(__name__)
+
 
 # ----------------------------
 # General operations in a channel
@@ -42,6 +58,15 @@ def is_no_mention_thread(context: BoltContext, parent_message: dict) -> bool:
 # ----------------------------
 
 
+def wip_message_metadata(messages: List[Dict[str, str]], user: str) -> dict:
+    # The system messages are referenced, not copied: their text stays in this process
+    return {
+        "event_type": "chat-gpt-convo",
+        "event_payload": prompt_metadata_payload(messages, user),
+    }
+
+
+@traced()
 def post_wip_message(
         *,
         client: WebClient,
@@ -51,28 +76,42 @@ def post_wip_message(
         messages: List[Dict[str, str]],
         user: str,
 ) -> SlackResponse:
-    system_messages = [msg for msg in messages if msg["role"] == "system"]
     return client.chat_postMessage(
         channel=channel,
         thread_ts=thread_ts,
         text=loading_text,
-        metadata={
-            "event_type": "chat-gpt-convo",
-            "event_payload": {"messages": system_messages, "user": user},
-        },
+        metadata=wip_message_metadata(messages, user),
     )
 
 
-def post_wip_message_with_attachment(
+@traced()
+async def async_post_wip_message(
+        *,
+        client: AsyncWebClient,
+        channel: str,
+        thread_ts: str,
+        loading_text: str,
+        messages: List[Dict[str, str]],
+        user: str,
+) -> AsyncSlackResponse:
+    return await client.chat_postMessage(
+        channel=channel,
+        thread_ts=thread_ts,
+        text=loading_text,
+        metadata=wip_message_metadata(messages, user),
+    )
+
+
+def build_wip_attachment_posts(
         *,
-        client: WebClient,
         channel: str,
         thread_ts: str,
         loading_text: list,
         messages: List[Dict[str, str]],
         user: str,
         context: BoltContext,
-):
+) -> List[Tuple[str, dict]]:
+    """Returns the Slack API calls (method name, kwargs) that deliver a Genie API result, in posting order."""
     try:
         sql = loading_text.get("sql_query", None)
         score = loading_text.get("score", 0)
@@ -82,8 +121,7 @@ def post_wip_message_with_attachment(
         ai_response = loading_text.get("ai_response", "")
         chat_history_id = loading_text.get("chat_history_id", "")
     except Exception as e:
-        traceback.print_exc()
-        print(f"post_wip_message_with_attachment, error={e}")
+        logger.exception(f"post_wip_message_with_attachment, error={e}")
         sql = None
         score = None
         json_obj = None
@@ -95,148 +133,282 @@ def post_wip_message_with_attachment(
     debug = context.get("debug")
     chat_history_id_txt = f"id={chat_history_id}, "
 
-    print(f"post_wip_message_with_attachment, base64_encoded_chart_image={base64_encoded_chart_image}")
-
-    table = json_to_slack_table(json_obj)
+    logger.info(
+        f"post_wip_message_with_attachment, chat_history_id={chat_history_id}, base64_encoded_chart_image={len(base64_encoded_chart_image or '')} characters")
 
-    data_string = json.dumps(json_obj, indent=4)  # 'your_data' is your JSON data
-
-    file_json = io.BytesIO(data_string.encode('utf-8')).getvalue()
-    file_json_size = len(file_json)
-    print(f"post_wip_message_with_attachment, file_json_size={file_json_size} bytes")
-
-    file_txt = io.BytesIO(table.encode('utf-8')).getvalue()
-    file_txt_size = len(file_txt)
-    print(f"post_wip_message_with_attachment, file_txt_size={file_txt_size} bytes")
-
-    if base64_encoded_chart_image:
-        file_png = io.BytesIO(base64.b64decode(base64_encoded_chart_image)).getvalue()
-        file_png_size = len(file_png)
-        print(f"post_wip_message_with_attachment, file_png_size={file_png_size} bytes")
-    else:
-        file_png_size = 0
-        file_png = None
-
-    system_messages = [msg for msg in messages if msg["role"] == "system"]
+    metadata = wip_message_metadata(messages, user)
+    posts = []
 
     if ai_response or score:
         score_msg = ""
         if score > 0:
             score_msg = " The AI Calculated score for this answer is: " + str(score)
-        client.chat_postMessage(
+        posts.append(("chat_postMessage", dict(
             channel=channel,
             thread_ts=thread_ts,
             text=chat_history_id_txt + ai_response + score_msg,
-            metadata={
-                "event_type": "chat-gpt-convo",
-                "event_payload": {"messages": system_messages, "user": user},
-            },
-        )
+            metadata=metadata,
+        )))
 
     if sql:
-        client.chat_postMessage(
+        posts.append(("chat_postMessage", dict(
             channel=channel,
             thread_ts=thread_ts,
             text=chat_history_id_txt + "```" + sql + "```",
-            metadata={
-                "event_type": "chat-gpt-convo",
-                "event_payload": {"messages": system_messages, "user": user},
-            },
-        )
-
-    if file_json_size > 0 and (json_obj and len(json_obj) > 0):
-        client.files_upload_v2(
+            metadata=metadata,
+        )))
+
+    # File contents are built lazily, right before their upload; see resolve_upload(). Nothing is built
+    # for files that are never sent, but concurrent uploads hold up to SLACK_FILE_UPLOAD_CONCURRENCY
+    # files at once, and a batched upload holds all of them
+    if json_obj and len(json_obj) > 0:
+        posts.append(("files_upload_v2", dict(
             channels=channel,  # replace 'channel_id' with the ID of the channel you want to post to
             thread_ts=thread_ts,
-            metadata={
-                "event_type": "chat-gpt-convo",
-                "event_payload": {"messages": system_messages, "user": user},
-            },
-            content=file_json,
+            metadata=metadata,
+            content=lambda: json_artifact(json_obj),
             filename=f"{chat_history_id}_data.json"  # the filename that will be displayed in Slack
-        )
-        print(f"post_wip_message_with_attachment, data.json, done")
-
-    if file_txt_size > 0 and (json_obj and len(json_obj) > 0):
-        client.files_upload_v2(
+        )))
+        posts.append(("files_upload_v2", dict(
             channels=channel,  # replace 'channel_id' with the ID of the channel you want to post to
             thread_ts=thread_ts,
-            metadata={
-                "event_type": "chat-gpt-convo",
-                "event_payload": {"messages": system_messages, "user": user},
-            },
-            content=file_txt,
+            metadata=metadata,
+            content=lambda: json_to_slack_table(json_obj).encode("utf-8"),
             filename=f"{chat_history_id}_data.txt"  # the filename that will be displayed in Slack
-        )
-        print(f"post_wip_message_with_attachment, data.txt, done")
+        )))
 
-    if file_png_size > 0:
-        client.files_upload_v2(
+    if base64_encoded_chart_image:
+        posts.append(("files_upload_v2", dict(
             channels=channel,  # replace 'channel_id' with the ID of the channel you want to post to
             thread_ts=thread_ts,
-            metadata={
-                "event_type": "chat-gpt-convo",
-                "event_payload": {"messages": system_messages, "user": user},
-            },
-            content=file_png,
+            metadata=metadata,
+            content=lambda: base64.b64decode(base64_encoded_chart_image),
             filename=f"{chat_history_id}_data.png"  # the filename that will be displayed in Slack
-        )
+        )))
 
     if debug == "true" and len(intermediate_steps) > 0:
-        intermediate_steps_table = json.dumps(intermediate_steps, indent=4)  # 'your_data' is your JSON data
-        intermediate_steps_table_file_txt = io.BytesIO(intermediate_steps_table.encode('utf-8')).getvalue()
-        client.files_upload_v2(
+        posts.append(("files_upload_v2", dict(
             channels=channel,  # replace 'channel_id' with the ID of the channel you want to post to
             thread_ts=thread_ts,
-            metadata={
-                "event_type": "chat-gpt-convo",
-                "event_payload": {"messages": system_messages, "user": user},
-            },
-            content=intermediate_steps_table_file_txt,
+            metadata=metadata,
+            content=lambda: json_artifact(intermediate_steps),
             filename=f"{chat_history_id}_intermediate_steps.txt"  # the filename that will be displayed in Slack
-        )
-        print(f"post_wip_message_with_attachment, intermediate_steps.txt, done")
+        )))
 
     # ERROR MSG
     if (sql and len(sql) == 0) and (json_obj and len(json_obj) == 0):
-        client.chat_postMessage(
+        posts.append(("chat_postMessage", dict(
             channel=channel,
             thread_ts=thread_ts,
             text=chat_history_id_txt + DEFAULT_ERROR_TEXT,
-            metadata={
-                "event_type": "chat-gpt-convo",
-                "event_payload": {"messages": system_messages, "user": user},
-            },
-        )
+            metadata=metadata,
+        )))
+
+    return posts
+
+
+# Shared by all workers; WebClient is safe to use from several threads
+upload_executor = ThreadPoolExecutor(
+    max_workers=max(SLACK_FILE_UPLOAD_CONCURRENCY, 1), thread_name_prefix="slack-upload"
+)
+# Uploads submitted to upload_executor that haven't finished yet (queued or running)
+_pending_uploads = 0
+_pending_uploads_lock = threading.Lock()
+
+
+def pending_uploads() -> int:
+    with _pending_uploads_lock:
+        return _pending_uploads
+
+
+def _upload_finished(future: Future):
+    global _pending_uploads
+    with _pending_uploads_lock:
+        _pending_uploads -= 1
+
+
+def submit_upload(client: WebClient, method: str, kwargs: dict) -> Future:
+    """Runs call_slack_api on upload_executor, in a copy of this context so its spans join the current trace."""
+    global _pending_uploads
+    with _pending_uploads_lock:
+        _pending_uploads += 1
+    try:
+        future = upload_executor.submit(contextvars.copy_context().run, call_slack_api, client, method, kwargs)
+    except BaseException:
+        _upload_finished(None)
+        raise
+    future.add_done_callback(_upload_finished)
+    return future
+
+
+QUEUE_GAUGES.set_function(pending_uploads, queue="upload_executor")
+
+
+def split_attachment_posts(
+        posts: List[Tuple[str, dict]],
+        batched: bool = SLACK_FILE_UPLOAD_BATCHED,
+) -> Tuple[List[Tuple[str, dict]], List[Tuple[str, dict]], List[Tuple[str, dict]]]:
+    """Splits posts into (messages before the files, file uploads, messages after the files).
+
+    Messages keep their order in the thread; the uploads in between may run concurrently,
+    or are merged into one files_upload_v2 call when batched is True.
+    """
+    leading, uploads, trailing = [], [], []
+    for method, kwargs in posts:
+        if method == "files_upload_v2":
+            uploads.append((method, kwargs))
+        elif uploads:
+            trailing.append((method, kwargs))
+        else:
+            leading.append((method, kwargs))
+
+    if batched and len(uploads) > 1:
+        first = uploads[0][1]
+        uploads = [("files_upload_v2", dict(
+            channel=first["channels"],
+            thread_ts=first["thread_ts"],
+            file_uploads=[{"content": kwargs["content"], "filename": kwargs["filename"]} for _, kwargs in uploads],
+        ))]
+    return leading, uploads, trailing
+
+
+def json_artifact(data) -> bytes:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+def resolve_file(content, filename: str) -> Tuple[bytes, str]:
+    """Builds a lazy file content and gzips text files above SLACK_FILE_UPLOAD_GZIP_MIN_BYTES."""
+    if callable(content):
+        content = content()
+    if (
+            SLACK_FILE_UPLOAD_GZIP_MIN_BYTES > 0
+            and len(content) >= SLACK_FILE_UPLOAD_GZIP_MIN_BYTES
+            and filename.endswith((".json", ".txt"))
+    ):
+        content = gzip.compress(content, compresslevel=6)
+        filename = filename + ".gz"
+    logger.info(f"post_wip_message_with_attachment, {filename}, size={len(content)} bytes")
+    return content, filename
+
+
+def resolve_upload(kwargs: dict) -> dict:
+    """Builds the file contents of one Slack call; a batched files_upload_v2 call builds every file it shares."""
+    if "file_uploads" in kwargs:
+        file_uploads = []
+        for f in kwargs["file_uploads"]:
+            content, filename = resolve_file(f["content"], f["filename"])
+            file_uploads.append({**f, "content": content, "filename": filename})
+        return {**kwargs, "file_uploads": file_uploads}
+    if "content" in kwargs:
+        content, filename = resolve_file(kwargs["content"], kwargs["filename"])
+        return {**kwargs, "content": content, "filename": filename}
+    return kwargs
+
+
+def call_slack_api(client: WebClient, method: str, kwargs: dict):
+    kwargs = resolve_upload(kwargs)
+    if kwargs.get("content") == b"":
+        return None
+    with SLACK_UPLOAD_SECONDS.time(method=method):
+        response = getattr(client, method)(**kwargs)
+    logger.info(f"post_wip_message_with_attachment, {method}, {describe_post(kwargs)}, done")
+    return response
+
+
+async def async_call_slack_api(client: AsyncWebClient, method: str, kwargs: dict):
+    if "content" in kwargs or "file_uploads" in kwargs:
+        # Building, decoding and gzipping the files can take a while on large results
+        kwargs = await asyncio.to_thread(resolve_upload, kwargs)
+    if kwargs.get("content") == b"":
+        return None
+    with SLACK_UPLOAD_SECONDS.time(method=method):
+        response = await getattr(client, method)(**kwargs)
+    logger.info(f"post_wip_message_with_attachment, {method}, {describe_post(kwargs)}, done")
+    return response
+
+
+def describe_post(kwargs: dict) -> str:
+    if "file_uploads" in kwargs:
+        return ",".join(f["filename"] for f in kwargs["file_uploads"])
+    return kwargs.get("filename", "message")
+
+
+@traced()
+def post_wip_message_with_attachment(
+        *,
+        client: WebClient,
+        channel: str,
+        thread_ts: str,
+        loading_text: list,
+        messages: List[Dict[str, str]],
+        user: str,
+        context: BoltContext,
+):
+    posts = build_wip_attachment_posts(
+        channel=channel,
+        thread_ts=thread_ts,
+        loading_text=loading_text,
+        messages=messages,
+        user=user,
+        context=context,
+    )
+    leading, uploads, trailing = split_attachment_posts(posts)
+    for method, kwargs in leading:
+        call_slack_api(client, method, kwargs)
+
+    if len(uploads) > 1:
+        futures = [submit_upload(client, method, kwargs) for method, kwargs in uploads]
+        # Let every upload finish, then raise the first failure if any
+        wait(futures)
+        for future in futures:
+            future.result()
+    else:
+        for method, kwargs in uploads:
+            call_slack_api(client, method, kwargs)
+
+    for method, kwargs in trailing:
+        call_slack_api(client, method, kwargs)
+
+
+@traced()
+async def async_post_wip_message_with_attachment(
+        *,
+        client: AsyncWebClient,
+        channel: str,
+        thread_ts: str,
+        loading_text: list,
+        messages: List[Dict[str, str]],
+        user: str,
+        context: BoltContext,
+):
+    posts = build_wip_attachment_posts(
+        channel=channel,
+        thread_ts=thread_ts,
+        loading_text=loading_text,
+        messages=messages,
+        user=user,
+        context=context,
+    )
+    leading, uploads, trailing = split_attachment_posts(posts)
+    for method, kwargs in leading:
+        await async_call_slack_api(client, method, kwargs)
+    # Like upload_executor, this bounds how many files are built and held at once
+    semaphore = asyncio.Semaphore(max(SLACK_FILE_UPLOAD_CONCURRENCY, 1))
+
+    async def bounded_call(method: str, kwargs: dict):
+        async with semaphore:
+            return await async_call_slack_api(client, method, kwargs)
 
-    print(f"post_wip_message_with_attachment, data.png, done")
+    await asyncio.gather(*[bounded_call(method, kwargs) for method, kwargs in uploads])
+    for method, kwargs in trailing:
+        await async_call_slack_api(client, method, kwargs)
 
 
 def json_to_slack_table(json_array):
-    if not json_array:
-        return '```No data available```'
     try:
-        headers = list(json_array[0].keys())
-        table_data = [headers]
-
-        for json_object in json_array:
-            row_data = [str(json_object[header]) for header in headers]
-            table_data.append(row_data)
-
-        # Transpose data for column-wise length calculation
-        transposed_data = list(map(list, zip(*table_data)))
-        column_widths = [max(len(str(word)) for word in col) for col in transposed_data]
-
-        # Format the table
-        table_string = "```\n"  # start with opening ```
-        for row in table_data:
-            row_string = '| ' + ' | '.join(f"{x:<{y}}" for x, y in zip(row, column_widths)) + ' |\n'
-            table_string += row_string
-        table_string += "```"  # end with closing ```
-        return table_string
+        return render_text_table(json_array)
     except Exception as e:
-        traceback.print_exc()
-        print(f"json_to_slack_table, error={e}")
+        logger.exception(f"json_to_slack_table, error={e}")
         return ""
 
 
@@ -248,15 +420,11 @@ def update_wip_message(
         messages: List[Dict[str, str]],
         user: str,
 ) -> SlackResponse:
-    system_messages = [msg for msg in messages if msg["role"] == "system"]
     return client.chat_update(
         channel=channel,
         ts=ts,
         text=text,
-        metadata={
-            "event_type": "chat-gpt-convo",
-            "event_payload": {"messages": system_messages, "user": user},
-        },
+        metadata=wip_message_metadata(messages, user),
     )
 
 
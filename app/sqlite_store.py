@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class SQLiteDatabase:
+    """A SQLite database in WAL mode, shared by the local stores (config, event dedup, prompt refs).
+
+    Each thread gets its own connection to a file. An in-memory database only exists within
+    its connection, so for ":memory:" all threads share one connection and take turns on it.
+    The schema statements run once, when the database is opened.
+    """
+
+    def __init__(self, path: str, *schema: str):
+        self.path = path
+        self._local = threading.local()
+        self._shared: Optional[sqlite3.Connection] = None
+        self._shared_lock = threading.RLock()
+        if path == ":memory:":
+            self._shared = self._connect(check_same_thread=False)
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        for statement in schema:
+            self.execute(statement)
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        # isolation_level=None: transactions are only the ones begun with transaction()
+        connection = sqlite3.connect(
+            self.path, isolation_level=None, timeout=30, check_same_thread=check_same_thread
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        if self._shared is not None:
+            with self._shared_lock:
+                yield self._shared
+            return
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        yield connection
+
+    def execute(self, sql: str, params: tuple = ()) -> int:
+        """Runs a statement and returns the number of rows it changed."""
+        with self._connection() as connection:
+            return connection.execute(sql, params).rowcount
+
+    def fetchone(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        with self._connection() as connection:
+            return connection.execute(sql, params).fetchone()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs the block in a transaction that holds the write lock from the start (BEGIN IMMEDIATE)."""
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
@@ -0,0 +1,92 @@
+import csv
+import io
+from typing import Iterable, Iterator, List, Optional
+
+from app.env import (
+    SLACK_TABLE_MAX_ROWS,
+    SLACK_TABLE_MAX_COL_WIDTH,
+)
+
+TRUNCATION_MARKER = "…"
+
+
+def cell_text(value, max_col_width: int) -> str:
+    text = str(value).replace("\n", " ")
+    if max_col_width > 0 and len(text) > max_col_width:
+        return text[:max(max_col_width - 1, 0)] + TRUNCATION_MARKER
+    return text
+
+
+def iter_table_lines(
+        rows: List[dict],
+        max_rows: int = SLACK_TABLE_MAX_ROWS,
+        max_col_width: int = SLACK_TABLE_MAX_COL_WIDTH,
+) -> Iterator[str]:
+    """Yields the lines of a fixed-width text table for rows, each ending with a newline.
+
+    Headers come from the first row. Each cell is stringified once, column widths are computed
+    in the same pass, and output stops after max_rows rows with a marker line for the rest.
+    """
+    headers = list(rows[0].keys())
+    shown = rows if max_rows <= 0 else rows[:max_rows]
+
+    header_cells = [cell_text(header, max_col_width) for header in headers]
+    widths = [len(cell) for cell in header_cells]
+    body = []
+    for row in shown:
+        cells = [cell_text(row.get(header), max_col_width) for header in headers]
+        for i, cell in enumerate(cells):
+            if len(cell) > widths[i]:
+                widths[i] = len(cell)
+        body.append(cells)
+
+    yield format_table_line(header_cells, widths)
+    for cells in body:
+        yield format_table_line(cells, widths)
+
+    hidden = len(rows) - len(shown)
+    if hidden > 0:
+        yield f"{TRUNCATION_MARKER} {hidden} more rows not shown\n"
+
+
+def format_table_line(cells: List[str], widths: List[int]) -> str:
+    return "| " + " | ".join(cell.ljust(width) for cell, width in zip(cells, widths)) + " |\n"
+
+
+def render_text_table(
+        rows: Optional[List[dict]],
+        max_rows: int = SLACK_TABLE_MAX_ROWS,
+        max_col_width: int = SLACK_TABLE_MAX_COL_WIDTH,
+) -> str:
+    """Renders rows as a Slack code block, the format json_to_slack_table has always returned."""
+    if not rows:
+        return "```No data available```"
+    buffer = io.StringIO()
+    buffer.write("```\n")
+    for line in iter_table_lines(rows, max_rows=max_rows, max_col_width=max_col_width):
+        buffer.write(line)
+    buffer.write("```")
+    return buffer.getvalue()
+
+
+def iter_delimited(rows: Iterable[dict], delimiter: str = ",") -> Iterator[str]:
+    """Yields rows as CSV (or TSV with delimiter="\\t") lines, header first; rows are never truncated."""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()), delimiter=delimiter,
+                                    extrasaction="ignore", lineterminator="\n")
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def render_csv(rows: Optional[List[dict]], delimiter: str = ",") -> str:
+    return "".join(iter_delimited(rows or [], delimiter=delimiter))
+
+
+def render_tsv(rows: Optional[List[dict]]) -> str:
+    return render_csv(rows, delimiter="\t")
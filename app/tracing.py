@@ -0,0 +1,194 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from app.env import (
+    TRACE_EXPORT_PATH,
+    TRACE_SAMPLE_RATIO,
+    TRACE_SERVICE_NAME,
+)
+
+logger = logging.getLogger(__name__)
+
+# W3C Trace Context, see https://www.w3.org/TR/trace-context/
+TRACEPARENT_HEADER = "traceparent"
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict:
+        """The span in the field names of OTLP/JSON, one object per span."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": {key: value if isinstance(value, (bool, int, float)) else str(value)
+                           for key, value in self.attributes.items() if value is not None},
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+            "resource": {"service.name": TRACE_SERVICE_NAME},
+        }
+
+
+# Put on an exporter's queue by close() to stop its writer
+_STOP = object()
+
+
+class JsonLinesSpanExporter:
+    """Appends finished spans to a file, one JSON object per line; no collector needed.
+
+    export() only puts the span on a queue; a background thread writes it to the file and
+    flushes whenever the queue runs empty, so a slow disk never blocks a traced request.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+
+    def export(self, span: Span):
+        if self._writer is None:
+            self._start()
+        self._queue.put(span.to_dict())
+
+    def _start(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name="span-exporter", daemon=True)
+                self._writer.start()
+
+    def _write(self):
+        file = None
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is _STOP:
+                    return
+                try:
+                    if file is None:
+                        file = open(self.path, "a", encoding="utf-8")
+                    file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                    if self._queue.empty():
+                        file.flush()
+                except OSError:
+                    logger.exception(f"JsonLinesSpanExporter, failed to write to {self.path}")
+        finally:
+            if file is not None:
+                file.close()
+
+    def close(self):
+        """Writes out the queued spans and stops the background writer, if any."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(_STOP)
+            writer.join()
+
+
+exporter: Optional[JsonLinesSpanExporter] = JsonLinesSpanExporter(TRACE_EXPORT_PATH) if TRACE_EXPORT_PATH else None
+
+
+def stop_tracing():
+    """Writes out the queued spans and stops the exporter's background writer, if any."""
+    if exporter is not None:
+        exporter.close()
+
+
+atexit.register(stop_tracing)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attributes(**attributes):
+    """Adds attributes to the current span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attributes(**attributes)
+
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """Runs the block in a new span, a child of the current one or the root of a new trace.
+
+    The span is the current one for the block, including in tasks it creates; worker threads
+    only see it when they run in a copy of the context (contextvars.copy_context().run).
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        span = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    else:
+        span = Span(name, f"{random.getrandbits(128):032x}", None, random.random() < TRACE_SAMPLE_RATIO, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if span.sampled and exporter is not None:
+            exporter.export(span)
+
+
+def traced(name: Optional[str] = None):
+    """Decorates a function, or a coroutine function, to run in a span named after it."""
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(span_name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with start_span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inject_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """Adds the traceparent header of the current span, so the Genie API can join the trace."""
+    span = _current_span.get()
+    if span is not None:
+        headers[TRACEPARENT_HEADER] = span.traceparent()
+    return headers
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import WebClient
+
+from app.env import (
+    SLACK_UPDATE_MIN_INTERVAL_SECONDS,
+    SLACK_UPDATE_MAX_INTERVAL_SECONDS,
+)
+from app.slack_ops import update_wip_message
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(e: SlackApiError) -> Optional[float]:
+    """Returns the Retry-After of a 429 response, or None if e isn't a rate limit error."""
+    response = e.response
+    if response is None or response.status_code != 429:
+        return None
+    headers = {k.lower(): v for k, v in (response.headers or {}).items()}
+    value = headers.get("retry-after")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class WipMessageUpdater:
+    """Streams updates of one WIP reply with chat.update.
+
+    At most one chat.update is in flight. While it runs, newer texts replace each other, so
+    only the latest is sent next. Updates are spaced by an interval that grows when Slack
+    answers with 429 (honoring Retry-After) and shrinks back after successful calls.
+    """
+
+    def __init__(
+            self,
+            client: WebClient,
+            channel: str,
+            ts: str,
+            messages: List[Dict[str, str]],
+            user: str,
+            min_interval: float = SLACK_UPDATE_MIN_INTERVAL_SECONDS,
+            max_interval: float = SLACK_UPDATE_MAX_INTERVAL_SECONDS,
+    ):
+        self.client = client
+        self.channel = channel
+        self.ts = ts
+        self.messages = messages
+        self.user = user
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._cond = threading.Condition()
+        self._latest: Optional[str] = None
+        self._in_flight = False
+        self._closed = False
+        self._next_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    def wants_update(self) -> bool:
+        """True when a text submitted now would be sent right away; lets callers skip formatting otherwise."""
+        with self._cond:
+            return (
+                    not self._closed
+                    and self._latest is None
+                    and not self._in_flight
+                    and time.monotonic() >= self._next_at
+            )
+
+    def submit(self, text: str):
+        with self._cond:
+            if self._closed:
+                return
+            if self._latest is not None:
+                self.coalesced += 1
+            self._latest = text
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wip-message-updater", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._latest is None or time.monotonic() < self._next_at):
+                    timeout = None
+                    if self._latest is not None:
+                        timeout = self._next_at - time.monotonic()
+                    self._cond.wait(timeout=timeout)
+                if self._closed:
+                    return
+                text = self._latest
+                self._latest = None
+                self._in_flight = True
+            try:
+                self._send(text)
+            except SlackApiError as e:
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    logger.warning(f"WipMessageUpdater, chat_update failed, error={e}")
+                else:
+                    with self._cond:
+                        self.rate_limited += 1
+                        self.interval = min(self.max_interval, self.interval * 2)
+                        self._next_at = time.monotonic() + max(delay, self.interval)
+                        if self._latest is None:
+                            self._latest = text  # nothing newer yet, so retry this one
+            except Exception as e:
+                logger.warning(f"WipMessageUpdater, chat_update failed, error={e}")
+            finally:
+                with self._cond:
+                    self._in_flight = False
+                    self._cond.notify_all()
+
+    def _send(self, text: str):
+        update_wip_message(
+            client=self.client,
+            channel=self.channel,
+            ts=self.ts,
+            text=text,
+            messages=self.messages,
+            user=self.user,
+        )
+        with self._cond:
+            self.sent += 1
+            self.interval = max(self.min_interval, self.interval / 2)
+            self._next_at = time.monotonic() + self.interval
+
+    def close(self, final_text: Optional[str] = None):
+        """Drops pending updates, waits for the in-flight one, then sends final_text (errors propagate)."""
+        with self._cond:
+            self._closed = True
+            self._latest = None
+            self._cond.notify_all()
+            while self._in_flight:
+                self._cond.wait()
+            wait_seconds = self._next_at - time.monotonic() if self.rate_limited > 0 else 0
+        if final_text is None:
+            return
+        if wait_seconds > 0:
+            time.sleep(min(wait_seconds, self.max_interval))
+        self._send(final_text)
@@ -1,18 +1,21 @@
 import hashlib
+import logging
 import os
-import re
 import time
+from typing import Optional
 
 from urllib.parse import urlparse, urlunparse
 from app.env import (
-    REDACT_EMAIL_PATTERN,
-    REDACT_PHONE_PATTERN,
-    REDACT_CREDIT_CARD_PATTERN,
-    REDACT_SSN_PATTERN,
-    REDACT_USER_DEFINED_PATTERN,
     REDACTION_ENABLED,
+    GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS,
 )
-import requests
+from app.genie_client import GenieApiClient, get_genie_client
+from app.metrics import STAGE_SECONDS, GENIE_RETRIES
+from app.polling import BackoffSchedule
+from app.redaction import default_redactor, message_redaction_memo
+from app.tracing import traced, set_attributes
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_LOADING_TEXT = ":hourglass_flowing_sand: Wait a second, please ..."
 DEFAULT_ERROR_TEXT = ":warning: No results were returned from your query. Please review the generated SQL and the associated table/schema, then try again."
@@ -30,17 +33,17 @@ def redact_string(input_string: str) -> str:
     Returns:
         - str: the redacted string
     """
-    output_string = input_string
-    if REDACTION_ENABLED:
-        output_string = re.sub(REDACT_EMAIL_PATTERN, "[EMAIL]", output_string)
-        output_string = re.sub(
-            REDACT_CREDIT_CARD_PATTERN, "[CREDIT CARD]", output_string
-        )
-        output_string = re.sub(REDACT_PHONE_PATTERN, "[PHONE]", output_string)
-        output_string = re.sub(REDACT_SSN_PATTERN, "[SSN]", output_string)
-        output_string = re.sub(REDACT_USER_DEFINED_PATTERN, "[REDACTED]", output_string)
+    if REDACTION_ENABLED and input_string is not None:
+        return default_redactor.redact(input_string)
+    return input_string
+
 
-    return output_string
+def redact_message_text(message: dict) -> str:
+    """Same as redact_string for a Slack message's text, remembered by the message ts"""
+    text = message.get("text")
+    if REDACTION_ENABLED and text is not None:
+        return message_redaction_memo.redact(message.get("ts"), text)
+    return text
 
 
 def get_space_travel_update(retry_count):
@@ -81,9 +84,7 @@ def is_prime(number):
     return True
 
 
-def fetch_data_from_genieapi(
-        api_key=None,
-        endpoint="/language_to_sql",
+def build_genieapi_params(
         text_query=None,
         table_name=None,
         resourcename=None,
@@ -97,18 +98,10 @@ def fetch_data_from_genieapi(
         id=None,
         execute_sql=None,
         experimental_features=None,
-        MAX_RETRIES=5,
-        DELAY_FACTOR=0,
-        client=None,
-        channel=None,
-        thread_ts=None,
         db_warehouse=None,
         ai_model=None,
         ai_temp=None,
-):
-    # Set defaults
-    URL_DEFAULT = os.environ.get("GENIEAPI_HOST", "https://genieapi.defytrends.dev/api")
-
+) -> dict:
     if text_query is not None:
         text_query = text_query.replace('```', '').replace('`', '').strip()
 
@@ -120,9 +113,6 @@ def fetch_data_from_genieapi(
     }
 
     # Use arguments if provided, otherwise default
-    print(
-        f"fetch_data_from_genieapi, api_key={api_key}, endpoint={endpoint}, text_query={text_query}, table_name={table_name}, resourcename={resourcename}, experimental_features={experimental_features}")
-    endpoint_url = URL_DEFAULT + endpoint
     if resourcename is not None:
         PARAMS_DEFAULT["resourcename"] = resourcename
     if is_generate_code is not None:
@@ -152,50 +142,148 @@ def fetch_data_from_genieapi(
     if db_warehouse is not None:
         PARAMS_DEFAULT["db_warehouse"] = db_warehouse
 
+    return PARAMS_DEFAULT
 
-    headers = {"X-API-Key": api_key}
-
-    # Define max retries and delay for exponential backoff
 
-    retries = 0
-    while retries < MAX_RETRIES:
-        response = requests.get(endpoint_url, headers=headers, params=PARAMS_DEFAULT)
-
-        print(
-            f"fetch_data_from_genieapi, response.status_code={response.status_code}, endpoint_url={endpoint_url}, headers={headers}, PARAMS_DEFAULT={PARAMS_DEFAULT}")
+@traced()
+def fetch_data_from_genieapi(
+        api_key=None,
+        endpoint="/language_to_sql",
+        text_query=None,
+        table_name=None,
+        resourcename=None,
+        is_generate_code=None,
+        chat_history_size=None,
+        predict_count=None,
+        team_id=None,
+        user_id=None,
+        db_schema=None,
+        ai_engine=None,
+        id=None,
+        execute_sql=None,
+        experimental_features=None,
+        MAX_RETRIES=5,
+        DELAY_FACTOR=0,
+        client=None,
+        channel=None,
+        thread_ts=None,
+        db_warehouse=None,
+        ai_model=None,
+        ai_temp=None,
+        genie_client: Optional[GenieApiClient] = None,
+        poll_schedule: Optional[BackoffSchedule] = None,
+        long_poll_seconds: Optional[float] = None,
+):
+    genie_client = genie_client or get_genie_client()
+    set_attributes(endpoint=endpoint)
+
+    PARAMS_DEFAULT = build_genieapi_params(
+        text_query=text_query,
+        table_name=table_name,
+        resourcename=resourcename,
+        is_generate_code=is_generate_code,
+        chat_history_size=chat_history_size,
+        predict_count=predict_count,
+        team_id=team_id,
+        user_id=user_id,
+        db_schema=db_schema,
+        ai_engine=ai_engine,
+        id=id,
+        execute_sql=execute_sql,
+        experimental_features=experimental_features,
+        db_warehouse=db_warehouse,
+        ai_model=ai_model,
+        ai_temp=ai_temp,
+    )
 
-        # If status code is below 299, return the JSON response
-        if response.status_code < 299:
-            return response.json()
+    logger.info(
+        f"fetch_data_from_genieapi, endpoint={endpoint}, text_query={PARAMS_DEFAULT['text_query']}, table_name={table_name}, resourcename={redact_credentials_from_url(resourcename)}, experimental_features={experimental_features}")
 
-        elif 401 >= response.status_code <= 403:
-            raise Exception("USER_NOT_AUTHORIZED")
+    if long_poll_seconds is not None:
+        PARAMS_DEFAULT["wait"] = long_poll_seconds
+        connect_timeout, read_timeout = genie_client.timeout
+        request_timeout = (connect_timeout, read_timeout + long_poll_seconds)
+    else:
+        request_timeout = genie_client.timeout
 
-        # If status code is 500 or above, retry the request
-        else:
-            retrymsg = get_space_travel_update(retries)
-            isprime = is_prime(retries)
-            # print(f"Will retry ?! retrymsg={retrymsg}, isprime={isprime}")
-            if client and channel and thread_ts and isprime:
-                client.chat_postMessage(
-                    channel=channel,
-                    thread_ts=thread_ts,
-                    text=retrymsg,
-                )
-            retries += 1
-            if DELAY_FACTOR > 0:
-                time.sleep(DELAY_FACTOR ** retries)  # exponential backoff
+    # Define max retries and delay for exponential backoff
+    # When a poll_schedule is given, it bounds the polling instead of MAX_RETRIES/DELAY_FACTOR
+    delays = iter(poll_schedule) if poll_schedule is not None else None
+    last_progress_at = time.monotonic()
+    progress_count = 0
+
+    # genie_poll_wait only counts the waits for the result (backoff sleeps and long polls), once
+    # per call; the requests themselves are in GENIE_REQUEST_SECONDS
+    is_polling = poll_schedule is not None or long_poll_seconds is not None
+    poll_wait_seconds = 0.0
+    try:
+        retries = 0
+        while delays is not None or retries < MAX_RETRIES:
+            requested_at = time.monotonic()
+            response = genie_client.get(endpoint, api_key, params=PARAMS_DEFAULT, timeout=request_timeout)
+            if long_poll_seconds is not None:
+                poll_wait_seconds += time.monotonic() - requested_at
+
+            logger.debug(f"fetch_data_from_genieapi, response.status_code={response.status_code}, endpoint={endpoint}, retries={retries}")
+
+            # If status code is below 299, return the JSON response
+            if response.status_code < 299:
+                return response.json()
+
+            elif 401 >= response.status_code <= 403:
+                raise Exception("USER_NOT_AUTHORIZED")
+
+            # If the request is still being processed, poll again after a jittered backoff
+            elif delays is not None:
+                delay = next(delays, None)
+                if delay is None:
+                    break
+                now = time.monotonic()
+                if client and channel and thread_ts and now - last_progress_at >= GENIEAPI_POLL_PROGRESS_INTERVAL_SECONDS:
+                    client.chat_postMessage(
+                        channel=channel,
+                        thread_ts=thread_ts,
+                        text=get_space_travel_update(progress_count),
+                    )
+                    progress_count += 1
+                    last_progress_at = now
+                retries += 1
+                GENIE_RETRIES.inc(endpoint=endpoint)
+                time.sleep(delay)
+                poll_wait_seconds += delay
+
+            # If status code is 500 or above, retry the request
             else:
-                time.sleep(10)
-
-    # If maximum retries are reached, raise an exception
-    raise Exception("Max retries reached without a successful response")
-
-
-def post_data_to_genieapi(api_key=None, endpoint=None, params=None, post_body=None):
+                retrymsg = get_space_travel_update(retries)
+                isprime = is_prime(retries)
+                # print(f"Will retry ?! retrymsg={retrymsg}, isprime={isprime}")
+                if client and channel and thread_ts and isprime:
+                    client.chat_postMessage(
+                        channel=channel,
+                        thread_ts=thread_ts,
+                        text=retrymsg,
+                    )
+                retries += 1
+                GENIE_RETRIES.inc(endpoint=endpoint)
+                if DELAY_FACTOR > 0:
+                    time.sleep(DELAY_FACTOR ** retries)  # exponential backoff
+                else:
+                    time.sleep(10)
+
+        # If maximum retries are reached, raise an exception
+        raise Exception("Max retries reached without a successful response")
+    finally:
+        if is_polling:
+            STAGE_SECONDS.observe(poll_wait_seconds, stage="genie_poll_wait")
+
+
+@traced()
+def post_data_to_genieapi(api_key=None, endpoint=None, params=None, post_body=None,
+                          genie_client: Optional[GenieApiClient] = None):
     # Set defaults
     API_KEY_DEFAULT = os.environ.get("API_KEY", "")
-    URL_DEFAULT = os.environ.get("GENIEAPI_HOST", "https://genieapi.defytrends.dev/api")
+    genie_client = genie_client or get_genie_client()
+    set_attributes(endpoint=endpoint)
 
     # PARAMS_DEFAULT = {
     #     "text_query": text_query,
@@ -206,16 +294,13 @@ def post_data_to_genieapi(api_key=None, endpoint=None, params=None, post_body=No
     # Use arguments if provided, otherwise default
     api_key = api_key if api_key is not None else API_KEY_DEFAULT
 
-    endpoint_url = URL_DEFAULT + endpoint
-    headers = {"X-API-Key": api_key}
-
     # Define max retries and delay for exponential backoff
     MAX_RETRIES = 3
     DELAY_FACTOR = 2
 
     retries = 0
     while retries < MAX_RETRIES:
-        response = requests.post(endpoint_url, headers=headers, params=params, json=post_body)
+        response = genie_client.post(endpoint, api_key, params=params, json=post_body)
 
         # If status code is below 299, return the JSON response
         if response.status_code < 299:
@@ -228,6 +313,7 @@ def post_data_to_genieapi(api_key=None, endpoint=None, params=None, post_body=No
         # If status code is 500 or above, retry the request
         elif response.status_code >= 500:
             retries += 1
+            GENIE_RETRIES.inc(endpoint=endpoint)
             time.sleep(DELAY_FACTOR ** retries)  # exponential backoff
         else:
             break
@@ -280,6 +366,21 @@ def redact_credentials_from_url(url: None):
     return redacted_url
 
 
+# Config fields that are never logged as they are
+SECRET_CONFIG_KEYS = ("api_key",)
+
+
+def redact_config(config: dict) -> dict:
+    """Returns a copy of a team/user config that is safe to log: secrets masked, db_url without credentials."""
+    redacted = dict(config)
+    for key in SECRET_CONFIG_KEYS:
+        if redacted.get(key):
+            redacted[key] = "REDACTED"
+    if redacted.get("db_url"):
+        redacted["db_url"] = redact_credentials_from_url(redacted["db_url"])
+    return redacted
+
+
 def send_help_buttons(channel_id, client, text):
     client.chat_postMessage(
         channel=channel_id,
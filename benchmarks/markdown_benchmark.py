@@ -0,0 +1,78 @@
+"""Compares app/markdown.py with the previous uncompiled implementation.
+
+Run from the repository root:
+
+    python -m benchmarks.markdown_benchmark
+"""
+import re
+import timeit
+
+from app.markdown import markdown_to_slack, IncrementalConverter
+
+SAMPLE = (
+    "Here is **bold**, *italic*, __bold__ and ~~strike~~ text with `inline *code*`.\n"
+    "```\nfor i in range(10):\n    print(i * 2)\n```\n"
+    "* a bullet with ***bold italic*** words\n\n"
+)
+
+
+def legacy_markdown_to_slack(content: str) -> str:
+    parts = re.split(r"(?s)(```.+?```|`[^`\n]+?`)", content)
+    result = ""
+    for part in parts:
+        if part.startswith("```") or part.startswith("`"):
+            result += part
+        else:
+            for o, n in [
+                (r"\*\*\*(?!\s)([^\*\n]+?)(?<!\s)\*\*\*", r"_*\1*_"),
+                (r"(?<![\*_])\*(?!\s)([^\*\n]+?)(?<!\s)\*(?![\*_])", r"_\1_"),
+                (r"\*\*(?!\s)([^\*\n]+?)(?<!\s)\*\*", r"*\1*"),
+                (r"__(?!\s)([^_\n]+?)(?<!\s)__", r"*\1*"),
+                (r"~~(?!\s)([^~\n]+?)(?<!\s)~~", r"~\1~"),
+            ]:
+                part = re.sub(o, n, part)
+            result += part
+    return result
+
+
+def stream_full(content: str, chunk_size: int, convert) -> str:
+    # What the streaming loop used to do: reconvert the whole reply on every update
+    text = ""
+    for i in range(0, len(content), chunk_size):
+        text = convert(content[:i + chunk_size])
+    return text
+
+
+def stream_incremental(content: str, chunk_size: int) -> str:
+    converter = IncrementalConverter(markdown_to_slack)
+    text = ""
+    for i in range(0, len(content), chunk_size):
+        converter.append(content[i:i + chunk_size])
+        text = converter.text()
+    return text
+
+
+def main():
+    chunk_size = 80  # roughly 20 tokens per update
+    print(f"{'size':>8} {'legacy':>10} {'compiled':>10} {'stream legacy':>14} {'stream incr':>12}  (ms)")
+    for size in (1_000, 10_000, 100_000):
+        content = (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+        assert markdown_to_slack(content) == legacy_markdown_to_slack(content)
+        assert stream_incremental(content, chunk_size) == markdown_to_slack(content)
+        number = max(1, 200_000 // size)
+        stream_number = max(1, 20_000 // size)
+
+        def ms(fn, n):
+            return timeit.timeit(fn, number=n) / n * 1000
+
+        print(
+            f"{size:>8}"
+            f" {ms(lambda: legacy_markdown_to_slack(content), number):>10.3f}"
+            f" {ms(lambda: markdown_to_slack(content), number):>10.3f}"
+            f" {ms(lambda: stream_full(content, chunk_size, legacy_markdown_to_slack), stream_number):>14.1f}"
+            f" {ms(lambda: stream_incremental(content, chunk_size), stream_number):>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Compares app/redaction.py with the previous sequential re.sub redaction on thread replays.
+
+Run from the repository root:
+
+    python -m benchmarks.redaction_benchmark
+"""
+import re
+import timeit
+
+from app.redaction import REDACTION_RULES, Redactor, MessageRedactionMemo
+
+MESSAGES = [
+    "Can you list the orders placed by jane.doe@example.com last week?",
+    "Sure, here they are. Call (555) 123-4567 if anything looks off.",
+    "The card on file is 1234 5678 9012 3456 and the SSN is 123-45-6789.",
+    "Show me the top 10 customers by revenue in 2023, grouped by region please.",
+]
+
+
+def legacy_redact(text: str) -> str:
+    for _, pattern, replacement in REDACTION_RULES:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+def thread(size: int) -> list:
+    return [{"ts": f"{i}.0", "text": MESSAGES[i % len(MESSAGES)] + f" #{i}"} for i in range(size)]
+
+
+def main():
+    redactor = Redactor()
+    size = 1000
+    messages = thread(size)
+    for message in messages:
+        assert redactor.redact(message["text"]) == legacy_redact(message["text"])
+
+    def replay_legacy():
+        return [legacy_redact(m["text"]) for m in messages]
+
+    def replay_compiled():
+        return [redactor.redact(m["text"]) for m in messages]
+
+    memo = MessageRedactionMemo(redactor, max_size=size * 2)
+    replay_compiled()  # not timed: the memo is warmed by the previous replay of the thread
+
+    def replay_memo():
+        return [memo.redact(m["ts"], m["text"]) for m in messages]
+
+    replay_memo()
+    number = 20
+    print(f"replaying a thread of {size} messages ({number} runs)")
+    for name, fn in (
+            ("sequential re.sub", replay_legacy),
+            ("compiled", replay_compiled),
+            ("compiled + memo", replay_memo),
+    ):
+        ms = timeit.timeit(fn, number=number) / number * 1000
+        print(f"{name:>20} {ms:>8.2f} ms  {size / ms * 1000:>10.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
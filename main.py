@@ -3,7 +3,7 @@ import logging
 import os
 import re
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 import threading
 import boto3
 
@@ -14,6 +14,9 @@ from app.bolt_listeners import before_authorize, register_listeners
 from app.env import (
     SLACK_APP_LOG_LEVEL,
 )
+from app.executor import submit_command
+from app.log_config import configure_logging
+from app.metrics import render_metrics, CONTENT_TYPE
 
 from main_handlers import handle_use_db_func, handle_suggest_func, handle_preview_func, \
     handle_get_db_urls_func, handle_set_db_url_func, handle_get_db_tables_func, handle_set_db_table_func, \
@@ -52,6 +55,11 @@ if __name__ == "__main__":
         return jsonify({"status": "ok"}), 200
 
 
+    @healthcheck_app.route("/metrics", methods=['GET'])
+    def metrics():
+        return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
     # Create a function that starts the Flask server
     def start_healthcheck_server():
         port = int(os.getenv('PORT', 9891))
@@ -64,7 +72,7 @@ if __name__ == "__main__":
 
     from slack_bolt.adapter.socket_mode import SocketModeHandler
 
-    logging.basicConfig(level=SLACK_APP_LOG_LEVEL)
+    configure_logging(SLACK_APP_LOG_LEVEL, fmt=logging.BASIC_FORMAT)
 
     app = App(
         token=SLACK_BOT_TOKEN,
@@ -89,156 +97,155 @@ if __name__ == "__main__":
     @app.command(f"/{PREFIX}set_db_table")
     def handle_set_db_table(ack, command, respond, context: BoltContext, logger: logging.Logger,
                             client: WebClient, payload: dict):
-        threading.Thread(target=handle_set_db_table_func,
-                         args=(ack, command, respond, context, logger, client, payload, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_db_table_func,
+                       (ack, command, respond, context, logger, client, payload, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}get_db_tables")
     def handle_get_db_tables(ack, command, respond, context: BoltContext, logger: logging.Logger, client: WebClient,
                              payload: dict):
-        threading.Thread(target=handle_get_db_tables_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_get_db_tables_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}set_db_url")
     def handle_set_db_url(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_db_url_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_db_url_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}get_db_urls")
     def handle_get_db_urls(ack, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_get_db_urls_func,
-                         args=(ack, respond, context, logger, client)).start()
+        submit_command(ack, respond, context, handle_get_db_urls_func,
+                       (ack, respond, context, logger, client))
 
 
     @app.command(f"/{PREFIX}preview")
     def handle_preview(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-        threading.Thread(target=handle_preview_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_preview_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}suggest")
     def handle_suggest(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-        threading.Thread(target=handle_suggest_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_suggest_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}login")
     def handle_login(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_login_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_login_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}set_key")
     def handle_set_key(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_key_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_key_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}get_db_schemas")
     def handle_get_db_schemas(ack, command, respond, context: BoltContext, logger: logging.Logger, client: WebClient,
                               payload: dict):
-        threading.Thread(target=handle_get_db_schemas_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_get_db_schemas_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}set_db_schema")
     def handle_set_db_schema(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_db_schema_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_db_schema_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}set_ai_engine")
     def handle_set_ai_engine(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_ai_engine_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_ai_engine_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}use_db")
     def handle_use_db(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_use_db_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_use_db_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}set_chat_history_size")
     def handle_set_chat_history_size(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_chat_history_size_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_chat_history_size_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}predict")
     def handle_predict(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-        threading.Thread(target=handle_predict_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_predict_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}suggest_tables")
     def handle_suggest_tables(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-        threading.Thread(target=handle_suggest_tables_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_suggest_tables_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}get_queries")
     def handle_suggest_tables(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-        threading.Thread(target=handle_show_queries_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_show_queries_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}set_debug")
     def handle_set_debug(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_debug_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_debug_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}set_experimental_features")
     def handle_set_experimental_features(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_experimental_features_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_experimental_features_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}set_db_warehouse")
     def handle_set_db_warehouse(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_db_warehouse_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_db_warehouse_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}get_db_warehouses")
     def handle_get_db_warehouses(ack, command, respond, context: BoltContext, logger: logging.Logger, client: WebClient,
                                  payload: dict):
-        threading.Thread(target=handle_get_db_warehouses_func,
-                         args=(ack, command, respond, context, logger, client, payload)).start()
+        submit_command(ack, respond, context, handle_get_db_warehouses_func,
+                       (ack, command, respond, context, logger, client, payload))
 
 
     @app.command(f"/{PREFIX}set_ai_model")
     def handle_set_ai_model(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_ai_model_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_ai_model_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.command(f"/{PREFIX}set_ai_temp")
     def handle_set_ai_temp(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-        threading.Thread(target=handle_set_ai_temp_func,
-                         args=(ack, command, respond, context, logger, client, s3_client,
-                               AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_ai_temp_func,
+                       (ack, command, respond, context, logger, client, s3_client,
+                        AWS_STORAGE_BUCKET_NAME))
 
 
     @app.action(re.compile("^help:"))
     def handle_help_actions(ack, body, say):
-        threading.Thread(target=handle_help_actions_func,
-                         args=(ack, body, say)).start()
+        return handle_help_actions_func(ack, body, say)
 
 
     @app.action(re.compile("^button:.+:.+"))
@@ -247,25 +254,25 @@ if __name__ == "__main__":
         command = {"text": parameter}
         ack()
         if action == 'use_db':
-            threading.Thread(target=handle_use_db_func,
-                             args=(ack, command, respond, context, logger, client,
-                                   s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+            submit_command(ack, respond, context, handle_use_db_func,
+                           (ack, command, respond, context, logger, client,
+                            s3_client, AWS_STORAGE_BUCKET_NAME))
         if action == "set_db_table":
-            threading.Thread(target=handle_set_db_table_func,
-                             args=(ack, command, respond, context, logger, client, payload,
-                                   s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+            submit_command(ack, respond, context, handle_set_db_table_func,
+                           (ack, command, respond, context, logger, client, payload,
+                            s3_client, AWS_STORAGE_BUCKET_NAME))
 
         if action == "set_db_warehouse":
-            threading.Thread(target=handle_set_db_warehouse_func,
-                             args=(ack, command, respond, context, logger, client,
-                                   s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+            submit_command(ack, respond, context, handle_set_db_warehouse_func,
+                           (ack, command, respond, context, logger, client,
+                            s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
     @app.action("query_selected")
     def handle_query_selection(ack, context, client, payload, body, respond):
         id = body["actions"][0]["selected_option"]["value"]
-        threading.Thread(target=handle_query_selected_action,
-                         args=(ack, context, client, payload, respond, id)).start()
+        submit_command(ack, respond, context, handle_query_selected_action,
+                       (ack, context, client, payload, respond, id))
 
 
     handler = SocketModeHandler(app, SLACK_APP_TOKEN)
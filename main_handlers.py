@@ -1,14 +1,16 @@
+import asyncio
 import json
 import logging
 import botocore
-import traceback
 
 import boto3 as boto3
 from slack_bolt import BoltContext
 from app.bolt_listeners import DEFAULT_LOADING_TEXT, suggest_table, preview_table, predict_table, suggest_tables
+from app.config_store import get_config_store
+from app.metrics import STAGE_SECONDS
 from app.slack_ops import post_wip_message_with_attachment
 from app.utils import send_help_buttons, fetch_data_from_genieapi, redact_credentials_from_url, cool_name_generator, \
-    post_data_to_genieapi, redact_string
+    post_data_to_genieapi, redact_string, redact_config
 
 from app.env import (
     DEFAULT_OPENAI_MODEL,
@@ -28,71 +30,82 @@ from app.slack_ops import (
 def set_s3_openai_api_key_func(context: BoltContext, next_, logger: logging.Logger, s3_client, AWS_STORAGE_BUCKET_NAME):
     logger.info("set_s3_openai_api_key init")
     try:
-        key = context.team_id
-        try:
-            s3_response = s3_client.get_object(
-                Bucket=AWS_STORAGE_BUCKET_NAME, Key=key
-            )
-            config_str: str = s3_response["Body"].read().decode("utf-8")
-            if config_str.startswith("{"):
-                config = json.loads(config_str)
-                logger.info(f"set_s3_openai_api_key, team_id, config={config}")
-
-                context["api_key"] = config.get("api_key")
-                context["OPENAI_MODEL"] = config.get("model")
-                context["OPENAI_TEMPERATURE"] = config.get(
-                    "temperature", DEFAULT_OPENAI_TEMPERATURE
-                )
-        except s3_client.exceptions.NoSuchKey as e:
-            traceback.print_exc()
-            logger.error(f"set_s3_openai_api_key, team_id, key={key}, error={e}")
-
-        user_id = context.actor_user_id or context.user_id
-
-        key = context.team_id + "_" + user_id
-        try:
-            s3_response = s3_client.get_object(
-                Bucket=AWS_STORAGE_BUCKET_NAME, Key=key
-            )
-            config_str: str = s3_response["Body"].read().decode("utf-8")
-            if config_str.startswith("{"):
-                config = json.loads(config_str)
-                logger.info(f"set_s3_openai_api_key, team_id+user_id, config={config}")
-
-                context["db_table"] = config.get("db_table")
-                context["db_url"] = config.get("db_url")
-                context["db_schema"] = config.get("db_schema")
-                context["db_warehouse"] = config.get("db_warehouse")
-                context["ai_engine"] = config.get("ai_engine")
-                context["ai_model"] = config.get("ai_model")
-                context["ai_temp"] = config.get("ai_temp")
-                context["chat_history_size"] = config.get("chat_history_size")
-                context["debug"] = config.get("debug")
-                context["experimental_features"] = config.get("experimental_features")
-            else:
-                # The legacy data format
-                context["OPENAI_MODEL"] = DEFAULT_OPENAI_MODEL
-                context["OPENAI_TEMPERATURE"] = DEFAULT_OPENAI_TEMPERATURE
-        except s3_client.exceptions.NoSuchKey as e:
-            traceback.print_exc()
-            logger.error(f"set_s3_openai_api_key, team_id+user_id, key={key}, error={e}")
-
-        context["OPENAI_API_TYPE"] = DEFAULT_OPENAI_API_TYPE
-        context["OPENAI_API_BASE"] = DEFAULT_OPENAI_API_BASE
-        context["OPENAI_API_VERSION"] = DEFAULT_OPENAI_API_VERSION
-        context["OPENAI_DEPLOYMENT_ID"] = DEFAULT_OPENAI_DEPLOYMENT_ID
+        config_store = get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME)
+        with STAGE_SECONDS.time(stage="config_load"):
+            team_config_str = config_store.load(context.team_id)
+            user_config_str = config_store.load(get_user_bucket_key(context))
+        apply_s3_config_to_context(context, logger, team_config_str, user_config_str)
     except:  # noqa: E722
         context["api_key"] = None
     next_()
 
 
+async def async_set_s3_openai_api_key_func(context, next_, logger: logging.Logger, s3_client, AWS_STORAGE_BUCKET_NAME):
+    logger.info("async_set_s3_openai_api_key init")
+    try:
+        config_store = get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME)
+        with STAGE_SECONDS.time(stage="config_load"):
+            team_config_str, user_config_str = await asyncio.gather(
+                config_store.async_load(context.team_id),
+                config_store.async_load(get_user_bucket_key(context)),
+            )
+        apply_s3_config_to_context(context, logger, team_config_str, user_config_str)
+    except:  # noqa: E722
+        context["api_key"] = None
+    await next_()
+
+
+def get_user_bucket_key(context) -> str:
+    user_id = context.actor_user_id or context.user_id
+    return context.team_id + "_" + user_id
+
+
+def apply_s3_config_to_context(context, logger: logging.Logger, team_config_str, user_config_str):
+    if team_config_str is None:
+        logger.error(f"set_s3_openai_api_key, team_id, key={context.team_id}, error=NoSuchKey")
+    elif team_config_str.startswith("{"):
+        config = json.loads(team_config_str)
+        logger.info(f"set_s3_openai_api_key, team_id, config={redact_config(config)}")
+
+        context["api_key"] = config.get("api_key")
+        context["OPENAI_MODEL"] = config.get("model")
+        context["OPENAI_TEMPERATURE"] = config.get(
+            "temperature", DEFAULT_OPENAI_TEMPERATURE
+        )
+
+    if user_config_str is None:
+        logger.error(f"set_s3_openai_api_key, team_id+user_id, key={get_user_bucket_key(context)}, error=NoSuchKey")
+    elif user_config_str.startswith("{"):
+        config = json.loads(user_config_str)
+        logger.info(f"set_s3_openai_api_key, team_id+user_id, config={redact_config(config)}")
+
+        context["db_table"] = config.get("db_table")
+        context["db_url"] = config.get("db_url")
+        context["db_schema"] = config.get("db_schema")
+        context["db_warehouse"] = config.get("db_warehouse")
+        context["ai_engine"] = config.get("ai_engine")
+        context["ai_model"] = config.get("ai_model")
+        context["ai_temp"] = config.get("ai_temp")
+        context["chat_history_size"] = config.get("chat_history_size")
+        context["debug"] = config.get("debug")
+        context["experimental_features"] = config.get("experimental_features")
+    else:
+        # The legacy data format
+        context["OPENAI_MODEL"] = DEFAULT_OPENAI_MODEL
+        context["OPENAI_TEMPERATURE"] = DEFAULT_OPENAI_TEMPERATURE
+
+    context["OPENAI_API_TYPE"] = DEFAULT_OPENAI_API_TYPE
+    context["OPENAI_API_BASE"] = DEFAULT_OPENAI_API_BASE
+    context["OPENAI_API_VERSION"] = DEFAULT_OPENAI_API_VERSION
+    context["OPENAI_DEPLOYMENT_ID"] = DEFAULT_OPENAI_DEPLOYMENT_ID
+
+
 def render_home_tab_func(client, context, logger, s3_client, AWS_STORAGE_BUCKET_NAME):
     logger.info("render_home_tab, init")
     message = DEFAULT_HOME_TAB_MESSAGE
     configure_label = DEFAULT_HOME_TAB_CONFIGURE_LABEL
     try:
-        response = s3_client.get_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=context.team_id)
-        body = response['Body'].read().decode('utf-8')
+        body = get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME).load(context.team_id)
         data = json.loads(body)
         if data["api_key"] is not None:
             message = "This app is ready to use in this workspace :raised_hands:"
@@ -124,7 +137,6 @@ def handle_set_db_table_func(ack, command, respond, context: BoltContext, logger
     try:
         preview_table(context, client, payload, value)
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to run preview for table")  # Respond to the command
 
@@ -197,7 +209,6 @@ def handle_get_db_tables_func(ack, command, respond, context: BoltContext, logge
         )
 
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to get DB tables")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -264,7 +275,6 @@ def handle_get_db_schemas_func(ack, command, respond, context: BoltContext, logg
         )
 
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to get DB Schemas")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -292,13 +302,12 @@ def handle_set_db_url_func(ack, command, respond, context: BoltContext, logger:
         post_data_to_genieapi(api_key, "/update/user/database_connection", None,
                               {"connection_string_url": value, "resourcename": resource_name})
 
-        save_s3("db_url", resource_name, logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
-        save_s3("db_schema", "", logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
+        save_s3_changes({"db_url": resource_name, "db_schema": ""}, logger, context, s3_client,
+                        AWS_STORAGE_BUCKET_NAME)
 
         respond(text=f"DB URL set to: {redact_string(resource_name)}")  # Respond to the command
 
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to set DB URL to: {redact_string(value)}")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -338,7 +347,6 @@ def handle_get_db_urls_func(ack, respond, context: BoltContext, logger: logging.
         respond(blocks=blocks)
 
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to get DB URLs")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -358,7 +366,6 @@ def handle_preview_func(ack, command, respond, context: BoltContext, logger: log
     try:
         preview_table(context, client, payload, value)
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to run preview for table")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -379,7 +386,6 @@ def handle_suggest_func(ack, command, respond, context, logger, client, payload)
     try:
         suggest_table(context, client, payload, value)
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to run suggest for table")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -391,7 +397,7 @@ def handle_set_key_func(ack, command, respond, context: BoltContext, logger: log
     ack()
 
     api_key = command['text']
-    logger.info(f"set_key!!!, api_key={api_key}")
+    logger.info(f"set_key, team_id={context.team_id}, user_id={context.user_id}")
 
     if api_key is None or api_key == "":
         respond(text="You must provide an API key after /set_key asd123")
@@ -421,9 +427,8 @@ def handle_set_ai_engine_func(ack, command, respond, context: BoltContext, logge
     value = command['text']
     logger.info(f"set_ai_engine!!!, value={value}")
 
-    save_s3("ai_engine", value, logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
-    save_s3("db_schema", "", logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
-    save_s3("db_table", "", logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
+    save_s3_changes({"ai_engine": value, "db_schema": "", "db_table": ""}, logger, context, s3_client,
+                    AWS_STORAGE_BUCKET_NAME)
 
     respond(text=f"AI Engine set to: {value}")  # Respond to the command
 
@@ -464,8 +469,7 @@ def handle_use_db_func(ack, command, respond, context: BoltContext, logger: logg
         respond(text="You must provide the DB alias after. eg /use_db bold-sky")
         return send_help_buttons(context.channel_id, client, "")
 
-    save_s3("db_url", value, logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
-    save_s3("db_schema", "", logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
+    save_s3_changes({"db_url": value, "db_schema": ""}, logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
 
     respond(text=f"Default DB for queries set to: {value}")  # Respond to the command
 
@@ -501,7 +505,6 @@ def handle_predict_func(ack, command, respond, context, logger, client, payload)
     try:
         predict_table(context, client, payload, value)
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to run prediction")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -522,7 +525,6 @@ def handle_suggest_tables_func(ack, command, respond, context, logger, client, p
     try:
         suggest_tables(context, client, payload, value)
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to run handle_suggest_tables_func")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -677,7 +679,6 @@ def handle_get_db_warehouses_func(ack, command, respond, context: BoltContext, l
         )
 
     except Exception as e:
-        traceback.print_exc()
         logger.exception(e)
         respond(text=f"Failed to get DB Warehouses")  # Respond to the command
         return send_help_buttons(context.channel_id, client, "")
@@ -776,41 +777,29 @@ def save_s3(
         s3_client: boto3.client,
         AWS_STORAGE_BUCKET_NAME: str
 ):
-    bucket_key = get_bucket_key(context, key, logger)
+    save_s3_changes({key: value}, logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
 
-    try:
-        # Step 1: Try to get the existing object from S3
+
+def save_s3_changes(
+        changes: dict,
+        logger: logging.Logger,
+        context: BoltContext,
+        s3_client: boto3.client,
+        AWS_STORAGE_BUCKET_NAME: str
+):
+    # Keys may live in the team or the user object, so write each object once with all of its changes
+    changes_by_bucket_key = {}
+    for key, value in changes.items():
+        changes_by_bucket_key.setdefault(get_bucket_key(context, key, logger), {})[key] = value
+
+    for bucket_key, bucket_changes in changes_by_bucket_key.items():
         try:
-            response = s3_client.get_object(
-                Bucket=AWS_STORAGE_BUCKET_NAME,
-                Key=bucket_key
-            )
-            body = response['Body'].read().decode('utf-8')
-            data = json.loads(body)
-        except s3_client.exceptions.NoSuchKey:
-            traceback.print_exc()
-            # If the object doesn't exist, create a new one
-            data = {}
-
-        # Step 2: Update or set the key and value in the object
-        data[key] = value
-
-        # Step 3: Put the updated or new object back into S3
-        s3_client.put_object(
-            Bucket=AWS_STORAGE_BUCKET_NAME,
-            Key=bucket_key,
-            Body=json.dumps(data)
-        )
-        return
-    except botocore.exceptions.ClientError as e:
-        traceback.print_exc()
-        # Specific exception handling for boto3's client errors
-        logger.error(f"save_s3, Encountered an error ClientError, with boto3: {e}")
-        return
-    except Exception as e:
-        traceback.print_exc()
-        logger.error(f"save_s3, Encountered an error Exception, with boto3: {e}")
-        return
+            get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME).update(bucket_key, bucket_changes)
+        except botocore.exceptions.ClientError as e:
+            # Specific exception handling for boto3's client errors
+            logger.exception(f"save_s3, Encountered an error ClientError, with boto3: {e}")
+        except Exception as e:
+            logger.exception(f"save_s3, Encountered an error Exception, with boto3: {e}")
 
 
 def delete_s3(
@@ -823,24 +812,18 @@ def delete_s3(
     bucket_key = get_bucket_key(context, key, logger)
 
     try:
-        print(f"delete_s3, delete_object, bucket_key={bucket_key}")
-        s3_client.delete_object(
-            Bucket=AWS_STORAGE_BUCKET_NAME,
-            Key=bucket_key,
-        )
+        logger.info(f"delete_s3, delete_object, bucket_key={bucket_key}")
+        get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME).delete(bucket_key)
     except botocore.exceptions.ClientError as e:
-        traceback.print_exc()
         # Specific exception handling for boto3's client errors
-        logger.error(f"delete_s3, Encountered an error ClientError, with boto3: {e}")
+        logger.exception(f"delete_s3, Encountered an error ClientError, with boto3: {e}")
         return
     except Exception as e:
-        traceback.print_exc()
-        logger.error(f"delete_s3, Encountered an error Exception, with boto3: {e}")
+        logger.exception(f"delete_s3, Encountered an error Exception, with boto3: {e}")
         return
 
 
 def get_bucket_key(context, key, logger):
-    user_id = context.actor_user_id or context.user_id
     if key == "db_table" \
             or key == "db_url" \
             or key == "db_schema" \
@@ -851,7 +834,7 @@ def get_bucket_key(context, key, logger):
             or key == "debug" \
             or key == "experimental_features" \
             or key == "chat_history_size":
-        bucket_key = context.team_id + "_" + user_id
+        bucket_key = get_user_bucket_key(context)
     else:
         bucket_key = context.team_id
     logger.info(f"get_bucket_key, bucket_key={bucket_key}")
@@ -2,18 +2,20 @@ import json
 import logging
 import os
 import re
-import threading
-import traceback
 
 from slack_sdk.web import WebClient
 from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
 from slack_bolt import App, Ack, BoltContext
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 
 from app.bolt_listeners import register_listeners, before_authorize
 from app.env import (
     SLACK_APP_LOG_LEVEL,
 )
+from app.executor import submit_command
+from app.config_store import get_config_store
+from app.log_config import configure_logging
+from app.metrics import render_metrics, CONTENT_TYPE
 
 import boto3
 
@@ -29,7 +31,7 @@ from slack_handler import SlackRequestHandler
 from slack_s3_oauth_flow import LambdaS3OAuthFlow
 from slack_bolt.oauth.oauth_settings import OAuthSettings
 
-logging.basicConfig(format="%(asctime)s %(message)s", level=SLACK_APP_LOG_LEVEL)
+configure_logging(SLACK_APP_LOG_LEVEL)
 
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
@@ -78,8 +80,7 @@ def register_revocation_handlers(app: App):
                         user_id=user_id,
                     )
                 except Exception as e:
-                    traceback.print_exc()
-                    logger.error(
+                    logger.exception(
                         f"Failed to installation_store.delete_installation: (team_id: {context.team_id}, enterprise_id:{context.enterprise_id}, user_id={user_id}, error: {e})"
                     )
         bots = event.get("tokens", {}).get("bot", [])
@@ -90,15 +91,13 @@ def register_revocation_handlers(app: App):
                     team_id=context.team_id,
                 )
             except Exception as e:
-                traceback.print_exc()
-                logger.error(
+                logger.exception(
                     f"Failed to delete_bot: (team_id: {context.team_id}, enterprise_id:{context.enterprise_id}, error: {e})"
                 )
             try:
-                s3_client.delete_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=context.team_id)
+                get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME).delete(context.team_id)
             except Exception as e:
-                traceback.print_exc()
-                logger.error(
+                logger.exception(
                     f"Failed to delete an OpenAI auth key: (team_id: {context.team_id}, error: {e})"
                 )
 
@@ -114,15 +113,13 @@ def register_revocation_handlers(app: App):
                 team_id=context.team_id,
             )
         except Exception as e:
-            traceback.print_exc()
-            logger.error(
+            logger.exception(
                 f"Failed to delete_bot: (team_id: {context.team_id}, enterprise_id:{context.enterprise_id}, error: {e})"
             )
         try:
-            s3_client.delete_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=context.team_id)
+            get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME).delete(context.team_id)
         except Exception as e:
-            traceback.print_exc()
-            logger.error(
+            logger.exception(
                 f"Failed to delete an OpenAI auth key: (team_id: {context.team_id}, error: {e})"
             )
 
@@ -163,143 +160,143 @@ def set_s3_openai_api_key(context: BoltContext, next_, logger: logging.Logger):
 @app.command(f"/{PREFIX}set_db_table")
 def handle_set_db_table(ack, command, respond, context: BoltContext, logger: logging.Logger, client: WebClient,
                         payload: dict):
-    threading.Thread(target=handle_set_db_table_func,
-                     args=(ack, command, respond, context, logger, client, payload, s3_client,
-                           AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_db_table_func,
+                   (ack, command, respond, context, logger, client, payload, s3_client,
+                    AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}get_db_tables")
 def handle_get_db_tables(ack, command, respond, context: BoltContext, logger: logging.Logger, client: WebClient,
                          payload: dict):
-    threading.Thread(target=handle_get_db_tables_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_get_db_tables_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}set_db_url")
 def handle_set_db_url(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_db_url_func,
-                     args=(ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_db_url_func,
+                   (ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}get_db_urls")
 def handle_get_db_urls(ack, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_get_db_urls_func,
-                     args=(ack, respond, context, logger, client)).start()
+    submit_command(ack, respond, context, handle_get_db_urls_func,
+                   (ack, respond, context, logger, client))
 
 
 @app.command(f"/{PREFIX}preview")
 def handle_preview(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-    threading.Thread(target=handle_preview_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_preview_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}suggest")
 def handle_suggest(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-    threading.Thread(target=handle_suggest_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_suggest_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}set_key")
 def handle_set_key(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_key_func,
-                     args=(ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_key_func,
+                   (ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}get_db_schemas")
 def handle_get_db_schemas(ack, command, respond, context: BoltContext, logger: logging.Logger, client: WebClient,
                           payload: dict):
-    threading.Thread(target=handle_get_db_schemas_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_get_db_schemas_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}set_db_schema")
 def handle_set_db_schema(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_db_schema_func,
-                     args=(ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_db_schema_func,
+                   (ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}set_ai_engine")
 def handle_set_ai_engine(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_ai_engine_func,
-                     args=(ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_ai_engine_func,
+                   (ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}login")
 def handle_login(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_login_func,
-                     args=(ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_login_func,
+                   (ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}use_db")
 def handle_use_db(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_use_db_func,
-                     args=(ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_use_db_func,
+                   (ack, command, respond, context, logger, client, s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}set_chat_history_size")
 def handle_set_chat_history_size(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_chat_history_size_func,
-                     args=(ack, command, respond, context, logger, client, s3_client,
-                           AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_chat_history_size_func,
+                   (ack, command, respond, context, logger, client, s3_client,
+                    AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}predict")
 def handle_predict(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-    threading.Thread(target=handle_predict_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_predict_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}suggest_tables")
 def handle_suggest_tables(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-    threading.Thread(target=handle_suggest_tables_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_suggest_tables_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}get_queries")
 def handle_suggest_tables(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-    threading.Thread(target=handle_show_queries_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_show_queries_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}set_debug")
 def handle_set_debug(ack, command, respond, context: BoltContext, logger: logging.Logger, client, payload):
-    threading.Thread(target=handle_set_debug_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_set_debug_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}set_experimental_features")
 def handle_set_experimental_features(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_experimental_features_func,
-                     args=(ack, command, respond, context, logger, client, s3_client,
-                           AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_experimental_features_func,
+                   (ack, command, respond, context, logger, client, s3_client,
+                    AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}set_db_warehouse")
 def handle_set_db_warehouse(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_db_warehouse_func,
-                     args=(ack, command, respond, context, logger, client, s3_client,
-                           AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_db_warehouse_func,
+                   (ack, command, respond, context, logger, client, s3_client,
+                    AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}get_db_warehouses")
 def handle_get_db_warehouses(ack, command, respond, context: BoltContext, logger: logging.Logger, client: WebClient,
                              payload: dict):
-    threading.Thread(target=handle_get_db_warehouses_func,
-                     args=(ack, command, respond, context, logger, client, payload)).start()
+    submit_command(ack, respond, context, handle_get_db_warehouses_func,
+                   (ack, command, respond, context, logger, client, payload))
 
 
 @app.command(f"/{PREFIX}set_ai_model")
 def handle_set_ai_model(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_ai_model_func,
-                     args=(ack, command, respond, context, logger, client, s3_client,
-                           AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_ai_model_func,
+                   (ack, command, respond, context, logger, client, s3_client,
+                    AWS_STORAGE_BUCKET_NAME))
 
 
 @app.command(f"/{PREFIX}set_ai_temp")
 def handle_set_ai_temp(ack, command, respond, context: BoltContext, logger: logging.Logger, client):
-    threading.Thread(target=handle_set_ai_temp_func,
-                     args=(ack, command, respond, context, logger, client, s3_client,
-                           AWS_STORAGE_BUCKET_NAME)).start()
+    submit_command(ack, respond, context, handle_set_ai_temp_func,
+                   (ack, command, respond, context, logger, client, s3_client,
+                    AWS_STORAGE_BUCKET_NAME))
 
 
 @app.action(re.compile("^help:"))
@@ -313,18 +310,18 @@ def handle_buttons_actions(ack, body, respond, context: BoltContext, logger: log
     command = {"text": parameter}
     ack()
     if action == 'use_db':
-        threading.Thread(target=handle_use_db_func,
-                         args=(ack, command, respond, context, logger, client,
-                               s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_use_db_func,
+                       (ack, command, respond, context, logger, client,
+                        s3_client, AWS_STORAGE_BUCKET_NAME))
     if action == "set_db_table":
-        threading.Thread(target=handle_set_db_table_func,
-                         args=(ack, command, respond, context, logger, client, payload,
-                               s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_db_table_func,
+                       (ack, command, respond, context, logger, client, payload,
+                        s3_client, AWS_STORAGE_BUCKET_NAME))
 
     if action == "set_db_warehouse":
-        threading.Thread(target=handle_set_db_warehouse_func,
-                         args=(ack, command, respond, context, logger, client,
-                               s3_client, AWS_STORAGE_BUCKET_NAME)).start()
+        submit_command(ack, respond, context, handle_set_db_warehouse_func,
+                       (ack, command, respond, context, logger, client,
+                        s3_client, AWS_STORAGE_BUCKET_NAME))
 
 
 
@@ -332,8 +329,8 @@ def handle_buttons_actions(ack, body, respond, context: BoltContext, logger: log
 @app.action("query_selected")
 def handle_query_selection(ack, context, client, payload, body, respond):
     id = body["actions"][0]["selected_option"]["value"]
-    threading.Thread(target=handle_query_selected_action,
-                     args=(ack, context, client, payload, respond, id)).start()
+    submit_command(ack, respond, context, handle_query_selected_action,
+                   (ack, context, client, payload, respond, id))
 
 
 @app.event("app_home_opened")
@@ -420,7 +417,7 @@ def slack_configure():
     try:
         validate_api_key_registration(view, context, logger)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception(f"slack_configure, validation failed, error={e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
     try:
@@ -442,6 +439,11 @@ def health_check():
     return jsonify({"status": "ok"}), 200
 
 
+@flask_app.route("/metrics", methods=['GET'])
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
 @flask_app.route("/slack/oauth_redirect", methods=["GET"])
 def oauth_redirect():
     return slack_handler.handle(req=request)
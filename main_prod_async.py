@@ -0,0 +1,380 @@
+import asyncio
+import logging
+import os
+import re
+from typing import Callable
+
+import boto3
+from aiohttp import web
+from slack_bolt.adapter.aiohttp import to_bolt_request, to_aiohttp_response
+from slack_bolt.async_app import AsyncApp, AsyncAck, AsyncBoltContext
+from slack_bolt.context.respond import Respond
+from slack_bolt.context.say import Say
+from slack_bolt.oauth.async_oauth_settings import AsyncOAuthSettings
+from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
+from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
+from slack_sdk.oauth.installation_store.amazon_s3 import AmazonS3InstallationStore
+from slack_sdk.oauth.state_store.amazon_s3 import AmazonS3OAuthStateStore
+from slack_sdk.web import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
+
+from app.async_bolt_listeners import register_async_listeners, async_before_authorize
+from app.async_genie_client import get_async_genie_client
+from app.env import (
+    SLACK_APP_LOG_LEVEL,
+)
+from app.executor import command_executor, count_command, DEFAULT_BUSY_TEXT
+from app.config_store import get_config_store
+from app.installation_store import CachingInstallationStore, ThreadedInstallationStore, ThreadedOAuthStateStore
+from app.log_config import configure_logging
+from app.metrics import render_metrics, CONTENT_TYPE
+
+from main_handlers import handle_use_db_func, handle_suggest_func, handle_preview_func, \
+    handle_get_db_urls_func, handle_set_db_url_func, handle_get_db_tables_func, handle_set_db_table_func, \
+    async_set_s3_openai_api_key_func, handle_help_actions_func, handle_set_chat_history_size_func, \
+    handle_predict_func, render_home_tab_func, handle_login_func, handle_set_key_func, handle_set_db_schema_func, \
+    handle_suggest_tables_func, handle_set_ai_engine_func, handle_get_db_schemas_func, handle_show_queries_func, \
+    handle_query_selected_action, handle_set_debug_func, handle_set_experimental_features_func, \
+    handle_set_db_warehouse_func, handle_get_db_warehouses_func, handle_set_ai_model_func, handle_set_ai_temp_func
+from main_prod_funcs import validate_api_key_registration, save_api_key_registration
+
+configure_logging(SLACK_APP_LOG_LEVEL)
+
+AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
+AWS_STORAGE_BUCKET_NAME = os.environ.get("AWS_STORAGE_BUCKET_NAME")
+AWS_S3_REGION_NAME = os.environ.get("AWS_S3_REGION_NAME", "nl-ams")
+AWS_S3_ENDPOINT_URL = os.environ.get("AWS_S3_ENDPOINT_URL")
+
+SLACK_CLIENT_ID = os.environ.get("SLACK_CLIENT_ID")
+SLACK_CLIENT_SECRET = os.environ.get("SLACK_CLIENT_SECRET")
+SLACK_STATE_S3_BUCKET_NAME = os.environ.get("SLACK_STATE_S3_BUCKET_NAME")
+SLACK_INSTALLATION_S3_BUCKET_NAME = os.environ.get("SLACK_INSTALLATION_S3_BUCKET_NAME")
+
+GPTINSLACK_HOST = os.environ.get("GPTINSLACK_HOST")
+PREFIX = ""
+if GPTINSLACK_HOST == "https://gptinslack.defytrends.dev":
+    PREFIX = "p"
+
+s3_client = boto3.client(
+    's3',
+    aws_access_key_id=AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    endpoint_url=AWS_S3_ENDPOINT_URL,
+    region_name=AWS_S3_REGION_NAME,
+    verify=True  # Consider this only if you have SSL issues, but be aware of the security implications
+)
+
+client_template = AsyncWebClient()
+client_template.retry_handlers.append(AsyncRateLimitErrorRetryHandler(max_retry_count=2))
+
+oauth_settings = AsyncOAuthSettings(
+    client_id=SLACK_CLIENT_ID,
+    client_secret=SLACK_CLIENT_SECRET,
+    redirect_uri=f"{GPTINSLACK_HOST}/slack/oauth_redirect",
+    install_page_rendering_enabled=True,
+    install_path="/slack/install",
+    redirect_uri_path="/slack/oauth_redirect",
+    # The S3 stores' async methods call boto3 directly; the Threaded* adapters run those calls off the event loop
+    state_store=ThreadedOAuthStateStore(AmazonS3OAuthStateStore(
+        s3_client=s3_client,
+        bucket_name=SLACK_STATE_S3_BUCKET_NAME,
+        expiration_seconds=600,
+    )),
+    installation_store=CachingInstallationStore(ThreadedInstallationStore(AmazonS3InstallationStore(
+        s3_client=s3_client,
+        bucket_name=SLACK_INSTALLATION_S3_BUCKET_NAME,
+        client_id=SLACK_CLIENT_ID,
+    ))),
+)
+
+app = AsyncApp(
+    process_before_response=True,
+    before_authorize=async_before_authorize,
+    oauth_settings=oauth_settings,
+    client=client_template,
+)
+register_async_listeners(app)
+
+
+#
+# The slash command and button handlers in main_handlers.py are synchronous.
+# They keep running on command_executor, with sync Slack adapters built from the request.
+#
+
+
+def noop_ack(*args, **kwargs):
+    # The async listener has already acknowledged the request
+    pass
+
+
+def sync_client(context: AsyncBoltContext) -> WebClient:
+    client = WebClient(token=context.bot_token)
+    client.retry_handlers.append(RateLimitErrorRetryHandler(max_retry_count=2))
+    return client
+
+
+async def submit_sync_command(ack: AsyncAck, body: dict, context: AsyncBoltContext, target: Callable,
+                              build_args: Callable) -> bool:
+    """Acknowledges the request and queues target(*build_args(ack, respond, client)) on command_executor."""
+    await ack()
+    client = sync_client(context)
+    respond = Respond(response_url=body.get("response_url"))
+    queued = command_executor.submit(context.team_id, target, *build_args(noop_ack, respond, client))
+    count_command(target, queued)
+    if queued:
+        return True
+    logging.getLogger(__name__).warning(
+        f"submit_sync_command, executor saturated, team_id={context.team_id}, stats={command_executor.stats()}"
+    )
+    await asyncio.to_thread(respond, text=DEFAULT_BUSY_TEXT)
+    return False
+
+
+def payload_command(target: Callable):
+    async def handler(ack: AsyncAck, command: dict, body: dict, context: AsyncBoltContext,
+                      logger: logging.Logger, payload: dict):
+        await submit_sync_command(ack, body, context, target,
+                                  lambda a, respond, client: (a, command, respond, context, logger, client, payload))
+    return handler
+
+
+def s3_command(target: Callable):
+    async def handler(ack: AsyncAck, command: dict, body: dict, context: AsyncBoltContext, logger: logging.Logger):
+        await submit_sync_command(ack, body, context, target,
+                                  lambda a, respond, client: (a, command, respond, context, logger, client,
+                                                              s3_client, AWS_STORAGE_BUCKET_NAME))
+    return handler
+
+
+async def handle_set_db_table(ack: AsyncAck, command: dict, body: dict, context: AsyncBoltContext,
+                              logger: logging.Logger, payload: dict):
+    await submit_sync_command(ack, body, context, handle_set_db_table_func,
+                              lambda a, respond, client: (a, command, respond, context, logger, client, payload,
+                                                          s3_client, AWS_STORAGE_BUCKET_NAME))
+
+
+async def handle_get_db_urls(ack: AsyncAck, body: dict, context: AsyncBoltContext, logger: logging.Logger):
+    await submit_sync_command(ack, body, context, handle_get_db_urls_func,
+                              lambda a, respond, client: (a, respond, context, logger, client))
+
+
+app.command(f"/{PREFIX}set_db_table")(handle_set_db_table)
+app.command(f"/{PREFIX}get_db_tables")(payload_command(handle_get_db_tables_func))
+app.command(f"/{PREFIX}set_db_url")(s3_command(handle_set_db_url_func))
+app.command(f"/{PREFIX}get_db_urls")(handle_get_db_urls)
+app.command(f"/{PREFIX}preview")(payload_command(handle_preview_func))
+app.command(f"/{PREFIX}suggest")(payload_command(handle_suggest_func))
+app.command(f"/{PREFIX}set_key")(s3_command(handle_set_key_func))
+app.command(f"/{PREFIX}get_db_schemas")(payload_command(handle_get_db_schemas_func))
+app.command(f"/{PREFIX}set_db_schema")(s3_command(handle_set_db_schema_func))
+app.command(f"/{PREFIX}set_ai_engine")(s3_command(handle_set_ai_engine_func))
+app.command(f"/{PREFIX}login")(s3_command(handle_login_func))
+app.command(f"/{PREFIX}use_db")(s3_command(handle_use_db_func))
+app.command(f"/{PREFIX}set_chat_history_size")(s3_command(handle_set_chat_history_size_func))
+app.command(f"/{PREFIX}predict")(payload_command(handle_predict_func))
+app.command(f"/{PREFIX}suggest_tables")(payload_command(handle_suggest_tables_func))
+app.command(f"/{PREFIX}get_queries")(payload_command(handle_show_queries_func))
+app.command(f"/{PREFIX}set_debug")(payload_command(handle_set_debug_func))
+app.command(f"/{PREFIX}set_experimental_features")(s3_command(handle_set_experimental_features_func))
+app.command(f"/{PREFIX}set_db_warehouse")(s3_command(handle_set_db_warehouse_func))
+app.command(f"/{PREFIX}get_db_warehouses")(payload_command(handle_get_db_warehouses_func))
+app.command(f"/{PREFIX}set_ai_model")(s3_command(handle_set_ai_model_func))
+app.command(f"/{PREFIX}set_ai_temp")(s3_command(handle_set_ai_temp_func))
+
+
+@app.action(re.compile("^help:"))
+async def handle_help_actions(ack: AsyncAck, body: dict, context: AsyncBoltContext):
+    await submit_sync_command(ack, body, context, handle_help_actions_func,
+                              lambda a, respond, client: (a, body, Say(client, context.channel_id)))
+
+
+@app.action(re.compile("^button:.+:.+"))
+async def handle_buttons_actions(ack: AsyncAck, body: dict, context: AsyncBoltContext, logger: logging.Logger,
+                                 payload: dict):
+    _, action, parameter = body['actions'][0]['action_id'].split(':')
+    command = {"text": parameter}
+    if action == 'use_db':
+        await submit_sync_command(ack, body, context, handle_use_db_func,
+                                  lambda a, respond, client: (a, command, respond, context, logger, client,
+                                                              s3_client, AWS_STORAGE_BUCKET_NAME))
+    elif action == "set_db_table":
+        await submit_sync_command(ack, body, context, handle_set_db_table_func,
+                                  lambda a, respond, client: (a, command, respond, context, logger, client, payload,
+                                                              s3_client, AWS_STORAGE_BUCKET_NAME))
+    elif action == "set_db_warehouse":
+        await submit_sync_command(ack, body, context, handle_set_db_warehouse_func,
+                                  lambda a, respond, client: (a, command, respond, context, logger, client,
+                                                              s3_client, AWS_STORAGE_BUCKET_NAME))
+    else:
+        await ack()
+
+
+@app.action("query_selected")
+async def handle_query_selection(ack: AsyncAck, body: dict, context: AsyncBoltContext, payload: dict):
+    id = body["actions"][0]["selected_option"]["value"]
+    await submit_sync_command(ack, body, context, handle_query_selected_action,
+                              lambda a, respond, client: (a, context, client, payload, respond, id))
+
+
+@app.event("app_home_opened")
+async def render_home_tab(context: AsyncBoltContext, logger: logging.Logger):
+    await asyncio.to_thread(render_home_tab_func, sync_client(context), context, logger,
+                            s3_client, AWS_STORAGE_BUCKET_NAME)
+
+
+@app.event("tokens_revoked")
+async def handle_tokens_revoked_events(event: dict, context: AsyncBoltContext, logger: logging.Logger):
+    logger.info("handle_tokens_revoked_events, init")
+    user_ids = event.get("tokens", {}).get("oauth", [])
+    for user_id in user_ids:
+        try:
+            await app.installation_store.async_delete_installation(
+                enterprise_id=context.enterprise_id,
+                team_id=context.team_id,
+                user_id=user_id,
+            )
+        except Exception as e:
+            logger.exception(
+                f"Failed to installation_store.delete_installation: (team_id: {context.team_id}, enterprise_id:{context.enterprise_id}, user_id={user_id}, error: {e})"
+            )
+    bots = event.get("tokens", {}).get("bot", [])
+    if len(bots) > 0:
+        try:
+            await app.installation_store.async_delete_bot(
+                enterprise_id=context.enterprise_id,
+                team_id=context.team_id,
+            )
+        except Exception as e:
+            logger.exception(
+                f"Failed to delete_bot: (team_id: {context.team_id}, enterprise_id:{context.enterprise_id}, error: {e})"
+            )
+        await delete_team_config(context, logger)
+
+
+@app.event("app_uninstalled")
+async def handle_app_uninstalled_events(context: AsyncBoltContext, logger: logging.Logger):
+    logger.info("handle_app_uninstalled_events, init")
+    try:
+        await app.installation_store.async_delete_all(
+            enterprise_id=context.enterprise_id,
+            team_id=context.team_id,
+        )
+    except Exception as e:
+        logger.exception(
+            f"Failed to delete_bot: (team_id: {context.team_id}, enterprise_id:{context.enterprise_id}, error: {e})"
+        )
+    await delete_team_config(context, logger)
+
+
+async def delete_team_config(context: AsyncBoltContext, logger: logging.Logger):
+    try:
+        await asyncio.to_thread(get_config_store(s3_client, AWS_STORAGE_BUCKET_NAME).delete, context.team_id)
+    except Exception as e:
+        logger.exception(
+            f"Failed to delete an OpenAI auth key: (team_id: {context.team_id}, error: {e})"
+        )
+
+
+@app.middleware
+async def log_request(logger, body, next):
+    logger.debug(body)
+    return await next()
+
+
+@app.middleware
+async def set_s3_openai_api_key(context: AsyncBoltContext, next_, logger: logging.Logger):
+    return await async_set_s3_openai_api_key_func(context, next_, logger, s3_client, AWS_STORAGE_BUCKET_NAME)
+
+
+@app.action("configure")
+async def handle_some_action(ack: AsyncAck, body: dict, client: AsyncWebClient, logger: logging.Logger):
+    logger.info("handle_some_action, init")
+    await ack()
+    api_key_text = "Save your Genie API key:"
+    submit = "Submit"
+    cancel = "Cancel"
+
+    await client.views_open(
+        trigger_id=body["trigger_id"],
+        view={
+            "type": "modal",
+            "callback_id": "configure",
+            "title": {"type": "plain_text", "text": "Genie API Key"},
+            "submit": {"type": "plain_text", "text": submit},
+            "close": {"type": "plain_text", "text": cancel},
+            "blocks": [
+                {
+                    "type": "input",
+                    "block_id": "api_key",
+                    "label": {"type": "plain_text", "text": api_key_text},
+                    "element": {"type": "plain_text_input", "action_id": "input"},
+                },
+            ],
+        },
+    )
+
+
+@app.view("configure")
+async def handle_modal_submission(ack: AsyncAck, view: dict, context: AsyncBoltContext, logger: logging.Logger):
+    logger.info("handle_modal_submission, configure, init")
+
+    try:
+        await asyncio.to_thread(validate_api_key_registration, view, context, logger)
+        await asyncio.to_thread(save_api_key_registration, view, logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
+    except Exception as e:
+        logger.exception(e)
+        await ack(
+            response_action="errors",
+            errors={"model": "failed to save api key"},
+        )
+        return
+
+    await ack()
+
+
+#
+# aiohttp server
+#
+
+
+async def handle_bolt_request(request: web.Request) -> web.Response:
+    bolt_response = await app.async_dispatch(await to_bolt_request(request))
+    return await to_aiohttp_response(bolt_response)
+
+
+async def handle_install(request: web.Request) -> web.Response:
+    bolt_response = await app.oauth_flow.handle_installation(await to_bolt_request(request))
+    return await to_aiohttp_response(bolt_response)
+
+
+async def handle_oauth_redirect(request: web.Request) -> web.Response:
+    bolt_response = await app.oauth_flow.handle_callback(await to_bolt_request(request))
+    return await to_aiohttp_response(bolt_response)
+
+
+async def health_check(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_metrics().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def close_genie_client(web_app: web.Application):
+    await get_async_genie_client().close()
+
+
+web_app = web.Application()
+web_app.add_routes([
+    web.post("/slack/events", handle_bolt_request),
+    web.post("/slack/interactions", handle_bolt_request),
+    web.get("/slack/install", handle_install),
+    web.get("/slack/oauth_redirect", handle_oauth_redirect),
+    web.get("/healthcheck", health_check),
+    web.get("/metrics", metrics),
+])
+web_app.on_cleanup.append(close_genie_client)
+
+if __name__ == "__main__":
+    web.run_app(web_app, port=int(os.environ.get("PORT", 3000)))
@@ -1,5 +1,4 @@
 import logging
-import traceback
 
 from app.utils import fetch_data_from_genieapi
 from slack_bolt import BoltContext
@@ -14,14 +13,13 @@ def validate_api_key_registration(view: dict, context: BoltContext, logger: logg
     inputs = view["state"]["values"]
     api_key = inputs["api_key"]["input"]["value"]
 
-    logger.info(f"validate_api_key_registration, init, already_set_api_key={already_set_api_key}")
+    logger.info(f"validate_api_key_registration, init, api_key_already_set={bool(already_set_api_key)}")
 
     try:
         isauth = fetch_data_from_genieapi(api_key=api_key, endpoint="/isauth")
         if isauth["message"] != "ok":
             raise Exception("Invalid Genie API KEY")
     except Exception as e:
-        traceback.print_exc()
         text = "This API key seems to be invalid"
         logger.exception(e)
         raise Exception(text)
@@ -40,5 +38,5 @@ def save_api_key_registration(
     try:
         save_s3("api_key", api_key, logger, context, s3_client, AWS_STORAGE_BUCKET_NAME)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception(f"save_api_key_registration, failed to save the API key, error={e}")
         raise Exception(f"Failed to save Genie API KEY, e={e}")
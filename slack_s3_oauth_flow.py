@@ -14,6 +14,8 @@ from slack_sdk.oauth.state_store.amazon_s3 import AmazonS3OAuthStateStore
 from slack_bolt.oauth.oauth_settings import OAuthSettings
 from slack_bolt.util.utils import create_web_client
 
+from app.installation_store import CachingInstallationStore
+
 
 class LambdaS3OAuthFlow(OAuthFlow):
     def __init__(
@@ -56,13 +58,18 @@ class LambdaS3OAuthFlow(OAuthFlow):
                 expiration_seconds=settings.state_expiration_seconds,
             )
 
-        if settings.installation_store is None or not isinstance(settings.installation_store, AmazonS3InstallationStore):
+        if settings.installation_store is None or not isinstance(
+                settings.installation_store, (AmazonS3InstallationStore, CachingInstallationStore)
+        ):
             settings.installation_store = AmazonS3InstallationStore(
                 logger=logger,
                 s3_client=self.s3_client,
                 bucket_name=installation_bucket_name,
                 client_id=settings.client_id,
             )
+        # Keep bot and installation lookups in memory, so authorizing an event isn't an S3 round trip
+        if not isinstance(settings.installation_store, CachingInstallationStore):
+            settings.installation_store = CachingInstallationStore(settings.installation_store)
 
         # Set up authorize function to surely use this installation_store.
         # When a developer use a settings initialized outside this constructor,
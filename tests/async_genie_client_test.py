@@ -0,0 +1,48 @@
+import asyncio
+
+from app.async_genie_client import async_fetch_data_from_genieapi, to_query_params
+from app.metrics import STAGE_SECONDS
+from app.polling import BackoffSchedule
+
+
+class FakeAsyncGenieClient:
+    read_timeout = 1
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def get(self, endpoint, api_key, params=None, read_timeout=None):
+        self.calls.append((endpoint, params))
+        return self.responses.pop(0)
+
+
+def test_to_query_params():
+    assert to_query_params(None) is None
+    assert to_query_params({"a": None, "b": True, "c": 3}) == {"b": "True", "c": "3"}
+
+
+def test_async_fetch_polls_until_success():
+    poll_waits = STAGE_SECONDS.count(stage="genie_poll_wait")
+    genie_client = FakeAsyncGenieClient([(404, None), (404, None), (200, {"status": "processing_sql"})])
+    result = asyncio.run(async_fetch_data_from_genieapi(
+        api_key="key",
+        endpoint="/language_to_sql_process",
+        id=42,
+        genie_client=genie_client,
+        poll_schedule=BackoffSchedule(initial_delay=0.01, max_delay=0.01, max_wait=5, jitter=0),
+    ))
+    assert result == {"status": "processing_sql"}
+    assert len(genie_client.calls) == 3
+    assert genie_client.calls[0][1]["id"] == 42
+    assert STAGE_SECONDS.count(stage="genie_poll_wait") == poll_waits + 1
+
+
+def test_async_fetch_without_polling_is_not_a_poll_wait():
+    poll_waits = STAGE_SECONDS.count(stage="genie_poll_wait")
+    genie_client = FakeAsyncGenieClient([(200, {"status": "ok"})])
+    result = asyncio.run(async_fetch_data_from_genieapi(
+        api_key="key", endpoint="/get_my_chat_history", genie_client=genie_client
+    ))
+    assert result == {"status": "ok"}
+    assert STAGE_SECONDS.count(stage="genie_poll_wait") == poll_waits
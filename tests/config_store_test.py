@@ -0,0 +1,77 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from app import config_store
+from app.config_store import SQLiteConfigStore, TieredConfigStore, ConfigStore
+
+
+class DictConfigStore(ConfigStore):
+    def __init__(self):
+        self.objects = {}
+        self.load_count = 0
+
+    def load(self, key):
+        self.load_count += 1
+        return self.objects.get(key)
+
+    def update(self, key, changes):
+        data = json.loads(self.objects.get(key) or "{}")
+        data.update(changes)
+        self.objects[key] = json.dumps(data)
+        return data
+
+    def delete(self, key):
+        self.objects.pop(key, None)
+
+
+def test_sqlite_config_store(tmp_path):
+    store = SQLiteConfigStore(str(tmp_path / "config.sqlite3"))
+    assert store.load("T1") is None
+    assert store.update("T1", {"api_key": "x"}) == {"api_key": "x"}
+    assert store.update("T1", {"db_url": "bold-sky"}) == {"api_key": "x", "db_url": "bold-sky"}
+    assert json.loads(asyncio.run(store.async_load("T1"))) == {"api_key": "x", "db_url": "bold-sky"}
+    store.delete("T1")
+    assert store.load("T1") is None
+
+
+def test_sqlite_config_store_concurrent_updates(tmp_path):
+    store = SQLiteConfigStore(str(tmp_path / "config.sqlite3"))
+    keys = [f"key{i}" for i in range(20)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda key: store.update("T1_U1", {key: "v"}), keys))
+    assert sorted(json.loads(store.load("T1_U1"))) == sorted(keys)
+
+
+def test_tiered_config_store(tmp_path):
+    remote = DictConfigStore()
+    remote.objects["T1"] = '{"api_key": "x"}'
+    store = TieredConfigStore(SQLiteConfigStore(str(tmp_path / "config.sqlite3")), remote, ttl_seconds=60)
+    for _ in range(3):
+        assert store.load("T1") == '{"api_key": "x"}'
+        assert store.load("T2") is None
+    assert remote.load_count == 2
+
+    store.update("T1", {"db_url": "bold-sky"})
+    assert json.loads(store.load("T1")) == {"api_key": "x", "db_url": "bold-sky"}
+    store.delete("T1")
+    assert store.load("T1") is None
+    assert remote.load_count == 2
+
+
+def test_get_config_store_is_per_client_and_bucket():
+    first, second = object(), object()
+    store = config_store.get_config_store(first, "bucket")
+    assert config_store.get_config_store(first, "bucket") is store
+    assert config_store.get_config_store(second, "bucket") is not store
+    assert config_store.get_config_store(first, "other") is not store
+
+
+def test_in_memory_sqlite_config_store_is_shared_by_threads():
+    store = SQLiteConfigStore(":memory:")
+    store.update("T1", {"api_key": "x"})
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert executor.submit(store.update, "T1", {"db_url": "bold-sky"}).result() == {
+            "api_key": "x", "db_url": "bold-sky"
+        }
+        assert json.loads(executor.submit(store.load, "T1").result()) == {"api_key": "x", "db_url": "bold-sky"}
@@ -0,0 +1,31 @@
+import threading
+
+from app.executor import FairBoundedExecutor
+
+
+def test_round_robin_across_teams_and_rejection():
+    executor = FairBoundedExecutor(max_workers=1, max_queue_size=5, max_queue_size_per_team=3)
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    assert executor.submit("T1", block)
+    started.wait()
+    assert executor.active_workers() == 1
+
+    for i in range(3):
+        assert executor.submit("T1", order.append, f"T1-{i}")
+    assert executor.submit("T1", order.append, "T1-3") is False  # per-team limit
+    assert executor.submit("T2", order.append, "T2-0")
+    assert executor.submit("T2", order.append, "T2-1")
+    assert executor.submit("T3", order.append, "T3-0") is False  # overall limit
+    assert executor.queue_depth() == 5
+
+    release.set()
+    executor.shutdown(wait=True)
+    assert order == ["T1-0", "T2-0", "T1-1", "T2-1", "T1-2"]
+    assert executor.stats()["rejected"] == 2
@@ -0,0 +1,86 @@
+import time
+
+from slack_bolt import BoltRequest
+
+from app.idempotency import (
+    InMemoryEventIdStore,
+    SQLiteEventIdStore,
+    TieredEventIdStore,
+    event_dedup_keys,
+    is_duplicate_event,
+    retry_num,
+)
+
+
+def event_body(event_id, client_msg_id=None, event_type="app_mention"):
+    event = {"type": event_type, "text": "hi", "channel": "C1", "ts": "1.0"}
+    if client_msg_id:
+        event["client_msg_id"] = client_msg_id
+    return {"type": "event_callback", "team_id": "T1", "event_id": event_id, "event": event}
+
+
+def test_event_dedup_keys():
+    assert event_dedup_keys({"type": "block_actions"}) == []
+    assert event_dedup_keys(event_body("Ev1", "m1")) == ["event:Ev1", "msg:app_mention:m1"]
+
+
+def test_retries_are_duplicates():
+    store = InMemoryEventIdStore(ttl_seconds=60)
+    assert not is_duplicate_event(event_body("Ev1", "m1"), store)
+    assert is_duplicate_event(event_body("Ev1", "m1"), store)
+    # The same user message redelivered under a new event id
+    assert is_duplicate_event(event_body("Ev2", "m1"), store)
+    # The message event for the same message is handled by its own listener
+    assert not is_duplicate_event(event_body("Ev3", "m1", event_type="message"), store)
+    assert not is_duplicate_event({"type": "block_actions"}, store)
+
+
+def test_in_memory_store_expires_and_bounds_keys():
+    store = InMemoryEventIdStore(ttl_seconds=0.05, max_size=2)
+    assert store.claim("a")
+    assert not store.claim("a")
+    time.sleep(0.06)
+    assert store.claim("a")
+    assert store.claim("b")
+    assert store.claim("c")  # evicts "a"
+    assert store.claim("a")
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    path = str(tmp_path / "events.sqlite3")
+    first = TieredEventIdStore(InMemoryEventIdStore(), SQLiteEventIdStore(path))
+    second = TieredEventIdStore(InMemoryEventIdStore(), SQLiteEventIdStore(path))
+    assert first.claim("event:Ev1")
+    assert not second.claim("event:Ev1")
+    assert not first.claim("event:Ev1")
+
+    expiring = SQLiteEventIdStore(path, ttl_seconds=0)
+    assert expiring.claim("event:Ev2")
+    assert expiring.claim("event:Ev2")
+
+
+def test_retry_num():
+    assert retry_num(BoltRequest(body="{}", headers={"X-Slack-Retry-Num": "2"})) == 2
+    assert retry_num(BoltRequest(body="{}", headers={})) == 0
+
+
+def test_in_memory_sqlite_store_is_shared_by_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    store = SQLiteEventIdStore(":memory:")
+    assert store.claim("event:Ev1")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert not executor.submit(store.claim, "event:Ev1").result()
+
+
+def test_sqlite_store_prunes_on_an_interval(tmp_path):
+    store = SQLiteEventIdStore(str(tmp_path / "events.sqlite3"), ttl_seconds=0, prune_interval_seconds=3600)
+    assert store.claim("event:Ev1")
+    assert store.claim("event:Ev2")
+    # Expired, but not pruned until the interval has passed
+    assert store.db.fetchone("SELECT COUNT(*) FROM events") == (2,)
+    store._next_prune = 0
+    assert store.claim("event:Ev3")
+    assert store.db.fetchone("SELECT COUNT(*) FROM events") == (1,)
+    plan = store.db.fetchone("EXPLAIN QUERY PLAN DELETE FROM events WHERE expires_at <= 0")
+    assert "events_expires_at" in plan[-1]
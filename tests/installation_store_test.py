@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+from slack_sdk.oauth.installation_store.models.bot import Bot
+
+from app.installation_store import CachingInstallationStore, ThreadedInstallationStore
+
+
+class FakeInstallationStore:
+    logger = None
+
+    def __init__(self):
+        self.bots = {}
+        self.find_count = 0
+
+    def save_bot(self, bot):
+        self.bots[bot.team_id] = bot
+
+    def find_bot(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        self.find_count += 1
+        return self.bots.get(team_id)
+
+    def delete_bot(self, *, enterprise_id, team_id):
+        self.bots.pop(team_id, None)
+
+    async def async_find_bot(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        return self.find_bot(enterprise_id=enterprise_id, team_id=team_id)
+
+
+def new_bot(team_id):
+    return Bot(team_id=team_id, bot_token="xoxb-1", bot_id="B1", bot_user_id="U1", installed_at=1.0)
+
+
+def test_lookups_are_cached_and_invalidated():
+    underlying = FakeInstallationStore()
+    store = CachingInstallationStore(underlying, ttl_seconds=60, negative_ttl_seconds=60, max_size=10)
+
+    assert store.find_bot(enterprise_id=None, team_id="T1") is None
+    assert store.find_bot(enterprise_id=None, team_id="T1") is None
+    assert underlying.find_count == 1  # the miss is cached too
+
+    store.save_bot(new_bot("T1"))
+    assert store.find_bot(enterprise_id=None, team_id="T1").bot_token == "xoxb-1"
+    assert asyncio.run(store.async_find_bot(enterprise_id=None, team_id="T1")).bot_token == "xoxb-1"
+    assert underlying.find_count == 2
+
+    store.delete_bot(enterprise_id=None, team_id="T1")
+    assert store.find_bot(enterprise_id=None, team_id="T1") is None
+    assert underlying.find_count == 3
+
+
+def test_misses_expire_sooner():
+    underlying = FakeInstallationStore()
+    store = CachingInstallationStore(underlying, ttl_seconds=60, negative_ttl_seconds=0.01, max_size=10)
+    assert store.find_bot(enterprise_id=None, team_id="T1") is None
+    underlying.bots["T1"] = new_bot("T1")  # installed through another node
+    asyncio.run(asyncio.sleep(0.02))
+    assert store.find_bot(enterprise_id=None, team_id="T1") is not None
+
+
+def test_threaded_store_runs_lookups_off_the_event_loop():
+    underlying = FakeInstallationStore()
+    underlying.save_bot(new_bot("T1"))
+    lookup_threads = []
+    find_bot = underlying.find_bot
+
+    def recording_find_bot(**kwargs):
+        lookup_threads.append(threading.get_ident())
+        return find_bot(**kwargs)
+
+    underlying.find_bot = recording_find_bot
+    store = CachingInstallationStore(ThreadedInstallationStore(underlying), ttl_seconds=60)
+
+    async def main():
+        return threading.get_ident(), await store.async_find_bot(enterprise_id=None, team_id="T1")
+
+    loop_thread, bot = asyncio.run(main())
+    assert bot.bot_token == "xoxb-1"
+    assert lookup_threads and lookup_threads[0] != loop_thread
@@ -0,0 +1,53 @@
+import io
+import json
+import logging
+
+import pytest
+
+from app.log_config import configure_logging, stop_logging, truncate
+from app.tracing import start_span
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_truncate():
+    assert truncate("abc", 5) == "abc"
+    assert truncate("x" * 10, 4) == "xxxx... (6 more characters)"
+    assert truncate({"a": 1}, 0) == "{'a': 1}"
+
+
+def test_queued_records_are_truncated_and_written(root_logger):
+    stream = io.StringIO()
+    configure_logging(logging.INFO, fmt="%(levelname)s %(message)s", log_format="text", use_queue=True, stream=stream)
+    logger = logging.getLogger("log_config_test")
+    logger.debug("not written")
+    logger.info("chart=%s", "A" * 5000)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("failed")
+    stop_logging()
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == f"INFO chart={'A' * 1994}... (3006 more characters)"
+    assert lines[1] == "ERROR failed"
+    assert lines[-1] == "ValueError: boom"
+
+
+def test_json_format_has_trace_id(root_logger):
+    stream = io.StringIO()
+    configure_logging(logging.INFO, log_format="json", use_queue=False, stream=stream)
+    with start_span("question") as span:
+        logging.getLogger("log_config_test").info("hello")
+    entry = json.loads(stream.getvalue())
+    assert entry["level"] == "INFO"
+    assert entry["message"] == "hello"
+    assert entry["trace_id"] == span.trace_id
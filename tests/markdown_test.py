@@ -122,3 +122,16 @@ else:
     ]:
         result = slack_to_markdown(content)
         assert result == expected
+
+
+def test_incremental_converter():
+    from app.markdown import IncrementalConverter
+
+    content = "Some **bold** text\n```\nkeep **this**\n```\nand ~~strike~~ `**code**`\n"
+    for chunk_size in (1, 3, 7):
+        converter = IncrementalConverter(markdown_to_slack)
+        committed = []
+        for i in range(0, len(content), chunk_size):
+            committed.append(converter.append(content[i:i + chunk_size]))
+            assert converter.text() == markdown_to_slack(content[:i + chunk_size])
+        assert "".join(committed) + converter.text()[len("".join(committed)):] == markdown_to_slack(content)
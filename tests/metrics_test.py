@@ -0,0 +1,49 @@
+from app.executor import command_name
+from app.metrics import Counter, Gauge, Histogram, Registry, render_metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("stage_seconds", "Stage duration.", ["stage"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="config_load")
+    histogram.observe(0.5, stage="config_load")
+    histogram.observe(5, stage="config_load")
+    assert histogram.count(stage="config_load") == 3
+    assert histogram.samples() == [
+        'stage_seconds_bucket{stage="config_load",le="0.1"} 1',
+        'stage_seconds_bucket{stage="config_load",le="1.0"} 2',
+        'stage_seconds_bucket{stage="config_load",le="+Inf"} 3',
+        'stage_seconds_sum{stage="config_load"} 5.55',
+        'stage_seconds_count{stage="config_load"} 3',
+    ]
+
+
+def test_registry_renders_text_exposition():
+    registry = Registry()
+    counter = registry.register(Counter("commands_total", "Commands.", ["command"]))
+    gauge = registry.register(Gauge("queue_size", "Queued tasks.", ["queue"]))
+    counter.inc(command="set_db_url")
+    counter.inc(command="set_db_url")
+    counter.inc(command='say "hi"')
+    gauge.set_function(lambda: 3, queue="commands")
+    gauge.set_function(lambda: 1 / 0, queue="broken")
+    assert counter.value(command="set_db_url") == 2
+    assert registry.render() == (
+        "# HELP commands_total Commands.\n"
+        "# TYPE commands_total counter\n"
+        'commands_total{command="set_db_url"} 2\n'
+        'commands_total{command="say \\"hi\\""} 1\n'
+        "# HELP queue_size Queued tasks.\n"
+        "# TYPE queue_size gauge\n"
+        'queue_size{queue="commands"} 3\n'
+    )
+
+
+def test_app_metrics():
+    def handle_set_db_table_func():
+        pass
+
+    assert command_name(handle_set_db_table_func) == "set_db_table"
+    text = render_metrics()
+    assert "# TYPE genie_stage_duration_seconds histogram" in text
+    assert 'genie_queue_size{queue="command_executor"} ' in text
+    assert "python_threads " in text
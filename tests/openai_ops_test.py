@@ -1,9 +1,39 @@
+import pytest
+import tiktoken
+
+from app import openai_ops
 from app.openai_ops import (
     format_assistant_reply,
     format_openai_message_content,
+    calculate_num_tokens,
 )
 
 
+class FakeEncoding:
+    name = "fake"
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return text.split()
+
+
+@pytest.fixture
+def fake_encoding(monkeypatch):
+    encoding = FakeEncoding()
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: encoding)
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: encoding)
+    for cached in (openai_ops.get_encoding, openai_ops.token_count_params):
+        cached.cache_clear()
+    openai_ops.clear_token_count_cache()
+    yield encoding
+    for cached in (openai_ops.get_encoding, openai_ops.token_count_params):
+        cached.cache_clear()
+    openai_ops.clear_token_count_cache()
+
+
 def test_format_assistant_reply():
     for content, expected in [
         (
@@ -64,3 +94,65 @@ int main(int argc, char *argv[])
     ]:
         result = format_openai_message_content(content, False)
         assert result == expected
+
+
+def test_calculate_num_tokens_memoizes_encodes(fake_encoding):
+    messages = [
+        {"role": "system", "content": "You are a bot"},
+        {"role": "user", "content": "hello there", "name": "bob"},
+    ]
+    # (4 + 1 + 4) + (4 + 1 + 2 + 1 - 1) + 3
+    assert calculate_num_tokens(messages, "gpt-3.5-turbo") == 19
+    encoded = len(fake_encoding.encoded)
+    assert calculate_num_tokens(messages, "gpt-3.5-turbo-0613") == 19
+    assert len(fake_encoding.encoded) == encoded
+
+
+def test_messages_within_context_window_matches_one_by_one_trimming(fake_encoding):
+    from app.openai_ops import messages_within_context_window, context_length, MAX_TOKENS
+
+    max_context_tokens = context_length("gpt-3.5-turbo") - MAX_TOKENS - 1
+    messages = [{"role": "system", "content": "rules " * 10}]
+    for i in range(300):
+        messages.append({"role": "user" if i % 2 else "assistant", "content": f"message {i} " + "word " * 20})
+    messages.append({"role": "system", "content": "late system note"})
+
+    expected = [dict(m) for m in messages]
+    expected_context_tokens = 0
+    while (num_tokens := calculate_num_tokens(expected)) > max_context_tokens:
+        i = next(i for i, m in enumerate(expected) if m["role"] in ("user", "assistant"))
+        expected_context_tokens = num_tokens
+        del expected[i]
+
+    trimmed, num_context_tokens, max_tokens = messages_within_context_window(messages, "gpt-3.5-turbo")
+    assert trimmed is messages
+    assert trimmed == expected
+    assert num_context_tokens == expected_context_tokens
+    assert max_tokens == max_context_tokens
+    assert trimmed[0]["role"] == "system" and trimmed[-1]["content"] == "late system note"
+
+
+def test_assistant_reply_formatter_matches_format_assistant_reply():
+    from app.openai_ops import AssistantReplyFormatter
+
+    reply = "\n\n<@U123>: Here you go:\n```python\nprint('foo')\n```\nand\n```  sql\nSELECT 1\n```\n"
+    for chunk_size in (1, 2, 3, 5, 8):
+        formatter = AssistantReplyFormatter(False)
+        for i in range(0, len(reply), chunk_size):
+            formatter.append(reply[i:i + chunk_size])
+            assert formatter.text() == format_assistant_reply(reply[:i + chunk_size], False)
+    assert formatter.text() == "Here you go:\n```\nprint('foo')\n```\nand\n```\nSELECT 1\n```\n"
+
+
+def test_unsupported_models_fall_back_to_a_default_budget_and_encoding(fake_encoding):
+    from app.bolt_listeners import dm_history_token_budget, dm_message_num_tokens
+    from app.openai_ops import FALLBACK_CONTEXT_LENGTH, MAX_TOKENS, context_length
+
+    with pytest.raises(NotImplementedError):
+        context_length("gpt-4o")
+    assert dm_history_token_budget({"OPENAI_MODEL": "gpt-4o"}) == FALLBACK_CONTEXT_LENGTH - MAX_TOKENS
+    # 3 per message + "user" + "hello there"
+    assert dm_message_num_tokens({"OPENAI_MODEL": "gpt-4o"})({"text": "hello there"}) == 6
+    # The workspace model wins over OPENAI_MODEL
+    assert dm_history_token_budget({"OPENAI_MODEL": "gpt-3.5-turbo-16k"}) == 16384 - MAX_TOKENS
+    assert dm_message_num_tokens({"OPENAI_MODEL": "gpt-3.5-turbo"})({"text": "hello there"}) == 7
@@ -0,0 +1,27 @@
+import time
+
+from app.polling import BackoffSchedule, server_push_mode
+
+
+def test_backoff_schedule_delays():
+    schedule = BackoffSchedule(initial_delay=0.25, max_delay=10, max_wait=60, jitter=0.2)
+    delays = [schedule.delay(attempt) for attempt in range(10)]
+    assert 0.2 <= delays[0] <= 0.3
+    assert 0.4 <= delays[1] <= 0.6
+    assert all(d <= 10 for d in delays)
+    assert delays[-1] >= 8
+
+
+def test_backoff_schedule_stops_at_max_wait():
+    schedule = BackoffSchedule(initial_delay=0.01, max_delay=0.01, max_wait=0.05, jitter=0)
+    count = 0
+    for delay in schedule:
+        time.sleep(delay)
+        count += 1
+    assert 1 <= count <= 6
+
+
+def test_server_push_mode():
+    assert server_push_mode({"chat_history_id": 1}) is None
+    assert server_push_mode({"push": {"mode": "websocket"}}) is None
+    assert server_push_mode({"push": {"mode": "sse", "endpoint": "/x"}}) == {"mode": "sse", "endpoint": "/x"}
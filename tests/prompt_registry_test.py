@@ -0,0 +1,62 @@
+import json
+from collections import OrderedDict
+
+from app import prompt_registry
+from app.metrics import PROMPT_REF_MISSES
+from app.prompt_registry import prompt_metadata_payload, metadata_system_messages, prompt_ref, SQLitePromptStore
+from app.slack_ops import wip_message_metadata
+
+
+def test_metadata_size_does_not_grow_with_the_prompt():
+    short = wip_message_metadata([{"role": "system", "content": "short"}], "U1")
+    long = wip_message_metadata([{"role": "system", "content": "long " * 1000}, {"role": "user", "content": "hi"}], "U1")
+    assert len(json.dumps(short)) == len(json.dumps(long))
+
+
+def test_system_messages_are_resolved_from_metadata():
+    messages = [{"role": "system", "content": "You are a bot"}, {"role": "user", "content": "hi"}]
+    payload = prompt_metadata_payload(messages, "U1")
+    assert payload["prompt_refs"] == [prompt_ref("You are a bot")]
+    assert metadata_system_messages(payload, "default") == [{"role": "system", "content": "You are a bot"}]
+
+    # Unknown refs (e.g. after a restart) fall back to the current system text
+    assert metadata_system_messages({"prompt_refs": ["0:unknown"]}, "default") == [
+        {"role": "system", "content": "default"}
+    ]
+    # Replies posted before prompt refs keep working
+    legacy = {"messages": [{"role": "system", "content": "old"}]}
+    assert metadata_system_messages(legacy, "default") == [{"role": "system", "content": "old"}]
+    assert metadata_system_messages({"user": "U1"}, "default") is None
+
+
+def test_unresolved_refs_are_counted():
+    misses = PROMPT_REF_MISSES.value()
+    assert metadata_system_messages({"prompt_refs": ["0:missing"]}, "default") == [
+        {"role": "system", "content": "default"}
+    ]
+    assert PROMPT_REF_MISSES.value() == misses + 1
+
+
+def test_sqlite_registry_survives_a_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt_registry, "PROMPT_REGISTRY_BACKEND", "sqlite")
+    monkeypatch.setattr(prompt_registry, "_prompt_store", SQLitePromptStore(str(tmp_path / "prompts.sqlite3")))
+    ref = prompt_ref("You are a durable bot")
+    # A new process: nothing in memory, a fresh connection to the same file
+    monkeypatch.setattr(prompt_registry, "_prompts", OrderedDict())
+    monkeypatch.setattr(prompt_registry, "_prompt_store", SQLitePromptStore(str(tmp_path / "prompts.sqlite3")))
+    assert metadata_system_messages({"prompt_refs": [ref]}, "default") == [
+        {"role": "system", "content": "You are a durable bot"}
+    ]
+
+
+def test_in_memory_sqlite_registry_is_shared_by_threads(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(prompt_registry, "PROMPT_REGISTRY_BACKEND", "sqlite")
+    monkeypatch.setattr(prompt_registry, "_prompt_store", SQLitePromptStore(":memory:"))
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ref = executor.submit(prompt_ref, "You are a threaded bot").result()
+    monkeypatch.setattr(prompt_registry, "_prompts", OrderedDict())
+    assert metadata_system_messages({"prompt_refs": [ref]}, "default") == [
+        {"role": "system", "content": "You are a threaded bot"}
+    ]
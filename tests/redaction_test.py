@@ -0,0 +1,55 @@
+import re
+
+from app.redaction import REDACTION_RULES, Redactor, MessageRedactionMemo
+from app.utils import redact_config
+
+
+def sequential_redact(text: str) -> str:
+    for _, pattern, replacement in REDACTION_RULES:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+def test_compiled_redaction_matches_sequential_re_sub():
+    redactor = Redactor()
+    for text in [
+        "Mail me at jane.doe@example.com or call (555) 123-4567.",
+        "Card 1234 5678 9012 3456, SSN 123-45-6789, phone 555.123.4567",
+        "Nothing to hide here, just 12 apples",
+        "",
+        # The phone number ends inside the SSN-like digits; the SSN rule must still see them
+        "9012456756785678555-",
+    ]:
+        assert redactor.redact(text) == sequential_redact(text)
+    assert redactor.redact("9012456756785678555-") == "[SSN][PHONE]-"
+
+
+def test_patterns_with_groups():
+    redactor = Redactor([("secret", r"(sk)-\w+", "[KEY]"), ("pin", r"\b(\d)\1{3}\b", "[PIN]")])
+    assert redactor.redact("sk-abc 1111 1234") == "[KEY] [PIN] 1234"
+
+
+def test_message_redaction_is_remembered_by_ts():
+    class CountingRedactor(Redactor):
+        calls = 0
+
+        def redact(self, text):
+            CountingRedactor.calls += 1
+            return super().redact(text)
+
+    memo = MessageRedactionMemo(CountingRedactor(), max_size=10)
+    assert memo.redact("1.0", "a@example.com") == "[EMAIL]"
+    assert memo.redact("1.0", "a@example.com") == "[EMAIL]"
+    assert CountingRedactor.calls == 1
+    assert memo.redact("1.0", "edited: 555-123-4567") == "edited: [PHONE]"
+    assert CountingRedactor.calls == 2
+
+
+def test_redact_config():
+    config = {"api_key": "secret", "db_url": "postgres://user:pw@db:5432/app", "db_table": "t"}
+    assert redact_config(config) == {
+        "api_key": "REDACTED",
+        "db_url": "postgres://REDACTED:REDACTED@db:5432/app",
+        "db_table": "t",
+    }
+    assert config["api_key"] == "secret"
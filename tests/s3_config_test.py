@@ -0,0 +1,222 @@
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from app import s3_config
+from app.s3_config import ConfigCache, MISSING
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3Client:
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    def __init__(self, objects: dict):
+        self.objects = objects
+        self.get_count = 0
+
+    def get_object(self, Bucket, Key):
+        self.get_count += 1
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key].encode("utf-8"))}
+
+
+def test_config_cache_lru_and_ttl():
+    cache = ConfigCache(max_size=2, ttl_seconds=0.05)
+    assert cache.get("a") is MISSING
+    cache.set("a", "1")
+    cache.set("b", None)
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    cache.set("c", "3")  # evicts "a", the least recently used entry
+    assert cache.get("a") is MISSING
+    assert cache.get("b") is None
+    time.sleep(0.06)
+    assert cache.get("c") is MISSING
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 3
+    assert stats["evictions"] == 1
+
+
+def test_load_s3_config():
+    s3_config.config_cache.clear()
+    client = FakeS3Client({"T1": '{"api_key": "x"}'})
+    for _ in range(3):
+        assert s3_config.load_s3_config(client, "bucket", "T1") == '{"api_key": "x"}'
+        assert s3_config.load_s3_config(client, "bucket", "T1_U1") is None
+    assert client.get_count == 2
+
+    s3_config.invalidate_s3_config("T1")
+    s3_config.load_s3_config(client, "bucket", "T1")
+    assert client.get_count == 3
+
+
+class FakeConditionalS3Client(FakeS3Client):
+    class meta:
+        class service_model:
+            @staticmethod
+            def operation_model(name):
+                class input_shape:
+                    members = {"Bucket": None, "Key": None, "Body": None, "IfMatch": None, "IfNoneMatch": None}
+
+                return type("OperationModel", (), {"input_shape": input_shape})
+
+    def __init__(self, objects: dict, concurrent_write=None):
+        super().__init__(objects)
+        self.versions = {key: 1 for key in objects}
+        self.concurrent_write = concurrent_write
+        self.put_count = 0
+
+    def get_object(self, Bucket, Key):
+        response = super().get_object(Bucket, Key)
+        response["ETag"] = f'"{self.versions[Key]}"'
+        return response
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None):
+        self.put_count += 1
+        if self.concurrent_write is not None:
+            # Another writer changes the object between our read and our put
+            concurrent_key, concurrent_body = self.concurrent_write
+            self.concurrent_write = None
+            self.objects[concurrent_key] = concurrent_body
+            self.versions[concurrent_key] = self.versions.get(concurrent_key, 0) + 1
+        exists = Key in self.objects
+        if (IfMatch is not None and (not exists or IfMatch != f'"{self.versions[Key]}"')) or (
+                IfNoneMatch == "*" and exists):
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        self.objects[Key] = Body
+        self.versions[Key] = self.versions.get(Key, 0) + 1
+
+
+def test_update_s3_config_applies_all_changes_at_once():
+    s3_config.config_cache.clear()
+    client = FakeConditionalS3Client({"T1_U1": '{"db_url": "old", "debug": "true"}'})
+    data = s3_config.update_s3_config(client, "bucket", "T1_U1", {"db_url": "new", "db_schema": ""})
+    assert data == {"db_url": "new", "debug": "true", "db_schema": ""}
+    assert client.put_count == 1
+    assert json.loads(s3_config.load_s3_config(client, "bucket", "T1_U1")) == data
+    assert client.get_count == 1  # the cache holds what was just written
+
+
+def test_update_s3_config_retries_on_conflict():
+    s3_config.config_cache.clear()
+    client = FakeConditionalS3Client({"T1_U1": '{"db_url": "old"}'},
+                                     concurrent_write=("T1_U1", '{"db_url": "old", "debug": "true"}'))
+    data = s3_config.update_s3_config(client, "bucket", "T1_U1", {"db_url": "new"})
+    assert data == {"db_url": "new", "debug": "true"}
+    assert client.put_count == 2
+
+
+def test_coalescer_merges_concurrent_changes():
+    s3_config.config_cache.clear()
+    client = FakeConditionalS3Client({})
+    coalescer = s3_config.ConfigWriteCoalescer(window_seconds=0.1)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            executor.submit(coalescer.update, client, "bucket", "T1_U1", {key: "v"})
+            for key in ("db_url", "db_table", "db_warehouse")
+        ]
+        results = [f.result() for f in futures]
+    assert client.put_count == 1
+    assert results[0] == {"db_url": "v", "db_table": "v", "db_warehouse": "v"}
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """Just enough of S3 over HTTP for GetObject and conditional PutObject."""
+
+    # HTTP/1.1 answers botocore's "Expect: 100-continue" on puts instead of letting it time out
+    protocol_version = "HTTP/1.1"
+    objects: dict = {}
+    versions: dict = {}
+    put_headers: list = []
+    # (key, body) written by "another node" between our first read and our first put
+    concurrent_write = None
+
+    def log_message(self, *args):
+        pass
+
+    def _key(self):
+        return self.path.split("?")[0].split("/", 2)[2]
+
+    def _error(self, status, code):
+        body = f"<Error><Code>{code}</Code><Message>{code}</Message></Error>".encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        key = self._key()
+        if key not in self.objects:
+            return self._error(404, "NoSuchKey")
+        body = self.objects[key].encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", f'"{self.versions[key]}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        key = self._key()
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        if_match, if_none_match = self.headers.get("If-Match"), self.headers.get("If-None-Match")
+        FakeS3Handler.put_headers.append((if_match, if_none_match))
+        if FakeS3Handler.concurrent_write is not None:
+            concurrent_key, concurrent_body = FakeS3Handler.concurrent_write
+            FakeS3Handler.concurrent_write = None
+            self.objects[concurrent_key] = concurrent_body
+            self.versions[concurrent_key] = self.versions.get(concurrent_key, 0) + 1
+        exists = key in self.objects
+        if (if_match is not None and (not exists or if_match != f'"{self.versions[key]}"')) or (
+                if_none_match == "*" and exists):
+            return self._error(412, "PreconditionFailed")
+        self.objects[key] = body
+        self.versions[key] = self.versions.get(key, 0) + 1
+        self.send_response(200)
+        self.send_header("ETag", f'"{self.versions[key]}"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_update_s3_config_sends_conditions_with_pinned_botocore():
+    FakeS3Handler.objects = {"T1_U1": '{"db_url": "old"}'}
+    FakeS3Handler.versions = {"T1_U1": 1}
+    FakeS3Handler.put_headers = []
+    FakeS3Handler.concurrent_write = ("T1_U1", '{"db_url": "old", "debug": "true"}')
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = boto3.client(
+            "s3",
+            endpoint_url=f"http://127.0.0.1:{server.server_port}",
+            region_name="us-east-1",
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+            config=Config(s3={"addressing_style": "path"}, retries={"max_attempts": 0}),
+        )
+        s3_config.config_cache.clear()
+        data = s3_config.update_s3_config(client, "bucket", "T1_U1", {"db_url": "new"})
+        # The first put lost the race and was retried on top of the concurrent change
+        assert data == {"db_url": "new", "debug": "true"}
+        assert FakeS3Handler.put_headers == [('"1"', None), ('"2"', None)]
+        assert json.loads(FakeS3Handler.objects["T1_U1"]) == data
+
+        data = s3_config.update_s3_config(client, "bucket", "T2", {"api_key": "x"})
+        assert data == {"api_key": "x"}
+        assert FakeS3Handler.put_headers[-1] == (None, "*")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,120 @@
+from app.slack_history import (
+    ThreadHistoryCache,
+    ParentMentionMemo,
+    fetch_thread_messages,
+    iter_dm_history,
+    take_within_budget,
+)
+
+
+class FakeClient:
+    def __init__(self, thread):
+        self.thread = thread
+        self.calls = []
+
+    def conversations_replies(self, **params):
+        self.calls.append(params)
+        oldest = float(params.get("oldest", 0))
+        messages = [m for m in self.thread if m is self.thread[0] or float(m["ts"]) >= oldest]
+        return {"messages": [dict(m) for m in messages]}
+
+
+def test_only_new_replies_are_fetched():
+    thread = [
+        {"ts": "1.0", "text": "<@UBOT> hi", "user": "U1"},
+        {"ts": "2.0", "text": "hello", "user": "U2"},
+    ]
+    client = FakeClient(thread)
+    cache = ThreadHistoryCache(max_threads=10, max_messages=100)
+
+    messages = fetch_thread_messages(client, "C1", "1.0", cache=cache)
+    assert [m["ts"] for m in messages] == ["1.0", "2.0"]
+    assert "oldest" not in client.calls[0]
+
+    new_message = {"ts": "3.0", "text": "again", "user": "U1", "thread_ts": "1.0"}
+    thread.append(new_message)
+    messages = fetch_thread_messages(client, "C1", "1.0", latest_message=new_message, cache=cache)
+    assert [m["ts"] for m in messages] == ["1.0", "2.0", "3.0"]
+    assert client.calls[1]["oldest"] == "2.0"
+
+
+def test_bot_replies_are_refetched_and_events_applied():
+    thread = [
+        {"ts": "1.0", "text": "hi", "user": "U1"},
+        {"ts": "2.0", "text": "...", "user": "UBOT", "bot_id": "B1"},
+        {"ts": "3.0", "text": "thanks", "user": "U1"},
+    ]
+    client = FakeClient(thread)
+    cache = ThreadHistoryCache(max_threads=10, max_messages=100)
+    fetch_thread_messages(client, "C1", "1.0", cache=cache)
+
+    thread[1]["text"] = "the full answer"
+    messages = fetch_thread_messages(client, "C1", "1.0", cache=cache)
+    assert client.calls[1]["oldest"] == "2.0"
+    assert messages[1]["text"] == "the full answer"
+
+    cache.apply_event({"channel": "C1", "subtype": "message_changed",
+                       "message": {"ts": "3.0", "thread_ts": "1.0", "text": "edited"}})
+    cache.apply_event({"channel": "C1", "subtype": "message_deleted",
+                       "previous_message": {"ts": "1.0", "thread_ts": "1.0"}})
+    messages = cache.store("C1", "1.0", [])
+    assert [(m["ts"], m["text"]) for m in messages] == [("2.0", "the full answer"), ("3.0", "edited")]
+
+
+def test_threads_are_evicted():
+    cache = ThreadHistoryCache(max_threads=2, max_messages=100)
+    for thread_ts in ("1.0", "2.0", "3.0"):
+        fetch_thread_messages(FakeClient([{"ts": thread_ts}]), "C1", thread_ts, cache=cache)
+    client = FakeClient([{"ts": "1.0"}])
+    fetch_thread_messages(client, "C1", "1.0", cache=cache)
+    assert "oldest" not in client.calls[0]
+
+
+def test_parent_mention_memo():
+    memo = ParentMentionMemo(max_size=2)
+    memo.put("C1", "1.0", True)
+    memo.put("C1", "2.0", False)
+    assert memo.get("C1", "1.0") is True
+    assert memo.get("C1", "2.0") is False
+
+    memo.apply_event({"channel": "C1", "subtype": "message_changed", "message": {"ts": "2.0", "text": "edited"}})
+    assert memo.get("C1", "2.0") is None
+
+    memo.put("C1", "3.0", False)
+    memo.put("C1", "4.0", False)
+    assert memo.get("C1", "1.0") is None
+
+
+class FakeHistoryClient:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def conversations_history(self, **params):
+        self.calls.append(params)
+        index = int(params.get("cursor", 0))
+        has_more = index + 1 < len(self.pages)
+        return {
+            "messages": self.pages[index],
+            "has_more": has_more,
+            "response_metadata": {"next_cursor": str(index + 1) if has_more else ""},
+        }
+
+
+def test_dm_history_stops_once_the_budget_is_filled():
+    pages = [
+        [{"ts": "5.0", "text": "e"}, {"ts": "4.0", "text": "d"}],
+        [{"ts": "3.0", "text": "c"}, {"ts": "2.0", "text": "b"}],
+        [{"ts": "1.0", "text": "a"}],
+    ]
+    client = FakeHistoryClient(pages)
+    messages = take_within_budget(iter_dm_history(client, "D1", window_seconds=60, page_size=2), 3, lambda m: 1)
+    assert [m["ts"] for m in messages] == ["3.0", "4.0", "5.0"]
+    assert len(client.calls) == 2
+    assert client.calls[1]["cursor"] == "1"
+    assert float(client.calls[0]["oldest"]) > 0
+
+    client = FakeHistoryClient(pages)
+    messages = take_within_budget(iter_dm_history(client, "D1"), 100, lambda m: 1)
+    assert [m["ts"] for m in messages] == ["1.0", "2.0", "3.0", "4.0", "5.0"]
+    assert len(client.calls) == 3
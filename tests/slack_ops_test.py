@@ -0,0 +1,90 @@
+from app.slack_ops import split_attachment_posts
+
+
+def upload(filename):
+    return "files_upload_v2", {"channels": "C1", "thread_ts": "1.0", "content": b"x", "filename": filename}
+
+
+def message(text):
+    return "chat_postMessage", {"channel": "C1", "thread_ts": "1.0", "text": text}
+
+
+def test_split_attachment_posts_keeps_message_order():
+    posts = [message("answer"), message("sql"), upload("a.json"), upload("a.txt"), message("error")]
+    leading, uploads, trailing = split_attachment_posts(posts, batched=False)
+    assert [kwargs["text"] for _, kwargs in leading] == ["answer", "sql"]
+    assert [kwargs["filename"] for _, kwargs in uploads] == ["a.json", "a.txt"]
+    assert [kwargs["text"] for _, kwargs in trailing] == ["error"]
+
+
+def test_split_attachment_posts_batched():
+    _, uploads, _ = split_attachment_posts([upload("a.json"), upload("a.png")], batched=True)
+    assert len(uploads) == 1
+    method, kwargs = uploads[0]
+    assert method == "files_upload_v2"
+    assert kwargs["channel"] == "C1"
+    assert [f["filename"] for f in kwargs["file_uploads"]] == ["a.json", "a.png"]
+
+
+def test_resolve_upload_builds_lazy_content(monkeypatch):
+    import gzip
+    from app import slack_ops
+
+    monkeypatch.setattr(slack_ops, "SLACK_FILE_UPLOAD_GZIP_MIN_BYTES", 100)
+    small = slack_ops.resolve_upload({"content": lambda: slack_ops.json_artifact([{"a": 1}]), "filename": "1_data.json"})
+    assert small == {"content": b'[{"a":1}]', "filename": "1_data.json"}
+
+    big = slack_ops.resolve_upload({"content": lambda: b"x" * 200, "filename": "1_data.txt"})
+    assert big["filename"] == "1_data.txt.gz"
+    assert gzip.decompress(big["content"]) == b"x" * 200
+
+
+def test_async_call_slack_api_builds_files_off_the_event_loop():
+    import asyncio
+    import threading
+
+    from app.slack_ops import async_call_slack_api
+
+    build_threads = []
+
+    def build():
+        build_threads.append(threading.get_ident())
+        return b"data"
+
+    class FakeAsyncClient:
+        async def files_upload_v2(self, **kwargs):
+            return kwargs
+
+    async def main():
+        method, kwargs = upload("a.json")
+        response = await async_call_slack_api(FakeAsyncClient(), method, {**kwargs, "content": build})
+        return threading.get_ident(), response
+
+    loop_thread, response = asyncio.run(main())
+    assert response["content"] == b"data"
+    assert build_threads and build_threads[0] != loop_thread
+
+
+def test_submit_upload_counts_pending_uploads():
+    import threading
+    import time
+
+    from app.slack_ops import pending_uploads, submit_upload
+
+    release = threading.Event()
+
+    class FakeClient:
+        def files_upload_v2(self, **kwargs):
+            release.wait(5)
+            return kwargs
+
+    method, kwargs = upload("a.json")
+    future = submit_upload(FakeClient(), method, kwargs)
+    assert pending_uploads() == 1
+    release.set()
+    assert future.result()["filename"] == "a.json"
+    # The done callback may run just after result() returns
+    deadline = time.monotonic() + 5
+    while pending_uploads() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pending_uploads() == 0
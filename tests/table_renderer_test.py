@@ -0,0 +1,31 @@
+from app.table_renderer import render_text_table, render_csv, render_tsv, iter_table_lines
+
+
+def test_render_text_table():
+    rows = [{"id": 1, "name": "alpha"}, {"id": 22, "name": None}]
+    assert render_text_table(rows) == (
+        "```\n"
+        "| id | name  |\n"
+        "| 1  | alpha |\n"
+        "| 22 | None  |\n"
+        "```"
+    )
+    assert render_text_table([]) == "```No data available```"
+
+
+def test_render_text_table_truncates_rows_and_columns():
+    rows = [{"text": "x" * 20} for _ in range(5)]
+    lines = list(iter_table_lines(rows, max_rows=2, max_col_width=6))
+    assert lines == [
+        "| text   |\n",
+        "| xxxxx… |\n",
+        "| xxxxx… |\n",
+        "… 3 more rows not shown\n",
+    ]
+
+
+def test_render_csv_and_tsv():
+    rows = [{"a": 1, "b": "x,y"}, {"a": 2, "b": "z"}]
+    assert render_csv(rows) == 'a,b\n1,"x,y"\n2,z\n'
+    assert render_tsv(rows) == "a\tb\n1\tx,y\n2\tz\n"
+    assert render_csv([]) == ""
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+from app import tracing
+from app.genie_client import GenieApiClient
+from app.tracing import JsonLinesSpanExporter, current_span, start_span, traced
+
+
+def test_spans_export_as_json_lines(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    exporter = JsonLinesSpanExporter(str(path))
+    monkeypatch.setattr(tracing, "exporter", exporter)
+
+    @traced()
+    def fetch(endpoint):
+        tracing.set_attributes(endpoint=endpoint)
+        raise ValueError("boom")
+
+    with start_span("get_language_to_sql", team_id="T1") as root:
+        try:
+            fetch("/language_to_sql")
+        except ValueError:
+            pass
+    assert current_span() is None
+    exporter.close()
+
+    child, parent = [json.loads(line) for line in path.read_text().splitlines()]
+    assert parent["name"] == "get_language_to_sql"
+    assert parent["spanId"] == root.span_id
+    assert parent["parentSpanId"] == ""
+    assert parent["attributes"] == {"team_id": "T1"}
+    assert child["name"] == "fetch"
+    assert child["traceId"] == parent["traceId"]
+    assert child["parentSpanId"] == parent["spanId"]
+    assert child["attributes"] == {"endpoint": "/language_to_sql"}
+    assert child["status"] == {"code": "ERROR", "message": "ValueError: boom"}
+    assert child["startTimeUnixNano"] <= child["endTimeUnixNano"]
+
+
+def test_genie_client_sends_traceparent():
+    client = GenieApiClient(base_url="http://genie")
+    assert "traceparent" not in client.headers("key")
+    with start_span("question") as span:
+        headers = client.headers("key")
+    assert headers["traceparent"] == f"00-{span.trace_id}-{span.span_id}-01"
+
+
+def test_spans_follow_asyncio_tasks():
+    async def child(name):
+        with start_span(name) as span:
+            await asyncio.sleep(0)
+            return span
+
+    async def main():
+        with start_span("root") as root:
+            spans = await asyncio.gather(child("a"), child("b"))
+        return root, spans
+
+    root, spans = asyncio.run(main())
+    assert [span.parent_id for span in spans] == [root.span_id, root.span_id]
+    assert {span.trace_id for span in spans} == {root.trace_id}
+
+
+def test_exporter_writes_every_queued_span_on_close(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    exporter = JsonLinesSpanExporter(str(path))
+    for i in range(100):
+        span = tracing.Span(f"span{i}", "0" * 32, None, True, {})
+        span.end_ns = span.start_ns
+        exporter.export(span)
+    exporter.close()
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == [f"span{i}" for i in range(100)]
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+
+from app.update_scheduler import WipMessageUpdater, retry_after_seconds
+
+
+def rate_limited_error(retry_after="0.05"):
+    response = SlackResponse(
+        client=None, http_verb="POST", api_url="chat.update", req_args={},
+        data={"ok": False, "error": "ratelimited"}, headers={"Retry-After": retry_after}, status_code=429,
+    )
+    return SlackApiError("ratelimited", response)
+
+
+class FakeClient:
+    def __init__(self, delay=0.0, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.texts = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def chat_update(self, channel, ts, text, metadata):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if self.failures > 0:
+                self.failures -= 1
+                raise rate_limited_error()
+            self.texts.append(text)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def new_updater(client, **kwargs):
+    return WipMessageUpdater(client=client, channel="C111", ts="1.0", messages=[], user="U111", **kwargs)
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(rate_limited_error("3")) == 3.0
+
+
+def test_updates_are_coalesced_and_serialized():
+    client = FakeClient(delay=0.02)
+    updater = new_updater(client, min_interval=0.01, max_interval=0.1)
+    for i in range(200):
+        updater.submit(f"text {i}")
+        time.sleep(0.001)
+    updater.close("final")
+    assert client.max_active == 1
+    assert client.texts[-1] == "final"
+    assert len(client.texts) < 50
+    assert updater.coalesced > 0
+
+
+def test_rate_limited_update_is_retried_and_slows_down():
+    client = FakeClient(failures=1)
+    updater = new_updater(client, min_interval=0.01, max_interval=1.0)
+    updater.submit("first")
+    deadline = time.monotonic() + 2
+    while client.texts == [] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.texts == ["first"]
+    assert updater.rate_limited == 1
+    updater.close("final")
+    assert client.texts == ["first", "final"]